@@ -1,47 +1,19 @@
 # scripts/add_score_to_lessons.py
+# Thêm trường score (random 40 hoặc 60) cho lesson chưa có.
+# Chỉ 1 lệnh update_many với aggregation pipeline ($rand chạy trên server),
+# thay vì 1 update_one cho mỗi lesson. Logic nằm ở backfill_lesson_attributes.py.
 
-import random
-from pymongo import MongoClient
-from dotenv import load_dotenv
+import sys
 import os
 
-load_dotenv()
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-MONGODB_URI = os.getenv("MONGO_URI")
-DATABASE_NAME = os.getenv("DATABASE_NAME")
+from app.backfill_lesson_attributes import run
 
-client = MongoClient(MONGODB_URI)
-db = client[DATABASE_NAME]
-lessons = db.lessons
 
 def add_score_to_lessons():
-    """
-    Thêm trường score vào mỗi lesson nếu chưa có.
-    Score random 40 hoặc 60.
-    """
-
-    # Lấy tất cả lessons
-    docs = lessons.find({})
-
-    updated = 0
-    skipped = 0
-
-    for doc in docs:
-        if "score" in doc:
-            skipped += 1
-            continue
-
-        score = random.choice([40, 60])
-
-        lessons.update_one(
-            {"_id": doc["_id"]},
-            {"$set": {"score": score}}
-        )
-
-        updated += 1
-
-    print(f"✅ Done! Updated: {updated}, Skipped (already have score): {skipped}")
+    return run(["score"])
 
 
 if __name__ == "__main__":
-    add_score_to_lessons()
+    sys.exit(0 if add_score_to_lessons() else 1)
@@ -3,12 +3,13 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 
-from app.db import get_db
+from app.db import get_async_db
 from app.services.auth_service import (
     register_user,
     login_user,
     get_user_from_token
 )
+from app.services.password_hasher import PasswordHasherBusy
 
 router = APIRouter()
 security = HTTPBearer()
@@ -37,14 +38,14 @@ class MessageResponse(BaseModel):
 # Dependency để lấy current user từ token
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db = Depends(get_db)
+    db = Depends(get_async_db)
 ):
     """
     Dependency để verify token và lấy user hiện tại
     Sử dụng trong các protected routes
     """
     token = credentials.credentials
-    user = get_user_from_token(db, token)
+    user = await get_user_from_token(db, token)
     
     if not user:
         raise HTTPException(
@@ -54,16 +55,27 @@ async def get_current_user(
     
     return user
 
+def _busy() -> HTTPException:
+    # Hàng đợi bcrypt đầy: báo client thử lại thay vì xếp hàng vô hạn
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Hệ thống đang bận, vui lòng thử lại sau",
+        headers={"Retry-After": "1"}
+    )
+
 # Routes
 @router.post("/auth/register", response_model=MessageResponse, status_code=status.HTTP_201_CREATED)
-async def register(request: RegisterRequest, db = Depends(get_db)):
+async def register(request: RegisterRequest, db = Depends(get_async_db)):
     """API đăng ký user mới"""
-    success, message, user_data = register_user(
-        db,
-        request.email,
-        request.username,
-        request.password
-    )
+    try:
+        success, message, user_data = await register_user(
+            db,
+            request.email,
+            request.username,
+            request.password
+        )
+    except PasswordHasherBusy:
+        raise _busy()
     
     if not success:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=message)
@@ -75,13 +87,16 @@ async def register(request: RegisterRequest, db = Depends(get_db)):
     }
 
 @router.post("/auth/login", response_model=MessageResponse)
-async def login(request: LoginRequest, db = Depends(get_db)):
+async def login(request: LoginRequest, db = Depends(get_async_db)):
     """API đăng nhập"""
-    success, message, user_data = login_user(
-        db,
-        request.username,
-        request.password
-    )
+    try:
+        success, message, user_data = await login_user(
+            db,
+            request.username,
+            request.password
+        )
+    except PasswordHasherBusy:
+        raise _busy()
     
     if not success:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=message)
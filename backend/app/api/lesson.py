@@ -1,12 +1,44 @@
 # app/api/lesson.py
-from fastapi import APIRouter, Depends, HTTPException
-from app.db import get_db
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from pydantic import BaseModel, Field
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from app.db import get_lessons_collection
 from app.services.lesson_service import LessonService
+from app.services.lesson_catalog import lesson_catalog
+from app.services.lesson_search import lesson_search
+from app.services.metrics import stage_timer, AUDIO_CACHE
 from pathlib import Path
 import hashlib
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_SEARCH_RESULTS = 50
+MAX_BATCH_LESSONS = 20
+AUDIO_WORKERS = 4
+
+
+class LessonBatchRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_LESSONS, description="Danh sách lesson id")
+    lang: str = Field(default="en", description="Ngôn ngữ cho audio")
+    include_audio: bool = Field(default=True, description="Chuẩn bị audio cho từng lesson")
+
+
+def _list_etag(version: str, cursor: Optional[str], limit: int, skip: int) -> str:
+    """ETag cho 1 trang danh sách = catalog version + tham số trang"""
+    page_key = hashlib.md5(f"{cursor}|{limit}|{skip}".encode()).hexdigest()[:8]
+    return f'W/"{version}-{page_key}"'
+
+
+def get_lesson_service(lessons_col = Depends(get_lessons_collection)) -> LessonService:
+    """LessonService đọc từ in-memory catalog (fallback Mongo nếu chưa nạp)"""
+    return LessonService(lessons_col, catalog=lesson_catalog, search=lesson_search)
+
 def get_or_create_audio(story_text: str, lesson_id: str, lang: str = "en") -> str:
     """
     Tạo hoặc lấy file audio đã có cho story.
@@ -23,27 +55,56 @@ def get_or_create_audio(story_text: str, lesson_id: str, lang: str = "en") -> st
     
     # Nếu file đã tồn tại, trả về URL
     if audio_path.exists():
-        print(f"✅ Using cached audio: {filename}")
+        AUDIO_CACHE.inc(1, "hit")
+        logger.debug("Using cached audio: %s", filename)
         return f"/temp_tts/{filename}"
     
     # Tạo audio mới với gTTS
+    AUDIO_CACHE.inc(1, "miss")
     try:
-        print(f"🎵 Generating audio for lesson {lesson_id}...")
+        logger.info("Generating audio for lesson %s", lesson_id)
         from gtts import gTTS
-        tts = gTTS(text=story_text, lang=lang)
-        tts.save(str(audio_path))
-        print(f"✅ Audio generated: {filename}")
+        with stage_timer("audio_generate"):
+            tts = gTTS(text=story_text, lang=lang)
+            tts.save(str(audio_path))
+        logger.info("Audio generated: %s", filename)
         return f"/temp_tts/{filename}"
     except Exception as e:
-        print(f"❌ Error generating audio: {e}")
+        logger.exception("Error generating audio for lesson %s", lesson_id)
         return None
 
 
+@router.get("/lessons/search")
+def search_lessons(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS),
+    svc: LessonService = Depends(get_lesson_service),
+):
+    """
+    Tìm lesson theo từ khóa (story, câu hỏi, đáp án)
+    Query params:
+        - q: từ khóa; từ cuối cùng được match theo prefix
+        - limit: số kết quả tối đa
+    """
+    results = svc.search_lessons_by_keyword(q, limit)
+    return {
+        "query": q,
+        "results": [
+            {
+                "id": doc["id"],
+                "story_preview": doc.get("story_preview"),
+                "score": doc.get("score"),
+                "relevance": doc.get("relevance"),
+            }
+            for doc in results
+        ],
+        "count": len(results),
+    }
+
+
 @router.get("/lessons/{lesson_id}/story")
-def get_lesson_story(lesson_id: str, db = Depends(get_db)):
+def get_lesson_story(lesson_id: str, svc: LessonService = Depends(get_lesson_service)):
     """Lấy story của lesson (original story)"""
-    collection = db["lessons"]
-    svc = LessonService(collection)
     # Always use original story (use_short=False)
     story = svc.get_story(lesson_id)
     if story is None:
@@ -52,13 +113,12 @@ def get_lesson_story(lesson_id: str, db = Depends(get_db)):
 
 
 @router.get("/lessons/{lesson_id}")
-def get_full_lesson(lesson_id: str, lang: str = "en", db = Depends(get_db)):
+def get_full_lesson(lesson_id: str, lang: str = "en", svc: LessonService = Depends(get_lesson_service)):
     """
     Lấy toàn bộ lesson bao gồm story, questions và audio URL.
     Query params:
         - lang: ngôn ngữ cho audio (en, vi, etc.)
     """
-    svc = LessonService(db["lessons"])
     # Get lesson với original story (use_short=False)
     doc = svc.get_full_lesson(lesson_id)
     
@@ -73,10 +133,10 @@ def get_full_lesson(lesson_id: str, lang: str = "en", db = Depends(get_db)):
     if story and story.strip():
         audio_url = get_or_create_audio(story, lesson_id, lang)
         if not audio_url:
-            print(f"⚠️ Failed to generate audio for lesson {lesson_id}")
+            logger.warning("Failed to generate audio for lesson %s", lesson_id)
     
-    # Lấy questions với correct answer
-    questions = svc.get_questions_with_correct_answer_text(lesson_id)
+    # Lấy questions với correct answer (dùng luôn doc đã lấy, không query lại)
+    questions = svc.add_correct_answer_text(svc.normalize_questions(doc.get("questions", [])))
     
     # Trả về data đơn giản
     return {
@@ -88,51 +148,128 @@ def get_full_lesson(lesson_id: str, lang: str = "en", db = Depends(get_db)):
 
 
 @router.get("/lessons/{lesson_id}/questions")
-def get_questions(lesson_id: str, db = Depends(get_db)):
+def get_questions(lesson_id: str, svc: LessonService = Depends(get_lesson_service)):
     """Lấy danh sách questions của lesson"""
-    svc = LessonService(db["lessons"])
     qs = svc.get_questions_with_correct_answer_text(lesson_id)
     return {"id": lesson_id, "questions": qs}
 
 
+@router.post("/lessons/batch")
+def get_lessons_batch(data: LessonBatchRequest, svc: LessonService = Depends(get_lesson_service)):
+    """
+    Lấy nhiều lesson trong 1 request (dùng để prefetch các bài tiếp theo).
+    Body:
+        - ids: danh sách lesson id (tối đa MAX_BATCH_LESSONS)
+        - lang: ngôn ngữ cho audio
+        - include_audio: có chuẩn bị audio hay không
+    """
+    ids = list(dict.fromkeys(data.ids))  # bỏ trùng, giữ thứ tự
+    docs = svc.get_lessons_bulk(ids)
+
+    # Kiểm tra / tạo audio song song (gTTS là network I/O)
+    audio_urls = {}
+    if data.include_audio:
+        jobs = {
+            lesson_id: doc.get("story", "")
+            for lesson_id, doc in docs.items()
+            if doc.get("story", "").strip()
+        }
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(AUDIO_WORKERS, len(jobs))) as pool:
+                futures = {
+                    lesson_id: pool.submit(get_or_create_audio, story, lesson_id, data.lang)
+                    for lesson_id, story in jobs.items()
+                }
+                audio_urls = {lesson_id: fut.result() for lesson_id, fut in futures.items()}
+
+    lessons = []
+    for lesson_id in ids:
+        doc = docs.get(lesson_id)
+        if not doc:
+            continue
+        lessons.append({
+            "id": doc.get("id", lesson_id),
+            "story": doc.get("story", ""),
+            "audio_url": audio_urls.get(lesson_id),
+            "questions": svc.add_correct_answer_text(doc.get("questions", [])),
+        })
+
+    return {
+        "lessons": lessons,
+        "count": len(lessons),
+        "not_found": [lesson_id for lesson_id in ids if lesson_id not in docs],
+    }
+
+
 @router.get("/lessons")
-def list_lessons(skip: int = 0, db = Depends(get_db)):
+def list_lessons(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1),
+    skip: int = 0,
+    lessons_col = Depends(get_lessons_collection),
+):
     """
-    Lấy danh sách tất cả lessons
+    Lấy danh sách lessons (keyset pagination theo id)
     Query params:
-        - skip: bỏ qua bao nhiêu lessons (for pagination)
+        - cursor: id của lesson cuối trang trước (lấy từ `next_cursor`)
+        - limit: số lessons mỗi trang (tối đa MAX_PAGE_SIZE)
+        - skip: (deprecated) chỉ dùng khi không có cursor
+
+    Response có ETag theo catalog version: client gửi If-None-Match
+    sẽ nhận 304 nếu danh sách không đổi.
     """
-    # Sort by id to ensure consistent order
-    cursor = db["lessons"].find({}, {
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    if lesson_catalog.is_loaded:
+        etag = _list_etag(lesson_catalog.version, cursor, limit, skip)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+        if cursor is None and skip:
+            # Đổi skip sang cursor để vẫn dùng keyset
+            records = lesson_catalog.records()
+            if records:
+                cursor = records[min(skip, len(records)) - 1].id
+        page, next_cursor = lesson_catalog.page_after(cursor, limit)
+
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        return {
+            "lessons": [{"id": rec.id} for rec in page],
+            "count": len(page),
+            "next_cursor": next_cursor,
+            "total": len(lesson_catalog),
+        }
+
+    # Fallback khi catalog chưa nạp: keyset query trên index `id`
+    query = {"id": {"$gt": cursor}} if cursor else {}
+    mongo_cursor = lessons_col.find(query, {
         "id": 1,
         "_id": 1
-    }).sort("id", 1).skip(skip)
-    
-    lessons = []
-    for doc in cursor:
-        lesson_data = {
-            "id": doc.get("id", str(doc["_id"])),
-        }
-        lessons.append(lesson_data)
-    
-    print(f"📚 Returning {len(lessons)} lessons")
-    if lessons:
-        print(f"   First: {lessons[0]['id']}")
-        print(f"   Last: {lessons[-1]['id']}")
-    
+    }).sort("id", 1)
+    if cursor is None and skip:
+        mongo_cursor = mongo_cursor.skip(skip)
+    docs = list(mongo_cursor.limit(limit + 1))
+
+    lessons = [{"id": doc.get("id", str(doc["_id"]))} for doc in docs[:limit]]
+    next_cursor = lessons[-1]["id"] if len(docs) > limit else None
+
     return {
         "lessons": lessons,
-        "count": len(lessons)
+        "count": len(lessons),
+        "next_cursor": next_cursor,
+        "total": None,
     }
 
 
 @router.post("/lessons/{lesson_id}/regenerate-audio")
-def regenerate_audio(lesson_id: str, lang: str = "en", db = Depends(get_db)):
+def regenerate_audio(lesson_id: str, lang: str = "en", svc: LessonService = Depends(get_lesson_service)):
     """
     Force regenerate audio cho lesson (xóa cache).
     Useful khi muốn đổi giọng hoặc update story.
     """
-    svc = LessonService(db["lessons"])
     # Always use original story
     story = svc.get_story(lesson_id)
     
@@ -147,7 +284,7 @@ def regenerate_audio(lesson_id: str, lang: str = "en", db = Depends(get_db)):
     
     if audio_path.exists():
         audio_path.unlink()
-        print(f"🗑️ Deleted cached audio: {filename}")
+        logger.info("Deleted cached audio: %s", filename)
     
     # Generate mới
     audio_url = get_or_create_audio(story, lesson_id, lang)
@@ -1,21 +1,41 @@
 # app/api/progress.py
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+import logging
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from pymongo.database import Database
+from typing import List, Literal, Optional
+from datetime import date, datetime, timedelta
+from motor.motor_asyncio import AsyncIOMotorDatabase
 
-from app.db import get_db
+from app.db import get_async_db
 from app.services.progress_service import ProgressService
+from app.services.leaderboard_service import (
+    leaderboard,
+    GLOBAL_BOARD,
+    weekly_board_name,
+    lesson_board_name,
+)
 from app.services.auth_service import get_user_from_token
 
 router = APIRouter(prefix="/progress", tags=["Progress"])
 
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_ITEMS = 100
+MAX_ACTIVITY_DAYS = 731  # 2 năm
+
 # Pydantic Models
 class SaveProgressRequest(BaseModel):
     lesson_id: str = Field(..., description="ID của lesson")
     score: int = Field(..., ge=0, le=4, description="Số câu đúng (0-4)")
     total_questions: int = Field(default=4, ge=1, description="Tổng số câu hỏi")
 
+class BatchProgressItem(SaveProgressRequest):
+    client_id: str = Field(..., min_length=1, max_length=64, description="ID do client sinh (idempotency key)")
+    completed_at: Optional[datetime] = Field(None, description="Thời điểm làm xong bài (phía client)")
+
+class BatchProgressRequest(BaseModel):
+    items: List[BatchProgressItem] = Field(..., min_length=1, max_length=MAX_BATCH_ITEMS)
+
 class ProgressResponse(BaseModel):
     id: str
     user_id: str
@@ -40,12 +60,40 @@ class AllProgressResponse(BaseModel):
     progress: List[ProgressResponse]
     stats: UserStatsResponse
 
+class BatchProgressResponse(BaseModel):
+    applied: List[str] = Field(..., description="client_id đã được áp dụng")
+    duplicates: List[str] = Field(..., description="client_id đã gửi trước đó (bỏ qua)")
+    progress: List[ProgressResponse]
+    stats: UserStatsResponse
+
 class StreakResponse(BaseModel):
     current_streak: int = Field(..., description="Số ngày học liên tiếp hiện tại")
     longest_streak: int = Field(..., description="Streak dài nhất từng đạt được")
     last_active_date: Optional[str] = Field(None, description="Ngày học gần nhất")
     total_active_days: int = Field(..., description="Tổng số ngày đã học")
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: str
+    username: Optional[str] = None
+    score: int
+
+class LeaderboardResponse(BaseModel):
+    board: str
+    entries: List[LeaderboardEntry]
+    me: Optional[LeaderboardEntry] = Field(None, description="Hạng của user hiện tại")
+    total_users: int
+
+class ActivityHistoryResponse(BaseModel):
+    start: str
+    end: str
+    days: int = Field(..., description="Số ngày trong khoảng")
+    bitmap: str = Field(..., description="Hex bitset, bit i (LSB-first mỗi byte) = ngày start+i có học")
+    runs: List[List[int]] = Field(..., description="[offset, length] các chuỗi ngày học liên tiếp")
+    counts: List[int] = Field(..., description="Số lesson mỗi ngày có học, theo thứ tự ngày")
+    active_days: int
+    total_lessons: int
+
 class LearningCalendarResponse(BaseModel):
     year: int
     month: int
@@ -53,7 +101,7 @@ class LearningCalendarResponse(BaseModel):
     total_days: int = Field(..., description="Tổng số ngày đã học trong tháng")
 
 
-def get_current_user(authorization: str = Header(...), db: Database = Depends(get_db)):
+async def get_current_user(authorization: str = Header(...), db: AsyncIOMotorDatabase = Depends(get_async_db)):
     """
     Dependency để lấy user từ Authorization header
     """
@@ -68,7 +116,7 @@ def get_current_user(authorization: str = Header(...), db: Database = Depends(ge
         token = authorization.replace("Bearer ", "")
         
         # Dùng auth_service có sẵn
-        user = get_user_from_token(db, token)
+        user = await get_user_from_token(db, token)
         
         if not user:
             raise HTTPException(
@@ -81,18 +129,29 @@ def get_current_user(authorization: str = Header(...), db: Database = Depends(ge
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Auth error: {e}")
+        logger.exception("Auth error")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials"
         )
 
 
+_progress_service: Optional[ProgressService] = None
+
+
+def get_progress_service(db: AsyncIOMotorDatabase = Depends(get_async_db)) -> ProgressService:
+    """Dependency trả về ProgressService dùng chung (long-lived, tạo 1 lần)"""
+    global _progress_service
+    if _progress_service is None or _progress_service.db is not db:
+        _progress_service = ProgressService(db, leaderboard=leaderboard)
+    return _progress_service
+
+
 @router.post("", response_model=ProgressResponse, status_code=status.HTTP_201_CREATED)
 async def save_progress(
     data: SaveProgressRequest,
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """
     Lưu hoặc cập nhật progress của user cho một lesson
@@ -112,8 +171,6 @@ async def save_progress(
                 detail="User ID not found"
             )
         
-        progress_service = ProgressService(db)
-        
         # Validate score
         if data.score > data.total_questions:
             raise HTTPException(
@@ -121,11 +178,12 @@ async def save_progress(
                 detail=f"Score cannot be greater than total questions ({data.total_questions})"
             )
         
-        result = progress_service.save_progress(
+        result = await progress_service.save_progress(
             user_id=user_id,
             lesson_id=data.lesson_id,
             score=data.score,
-            total_questions=data.total_questions
+            total_questions=data.total_questions,
+            username=current_user.get("username")
         )
         
         return result
@@ -133,25 +191,81 @@ async def save_progress(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in save_progress endpoint: {e}")
+        logger.exception("Error in save_progress endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to save progress"
         )
 
 
+@router.post("/batch", response_model=BatchProgressResponse)
+async def save_progress_batch(
+    data: BatchProgressRequest,
+    current_user: dict = Depends(get_current_user),
+    progress_service: ProgressService = Depends(get_progress_service)
+):
+    """
+    Gửi nhiều kết quả làm bài một lần (các bài làm khi offline)
+    
+    - **items**: danh sách kết quả theo thứ tự đã làm, mỗi item có `client_id` duy nhất
+    - Gửi lại cùng `client_id` sẽ không bị tính 2 lần
+    - Streak và thống kê được cập nhật 1 lần sau khi áp dụng cả batch
+    """
+    try:
+        user_id = current_user.get("user_id")
+        
+        if not user_id:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User ID not found"
+            )
+        
+        items = []
+        for item in data.items:
+            if item.score > item.total_questions:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Score cannot be greater than total questions ({item.client_id})"
+                )
+            completed_at = item.completed_at
+            if completed_at is not None and completed_at.tzinfo is not None:
+                # Đổi về local time (learning log dùng ngày local)
+                completed_at = completed_at.astimezone().replace(tzinfo=None)
+            items.append({
+                "client_id": item.client_id,
+                "lesson_id": item.lesson_id,
+                "score": item.score,
+                "total_questions": item.total_questions,
+                "completed_at": completed_at
+            })
+        
+        return await progress_service.save_progress_batch(
+            user_id,
+            items,
+            username=current_user.get("username")
+        )
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error in save_progress_batch endpoint")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to save progress batch"
+        )
+
+
 @router.get("/lesson/{lesson_id}", response_model=ProgressResponse)
 async def get_lesson_progress(
     lesson_id: str,
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """Lấy progress của user cho một lesson cụ thể"""
     try:
         user_id = current_user.get("user_id")
         
-        progress_service = ProgressService(db)
-        result = progress_service.get_user_progress(user_id, lesson_id)
+        result = await progress_service.get_user_progress(user_id, lesson_id)
         
         if not result:
             raise HTTPException(
@@ -164,7 +278,7 @@ async def get_lesson_progress(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in get_lesson_progress endpoint: {e}")
+        logger.exception("Error in get_lesson_progress endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get progress"
@@ -174,7 +288,7 @@ async def get_lesson_progress(
 @router.get("/all", response_model=AllProgressResponse)
 async def get_all_progress(
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """
     Lấy tất cả progress và thống kê của user
@@ -189,9 +303,8 @@ async def get_all_progress(
     try:
         user_id = current_user.get("user_id")
         
-        progress_service = ProgressService(db)
-        progress_list = progress_service.get_all_user_progress(user_id)
-        stats = progress_service.get_user_stats(user_id)
+        progress_list = await progress_service.get_all_user_progress(user_id)
+        stats = await progress_service.get_user_stats(user_id)
         
         return {
             "progress": progress_list,
@@ -199,7 +312,7 @@ async def get_all_progress(
         }
     
     except Exception as e:
-        print(f"❌ Error in get_all_progress endpoint: {e}")
+        logger.exception("Error in get_all_progress endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get progress"
@@ -209,7 +322,7 @@ async def get_all_progress(
 @router.get("/stats", response_model=UserStatsResponse)
 async def get_user_stats(
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """
     Lấy thống kê tổng quan của user
@@ -224,13 +337,12 @@ async def get_user_stats(
     try:
         user_id = current_user.get("user_id")
         
-        progress_service = ProgressService(db)
-        stats = progress_service.get_user_stats(user_id)
+        stats = await progress_service.get_user_stats(user_id)
         
         return stats
     
     except Exception as e:
-        print(f"❌ Error in get_user_stats endpoint: {e}")
+        logger.exception("Error in get_user_stats endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get stats"
@@ -240,7 +352,7 @@ async def get_user_stats(
 @router.get("/streak", response_model=StreakResponse)
 async def get_user_streak(
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """
     Lấy chi tiết streak học tập của user
@@ -265,27 +377,106 @@ async def get_user_streak(
                 detail="User ID not found"
             )
 
-        progress_service = ProgressService(db)
-        streak_data = progress_service.get_user_streak(user_id)
+        streak_data = await progress_service.get_user_streak(user_id)
 
         return streak_data
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in get_user_streak endpoint: {e}")
+        logger.exception("Error in get_user_streak endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get streak"
         )
 
 
+@router.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    board: Literal["global", "weekly", "lesson"] = "global",
+    lesson_id: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Bảng xếp hạng (precomputed, không aggregate Mongo mỗi request)
+    
+    - **board=global**: tổng best score của tất cả lessons
+    - **board=weekly**: tổng số câu đúng trong tuần này
+    - **board=lesson**: best score của 1 lesson (cần `lesson_id`)
+    - **me**: hạng của user hiện tại (null nếu chưa có điểm)
+    """
+    if board == "lesson":
+        if not lesson_id:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="lesson_id is required for lesson leaderboard"
+            )
+        board_name = lesson_board_name(lesson_id)
+    elif board == "weekly":
+        board_name = weekly_board_name()
+    else:
+        board_name = GLOBAL_BOARD
+    
+    return leaderboard.get_leaderboard(board_name, limit=limit, user_id=current_user.get("user_id"))
+
+
+@router.get("/activity", response_model=ActivityHistoryResponse)
+async def get_activity_history(
+    start: Optional[date] = Query(None, description="Ngày bắt đầu (YYYY-MM-DD), mặc định 1 năm trước"),
+    end: Optional[date] = Query(None, description="Ngày kết thúc (YYYY-MM-DD), mặc định hôm nay"),
+    current_user: dict = Depends(get_current_user),
+    progress_service: ProgressService = Depends(get_progress_service)
+):
+    """
+    Lịch sử học trong 1 khoảng ngày bất kỳ (heatmap cả năm trong 1 request)
+    
+    **Example**:
+    - GET /progress/activity?start=2025-01-01&end=2025-12-31
+    - `runs`: [[0, 3], [10, 1]] = học ngày 1-3/1 và 11/1
+    - `counts`: số lesson của từng ngày có học, cùng thứ tự với bitmap
+    """
+    try:
+        user_id = current_user.get("user_id")
+
+        if not user_id:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User ID not found"
+            )
+
+        end = end or datetime.now().date()
+        start = start or (end - timedelta(days=364))
+
+        if start > end:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="start must be before end"
+            )
+        if (end - start).days + 1 > MAX_ACTIVITY_DAYS:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Date range must be at most {MAX_ACTIVITY_DAYS} days"
+            )
+
+        return await progress_service.get_activity_history(user_id, start, end)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error in get_activity_history endpoint")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to get activity history"
+        )
+
+
 @router.get("/calendar/{year}/{month}", response_model=LearningCalendarResponse)
 async def get_learning_calendar(
     year: int,
     month: int,
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """
     Lấy calendar các ngày đã học trong tháng
@@ -322,8 +513,7 @@ async def get_learning_calendar(
                 detail="Month must be between 1 and 12"
             )
 
-        progress_service = ProgressService(db)
-        active_dates = progress_service.get_learning_calendar(user_id, year, month)
+        active_dates = await progress_service.get_learning_calendar(user_id, year, month)
 
         return {
             "year": year,
@@ -335,7 +525,7 @@ async def get_learning_calendar(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in get_learning_calendar endpoint: {e}")
+        logger.exception("Error in get_learning_calendar endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to get learning calendar"
@@ -346,7 +536,7 @@ async def get_learning_calendar(
 async def delete_lesson_progress(
     lesson_id: str,
     current_user: dict = Depends(get_current_user),
-    db: Database = Depends(get_db)
+    progress_service: ProgressService = Depends(get_progress_service)
 ):
     """
     Xóa progress của user cho một lesson (dùng để reset)
@@ -356,8 +546,7 @@ async def delete_lesson_progress(
     try:
         user_id = current_user.get("user_id")
         
-        progress_service = ProgressService(db)
-        deleted = progress_service.delete_progress(user_id, lesson_id)
+        deleted = await progress_service.delete_progress(user_id, lesson_id)
         
         if not deleted:
             raise HTTPException(
@@ -370,7 +559,7 @@ async def delete_lesson_progress(
     except HTTPException:
         raise
     except Exception as e:
-        print(f"❌ Error in delete_lesson_progress endpoint: {e}")
+        logger.exception("Error in delete_lesson_progress endpoint")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete progress"
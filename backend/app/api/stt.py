@@ -1,12 +1,16 @@
 # app/api/stt.py
+import logging
 import os
 import tempfile
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import JSONResponse
 from app.services.stt_service import DeepgramSTTService
+from app.services.metrics import stage_timer
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 @router.post("/speech-to-text")
 async def speech_to_text(
     audio: UploadFile = File(...),
@@ -60,7 +64,8 @@ async def speech_to_text(
         
         # Transcribe
         stt_service = DeepgramSTTService()
-        result = stt_service.transcribe_file(temp_path, language)
+        with stage_timer("stt"):
+            result = stt_service.transcribe_file(temp_path, language)
         
         return JSONResponse(content={
             "success": True,
@@ -90,7 +95,7 @@ async def speech_to_text(
             try:
                 os.unlink(temp_path)
             except Exception as e:
-                print(f"⚠️  Failed to delete temp file: {e}")
+                logger.warning("Failed to delete temp file: %s", e)
 
 
 @router.get("/supported-languages")
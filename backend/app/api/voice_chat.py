@@ -1,4 +1,5 @@
 # app/api/voice_chat.py
+import logging
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 from fastapi.responses import JSONResponse
@@ -10,6 +11,8 @@ from app.services.conversation_service import conv_store
 
 router = APIRouter()
 
+logger = logging.getLogger(__name__)
+
 class VoiceChatRequest(BaseModel):
     message: str = Field(..., min_length=1)
     language: Optional[str] = Field("en")
@@ -42,9 +45,7 @@ async def voice_chat(req: VoiceChatRequest):
     except asyncio.TimeoutError:
         raise HTTPException(status_code=504, detail=f"LLM timeout after {LLM_TIMEOUT}s")
     except Exception as e:
-        print("LLM error:", e)
-        import traceback
-        traceback.print_exc()
+        logger.exception("LLM error")
         raise HTTPException(status_code=500, detail=f"LLM error: {str(e)}")
 
     if not assistant_text or not str(assistant_text).strip():
@@ -60,7 +61,7 @@ async def voice_chat(req: VoiceChatRequest):
     except asyncio.TimeoutError:
         raise HTTPException(status_code=504, detail=f"TTS timeout after {TTS_TIMEOUT}s")
     except Exception as e:
-        print("TTS error:", e)
+        logger.exception("TTS error")
         raise HTTPException(status_code=500, detail="TTS error")
 
     if not audio_url:
@@ -0,0 +1,291 @@
+# app/backfill_lesson_attributes.py
+# Tính các field dẫn xuất cho lessons và ghi hàng loạt (bulk_write / update_many)
+# Chạy: python app/backfill_lesson_attributes.py [--attr difficulty] [--batch-size 500] [--dry-run]
+#
+# Thêm field mới: viết 1 class kế thừa
+#   - PipelineAttribute: 1 update_many với pipeline (không cần thống kê corpus)
+#   - AggregationAttribute: 1 aggregation tính giá trị (kể cả thống kê corpus),
+#     ghi các doc thay đổi bằng bulk_write
+#   - BatchAttribute: tính ở client khi không diễn đạt được bằng aggregation
+# rồi đăng ký bằng @register.
+import sys
+import os
+import time
+import argparse
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pymongo import UpdateOne
+
+from app.db import init_db, close_db, get_db
+
+LESSONS_COLLECTION = 'lessons'
+DEFAULT_BATCH_SIZE = 500
+
+# Cùng quy tắc với app.services.lesson_search.tokenize
+TOKEN_REGEX = "[a-z0-9]+"
+
+ATTRIBUTES: Dict[str, "LessonAttribute"] = {}
+
+
+def register(cls):
+    """Decorator: đăng ký attribute theo tên"""
+    ATTRIBUTES[cls.name] = cls()
+    return cls
+
+
+class LessonAttribute(ABC):
+    name = ""
+    fields: tuple = ()
+    description = ""
+
+    @abstractmethod
+    def apply(self, col, dry_run=False, batch_size=DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+        """Tính + ghi attribute, trả về {"matched", "modified"}"""
+
+
+def _write_changes(col, changes: Iterable[Tuple[Any, dict]], dry_run: bool, batch_size: int) -> int:
+    """bulk_write $set theo batch; trả về số doc được ghi"""
+    ops = []
+    written = 0
+
+    def flush():
+        nonlocal written
+        if ops and not dry_run:
+            col.bulk_write(ops, ordered=False)
+        written += len(ops)
+        print(f"  💾 changed {written}")
+        ops.clear()
+
+    for _id, new in changes:
+        ops.append(UpdateOne({"_id": _id}, {"$set": new}))
+        if len(ops) >= batch_size:
+            flush()
+    if ops:
+        flush()
+    return written
+
+
+class PipelineAttribute(LessonAttribute):
+    """Attribute tính hoàn toàn trên server: 1 lệnh update_many với pipeline."""
+    filter: dict = {}
+    pipeline: list = []
+
+    def apply(self, col, dry_run=False, **_):
+        if dry_run:
+            count = col.count_documents(self.filter)
+            print(f"  🧪 (dry-run) {count} lessons sẽ được cập nhật")
+            return {"matched": count, "modified": 0}
+        result = col.update_many(self.filter, self.pipeline)
+        return {"matched": result.matched_count, "modified": result.modified_count}
+
+
+class AggregationAttribute(LessonAttribute):
+    """
+    Attribute tính bằng 1 aggregation trên lessons (thống kê corpus chạy trên
+    server). pipeline() trả về {_id, <fields>} chỉ cho doc có giá trị thay đổi;
+    client chỉ stream kết quả vào bulk_write.
+    """
+
+    @abstractmethod
+    def pipeline(self, n_docs: int) -> List[dict]:
+        """Aggregation pipeline; n_docs = số lesson hiện có"""
+
+    def apply(self, col, dry_run=False, batch_size=DEFAULT_BATCH_SIZE):
+        n_docs = col.count_documents({})
+        if not n_docs:
+            return {"matched": 0, "modified": 0}
+        started = time.perf_counter()
+        cursor = col.aggregate(self.pipeline(n_docs), allowDiskUse=True, batchSize=batch_size)
+        changes = ((doc["_id"], {field: doc[field] for field in self.fields}) for doc in cursor)
+        modified = _write_changes(col, changes, dry_run, batch_size)
+        print(f"  📐 Aggregation + writes in {time.perf_counter() - started:.2f}s")
+        return {"matched": n_docs, "modified": modified}
+
+
+class BatchAttribute(LessonAttribute):
+    """
+    Attribute tính ở client, đọc collection đúng 1 lượt (streaming):
+        1. observe(doc): gọi cho từng doc, giữ lại state cần cho thống kê corpus
+        2. compute(): sau khi đọc xong, trả về (_id, {field: value}) cho từng doc
+    reset() xóa state, được gọi trước và sau mỗi lần apply.
+    Kết quả được ghi bằng bulk_write theo batch, chỉ các doc có giá trị thay đổi.
+    """
+    projection: dict = {}
+
+    @abstractmethod
+    def reset(self):
+        """Xóa state của lượt chạy"""
+
+    @abstractmethod
+    def observe(self, doc: dict):
+        """Nhận 1 doc trong lượt đọc duy nhất"""
+
+    @abstractmethod
+    def compute(self) -> Iterable[Tuple[Any, dict]]:
+        """(_id, giá trị mới) cho mọi doc đã observe"""
+
+    def apply(self, col, dry_run=False, batch_size=DEFAULT_BATCH_SIZE):
+        projection = {**self.projection, **{field: 1 for field in self.fields}}
+        self.reset()
+        try:
+            current: Dict[Any, tuple] = {}
+            for doc in col.find({}, projection):
+                current[doc["_id"]] = tuple(doc.get(field) for field in self.fields)
+                self.observe(doc)
+
+            changes = (
+                (_id, new) for _id, new in self.compute()
+                if current.get(_id) != tuple(new.get(field) for field in self.fields)
+            )
+            modified = _write_changes(col, changes, dry_run, batch_size)
+            return {"matched": len(current), "modified": modified}
+        finally:
+            self.reset()
+
+
+# ---------------------------------------------------------------------- #
+# Attributes
+# ---------------------------------------------------------------------- #
+@register
+class RandomScore(PipelineAttribute):
+    """Điểm thưởng của lesson: random 40 hoặc 60 cho lesson chưa có score."""
+    name = "score"
+    fields = ("score",)
+    description = "score 40/60 cho lesson chưa có (server-side $rand)"
+    filter = {"score": {"$exists": False}}
+    pipeline = [
+        {"$set": {"score": {"$cond": [{"$lt": [{"$rand": {}}, 0.5]}, 40, 60]}}}
+    ]
+
+
+def _percentile(rank_field: str, n_docs: int) -> dict:
+    """$rank (1-based, đồng hạng) -> percentile 0..1, như bisect_left / (n - 1)"""
+    if n_docs <= 1:
+        return {"$literal": 0.5}
+    return {"$divide": [{"$subtract": [f"${rank_field}", 1]}, n_docs - 1]}
+
+
+@register
+class Difficulty(AggregationAttribute):
+    """
+    Độ khó 0..1 = tổng có trọng số percentile của:
+        - độ dài story (số từ)
+        - độ hiếm từ vựng: IDF trung bình của các từ trong story (df trên toàn corpus)
+        - số câu hỏi, trong đó câu 'multiple' tính nặng hơn
+
+    Toàn bộ chạy trong 1 aggregation (MongoDB >= 5.0, cần $setWindowFields):
+    tokenize bằng $regexFindAll, df bằng window $count theo token, percentile
+    bằng window $rank theo từng feature.
+    """
+    name = "difficulty"
+    fields = ("difficulty", "difficulty_level")
+    description = "difficulty (0..1) + difficulty_level (easy/medium/hard)"
+
+    WEIGHTS = {"length": 0.4, "rarity": 0.4, "questions": 0.2}
+    LEVELS = ((1 / 3, "easy"), (2 / 3, "medium"))  # còn lại: hard
+
+    def pipeline(self, n_docs: int) -> List[dict]:
+        tokens = {"$map": {
+            "input": {"$regexFindAll": {"input": {"$toLower": {"$ifNull": ["$story", ""]}}, "regex": TOKEN_REGEX}},
+            "in": "$$this.match",
+        }}
+        question_weight = {"$sum": {"$map": {
+            "input": {"$ifNull": ["$questions", []]},
+            "in": {"$cond": [{"$eq": ["$$this.type", "multiple"]}, 1.5, 1.0]},
+        }}}
+        idf = {"$ln": {"$divide": [1 + n_docs, {"$add": [1, "$df"]}]}}
+        ranks = [
+            {"$setWindowFields": {"sortBy": {feature: 1}, "output": {f"{feature}_rank": {"$rank": {}}}}}
+            for feature in self.WEIGHTS
+        ]
+        score = {"$round": [{"$add": [
+            {"$multiply": [weight, _percentile(f"{feature}_rank", n_docs)]}
+            for feature, weight in self.WEIGHTS.items()
+        ]}, 3]}
+        level = {"$switch": {
+            "branches": [{"case": {"$lt": ["$difficulty", bound]}, "then": label} for bound, label in self.LEVELS],
+            "default": "hard",
+        }}
+
+        return [
+            {"$project": {
+                "tokens": tokens,
+                "questions": question_weight,
+                "current": ["$difficulty", "$difficulty_level"],
+            }},
+            {"$set": {"length": {"$size": "$tokens"}}},
+            # 1 dòng / (lesson, token) kèm tf; story rỗng vẫn giữ 1 dòng với token null
+            {"$unwind": {"path": "$tokens", "preserveNullAndEmptyArrays": True}},
+            {"$group": {
+                "_id": {"doc": "$_id", "token": "$tokens"},
+                "tf": {"$sum": 1},
+                "length": {"$first": "$length"},
+                "questions": {"$first": "$questions"},
+                "current": {"$first": "$current"},
+            }},
+            # df = số lesson chứa token
+            {"$setWindowFields": {"partitionBy": "$_id.token", "output": {"df": {"$count": {}}}}},
+            {"$group": {
+                "_id": "$_id.doc",
+                "idf_sum": {"$sum": {"$cond": [
+                    {"$eq": [{"$ifNull": ["$_id.token", None]}, None]}, 0, {"$multiply": ["$tf", idf]},
+                ]}},
+                "length": {"$first": "$length"},
+                "questions": {"$first": "$questions"},
+                "current": {"$first": "$current"},
+            }},
+            {"$set": {"rarity": {"$cond": [{"$gt": ["$length", 0]}, {"$divide": ["$idf_sum", "$length"]}, 0]}}},
+            *ranks,
+            {"$set": {"difficulty": score}},
+            {"$set": {"difficulty_level": level}},
+            # Chỉ trả về doc có giá trị thay đổi
+            {"$match": {"$expr": {"$ne": ["$current", ["$difficulty", "$difficulty_level"]]}}},
+            {"$project": {"difficulty": 1, "difficulty_level": 1}},
+        ]
+
+
+# ---------------------------------------------------------------------- #
+def run(attr_names=None, dry_run=False, batch_size=DEFAULT_BATCH_SIZE):
+    print("=" * 60)
+    print("🧮 BACKFILL LESSON ATTRIBUTES")
+    print("=" * 60)
+
+    try:
+        init_db()
+        col = get_db()[LESSONS_COLLECTION]
+        print("✅ MongoDB connected")
+    except Exception as e:
+        print(f"❌ MongoDB connection failed: {e}")
+        return False
+
+    try:
+        for name in attr_names or list(ATTRIBUTES):
+            attribute = ATTRIBUTES[name]
+            print(f"\n📌 {name}: {attribute.description}")
+            started = time.perf_counter()
+            stats = attribute.apply(col, dry_run=dry_run, batch_size=batch_size)
+            print(f"  ✅ matched {stats['matched']}, modified {stats['modified']} "
+                  f"in {time.perf_counter() - started:.2f}s")
+    finally:
+        close_db()
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tính và ghi các field dẫn xuất cho lessons")
+    parser.add_argument("--attr", action="append", choices=sorted(ATTRIBUTES), help="Attribute cần tính (mặc định: tất cả)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Số lesson mỗi bulk_write")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ tính, không ghi database")
+    parser.add_argument("--list", action="store_true", help="Liệt kê các attribute đã đăng ký")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, attribute in ATTRIBUTES.items():
+            print(f"{name:<12} {attribute.description}")
+        sys.exit(0)
+
+    ok = run(args.attr, dry_run=args.dry_run, batch_size=max(1, args.batch_size))
+    sys.exit(0 if ok else 1)
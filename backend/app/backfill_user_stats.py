@@ -0,0 +1,65 @@
+# app/backfill_user_stats.py
+# Tính lại user_stats (totals + streak) cho user đã có lịch sử học
+# Chạy: python app/backfill_user_stats.py [--user USER_ID]
+import sys
+import os
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db import init_async_db, close_async_db, get_async_db
+from app.services.progress_service import ProgressService
+
+CONCURRENCY = 8
+
+
+async def backfill(user_ids=None):
+    print("=" * 60)
+    print("🔁 BACKFILL USER STATS / STREAKS")
+    print("=" * 60)
+
+    await init_async_db()
+    db = get_async_db()
+    service = ProgressService(db)
+
+    try:
+        if not user_ids:
+            progress_users, log_users = await asyncio.gather(
+                db["user_progress"].distinct("user_id"),
+                db["learning_logs"].distinct("user_id"),
+            )
+            user_ids = sorted(set(progress_users) | set(log_users))
+
+        print(f"\n👥 Users to process: {len(user_ids)}\n")
+
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        done = 0
+        failed = 0
+
+        async def run(user_id):
+            nonlocal done, failed
+            async with semaphore:
+                try:
+                    stats = await service.rebuild_user_stats(user_id)
+                    done += 1
+                    print(f"   ✅ {user_id}: streak {stats['current_streak']} "
+                          f"(longest {stats['longest_streak']}, {stats['total_active_days']} days)")
+                except Exception as e:
+                    failed += 1
+                    print(f"   ❌ {user_id}: {e}")
+
+        await asyncio.gather(*(run(user_id) for user_id in user_ids))
+
+        print(f"\n{'=' * 60}")
+        print(f"✅ Done: {done}   ❌ Failed: {failed}")
+        print("=" * 60)
+    finally:
+        close_async_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill user_stats từ user_progress + learning_logs")
+    parser.add_argument("--user", action="append", dest="users", help="Chỉ backfill user này (có thể lặp lại)")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.users))
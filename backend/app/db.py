@@ -1,11 +1,30 @@
 # app/db.py
+"""
+MongoDB connection management.
+
+- Sync client (pymongo): scripts, lesson catalog, các route `def`
+- Async client (motor): các route `async def` (progress, auth)
+
+Pool size, timeouts, compression đọc từ env. Lesson catalog đọc với
+secondaryPreferred để giảm tải primary. Pool metrics (connections đang
+checked out, wait-queue time) và latency từng command được thu qua
+pymongo monitoring listeners.
+"""
+import logging
 import os
+import threading
+import time
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from typing import Optional
+from pymongo import MongoClient, ReadPreference, monitoring
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from typing import Any, Dict, Optional
+
+from app.services.metrics import mongo_command_metrics
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGODB_URI = os.getenv("MONGO_URI")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
 
@@ -14,29 +33,153 @@ if not MONGODB_URI:
 if not DATABASE_NAME:
     raise ValueError("❌ Missing DATABASE_NAME in .env")
 
+# Pool sizing: mỗi worker uvicorn có pool riêng cho sync + async client
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_SYNC_MAX_POOL_SIZE = int(os.getenv("MONGO_SYNC_MAX_POOL_SIZE", 20))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+
+# Timeouts
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 20000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+
+# Wire compression (snappy/zstd cần cài thêm python-snappy / zstandard)
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zlib")
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Thu thập pool metrics cho 1 client (sync hoặc async)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.checked_out = 0
+        self.open_connections = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _record_wait(self, event, failed: bool = False):
+        duration = getattr(event, "duration", None)  # pymongo >= 4.7
+        if duration is None:
+            started = getattr(self._local, "started", None)
+            duration = time.perf_counter() - started if started else 0.0
+        with self._lock:
+            if failed:
+                self.checkout_failures += 1
+            else:
+                self.checked_out += 1
+                self.checkouts += 1
+            self.wait_time_total += duration
+            self.wait_time_max = max(self.wait_time_max, duration)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._record_wait(event)
+
+    def connection_check_out_failed(self, event):
+        self._record_wait(event, failed=True)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "checked_out": self.checked_out,
+                "open_connections": self.open_connections,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_time_total_ms": round(self.wait_time_total * 1000, 3),
+                "wait_time_max_ms": round(self.wait_time_max * 1000, 3),
+                "wait_time_avg_ms": round(self.wait_time_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+            }
+
+
+sync_pool_metrics = PoolMetricsListener("sync")
+async_pool_metrics = PoolMetricsListener("async")
+
+
+def _client_options(max_pool_size: int, listener: PoolMetricsListener) -> Dict[str, Any]:
+    return {
+        "maxPoolSize": max_pool_size,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "compressors": MONGO_COMPRESSORS,
+        "retryWrites": True,
+        "retryReads": True,
+        "event_listeners": [listener, mongo_command_metrics],
+    }
+
+
 client: Optional[MongoClient] = None
 db = None
 
+async_client: Optional[AsyncIOMotorClient] = None
+async_db: Optional[AsyncIOMotorDatabase] = None
+
 def init_db():
+    """
+    Sync (pymongo) client - dùng cho scripts, lesson catalog và các route `def`.
+
+    Raises:
+        RuntimeError nếu không kết nối được (fail fast thay vì để db=None)
+    """
     global client, db
     if client is None:
         try:
-            client = MongoClient(MONGODB_URI)
+            client = MongoClient(MONGODB_URI, **_client_options(MONGO_SYNC_MAX_POOL_SIZE, sync_pool_metrics))
             db = client[DATABASE_NAME]
             client.admin.command("ping")
-            print("✅ MongoDB connected successfully!")
+            logger.info("MongoDB connected successfully!")
         except Exception as e:
+            if client is not None:
+                client.close()
             client = None
             db = None
-            print("❌ MongoDB connection failed:", e)
+            raise RuntimeError(f"MongoDB connection failed: {e}") from e
 def close_db():
     global client, db
     if client is not None:
         try:
             client.close()
-            print("✅ MongoDB connection closed")
+            logger.info("MongoDB connection closed")
         except Exception as e:
-            print("❌ Error closing MongoDB client:", e)
+            logger.error("Error closing MongoDB client: %s", e)
         finally:
             client = None
             db = None
@@ -49,3 +192,82 @@ def get_db():
     if db is None:
         raise RuntimeError("MongoDB not initialized. Call init_db() first.")
     return db
+
+def get_lessons_collection():
+    """
+    Collection `lessons` đọc với secondaryPreferred.
+    Lesson catalog gần như read-only nên không cần đọc từ primary.
+    """
+    return get_db().get_collection("lessons", read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+
+async def init_async_db():
+    """
+    Async (motor) client - dùng cho các route `async def` để không block event loop.
+
+    Raises:
+        RuntimeError nếu không kết nối được
+    """
+    global async_client, async_db
+    if async_client is None:
+        try:
+            async_client = AsyncIOMotorClient(MONGODB_URI, **_client_options(MONGO_MAX_POOL_SIZE, async_pool_metrics))
+            async_db = async_client[DATABASE_NAME]
+            await async_client.admin.command("ping")
+            logger.info("MongoDB async client connected!")
+        except Exception as e:
+            if async_client is not None:
+                async_client.close()
+            async_client = None
+            async_db = None
+            raise RuntimeError(f"MongoDB async connection failed: {e}") from e
+
+def close_async_db():
+    global async_client, async_db
+    if async_client is not None:
+        try:
+            async_client.close()
+            logger.info("MongoDB async client closed")
+        except Exception as e:
+            logger.error("Error closing MongoDB async client: %s", e)
+        finally:
+            async_client = None
+            async_db = None
+
+def get_async_db() -> AsyncIOMotorDatabase:
+    """
+    Trả về async db (motor).
+    Dùng như dependency trong các router async: `db = Depends(get_async_db)`
+    """
+    if async_db is None:
+        raise RuntimeError("MongoDB async client not initialized. Call init_async_db() first.")
+    return async_db
+
+
+async def check_db_health() -> Dict[str, Any]:
+    """
+    Health probe: ping qua async client (không block event loop).
+
+    Returns:
+        {"ok": bool, "latency_ms": float | None, "error": str | None, "pools": {...}}
+    """
+    result: Dict[str, Any] = {"ok": False, "latency_ms": None, "error": None}
+    if async_client is None:
+        result["error"] = "MongoDB async client not initialized"
+    else:
+        start = time.perf_counter()
+        try:
+            await async_client.admin.command("ping")
+            result["ok"] = True
+            result["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        except Exception as e:
+            result["error"] = str(e)
+    result["pools"] = get_pool_stats()
+    return result
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Pool metrics của cả sync và async client (kèm cấu hình để so sánh)."""
+    return {
+        "sync": {**sync_pool_metrics.snapshot(), "max_pool_size": MONGO_SYNC_MAX_POOL_SIZE},
+        "async": {**async_pool_metrics.snapshot(), "max_pool_size": MONGO_MAX_POOL_SIZE},
+    }
@@ -1,32 +1,92 @@
 # app/importdata.py
-# đọc data từ MCtest GitHub và import vào MongoDB ( bảng lessons )
+# đọc data từ MCtest GitHub (hoặc file TSV/ANS local) và import vào MongoDB ( bảng lessons )
+# Import incremental: chỉ upsert lesson mới / có nội dung thay đổi (theo content_hash),
+# không xóa collection, giữ nguyên các field do script khác thêm (score, ...)
+# Nhiều dataset được đọc song song (thread), parse bằng process pool, ghi bởi 1 writer
+# Chạy: python app/importdata.py [--tsv FILE --ans FILE] [--dataset mc160] [--dry-run] [--test]
+import sys
+import os
 import re
+import json
+import hashlib
+import argparse
+import time
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import zip_longest
+from datetime import datetime
 import requests
-from db import db  
+from pymongo import UpdateOne
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db import init_db, close_db, get_db
 
 LESSONS_COLLECTION = 'lessons'
+# Field do import quản lý; field khác (score, short_story, ...) không bị ghi đè
+CONTENT_FIELDS = ('story', 'questions')
+# Số lesson mỗi bulk_write
+IMPORT_BATCH_SIZE = 200
+# Pipeline song song: số thread đọc, số process parse, số dòng mỗi chunk parse
+READ_WORKERS = 4
+PARSE_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+PARSE_CHUNK_LINES = 100
+
 # URLs của MCtest trên GitHub
+MCTEST_BASE_URL = 'https://raw.githubusercontent.com/mcobzarenco/mctest/master/data/MCTest'
 MCTEST_URLS = {
     'mc160': {
         'train': {
-            'tsv': 'https://raw.githubusercontent.com/mcobzarenco/mctest/master/data/MCTest/mc160.train.tsv',
-            'ans': 'https://raw.githubusercontent.com/mcobzarenco/mctest/master/data/MCTest/mc160.train.ans'
+            'tsv': f'{MCTEST_BASE_URL}/mc160.train.tsv',
+            'ans': f'{MCTEST_BASE_URL}/mc160.train.ans'
+        },
+        'dev': {
+            'tsv': f'{MCTEST_BASE_URL}/mc160.dev.tsv',
+            'ans': f'{MCTEST_BASE_URL}/mc160.dev.ans'
+        },
+        'test': {
+            'tsv': f'{MCTEST_BASE_URL}/mc160.test.tsv',
+            'ans': f'{MCTEST_BASE_URL}/mc160.test.ans'
+        },
+    },
+    'mc500': {
+        'train': {
+            'tsv': f'{MCTEST_BASE_URL}/mc500.train.tsv',
+            'ans': f'{MCTEST_BASE_URL}/mc500.train.ans'
+        },
+        'dev': {
+            'tsv': f'{MCTEST_BASE_URL}/mc500.dev.tsv',
+            'ans': f'{MCTEST_BASE_URL}/mc500.dev.ans'
+        },
+        'test': {
+            'tsv': f'{MCTEST_BASE_URL}/mc500.test.tsv',
+            'ans': f'{MCTEST_BASE_URL}/mc500.test.ans'
         },
-        
     },
-    
 }
 
-def download_file(url):
-    """Download file từ URL"""
-    try:
-        print(f"  📥 Downloading: {url.split('/')[-1]}...")
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"  ❌ Lỗi download: {e}")
-        return None
+def is_url(source):
+    return source.startswith('http://') or source.startswith('https://')
+
+def iter_lines(source):
+    """
+    Đọc từng dòng (lazy) từ URL hoặc file local, không giữ cả file trong memory.
+    Raises: OSError / requests.RequestException
+    """
+    if is_url(source):
+        print(f"  📥 Streaming: {source.split('/')[-1]}...")
+        with requests.get(source, stream=True, timeout=30) as response:
+            response.raise_for_status()
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            for line in response.iter_lines(decode_unicode=True):
+                yield line
+    else:
+        print(f"  📂 Reading: {source}...")
+        with open(source, encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\r\n')
 
 def parse_mctest_line(line):
     """
@@ -124,96 +184,312 @@ def parse_answer_line(line):
         print(f"  ⚠️  Lỗi parse answers: {e}")
         return []
 
-def process_dataset(tsv_url, ans_url):
-    """Download và parse 1 dataset"""
-    tsv_content = download_file(tsv_url)
-    ans_content = download_file(ans_url)
+def iter_line_pairs(tsv_source, ans_source):
+    """Generator: (số dòng, dòng story, dòng answers), bỏ dòng trống"""
+    story_lines = iter_lines(tsv_source)
+    answer_lines = iter_lines(ans_source)
     
-    if not tsv_content or not ans_content:
-        return []
+    for idx, (story_line, answer_line) in enumerate(zip_longest(story_lines, answer_lines)):
+        if story_line is None or answer_line is None:
+            if (story_line or answer_line or '').strip():
+                print(f"  ⚠️  Cảnh báo: stories != answers (lệch từ dòng {idx + 1})")
+            break
+        if not story_line.strip():
+            continue
+        yield idx + 1, story_line, answer_line
+
+def build_lesson(line_no, story_line, answer_line):
+    """Parse 1 cặp dòng story/answers -> lesson dict (None nếu dòng lỗi)"""
+    lesson = parse_mctest_line(story_line)
     
-    story_lines = tsv_content.strip().split('\n')
-    answer_lines = ans_content.strip().split('\n')
+    if not lesson:
+        print(f"  ⚠️  Bỏ qua dòng {line_no}")
+        return None
     
-    if len(story_lines) != len(answer_lines):
-        print(f"  ⚠️  Cảnh báo: stories ({len(story_lines)}) != answers ({len(answer_lines)})")
+    answers = parse_answer_line(answer_line)
     
-    lessons = []
+    for q_idx, question in enumerate(lesson['questions']):
+        if q_idx < len(answers):
+            question['answer'] = answers[q_idx]
+        else:
+            question['answer'] = 0
     
-    for idx, (story_line, answer_line) in enumerate(zip(story_lines, answer_lines)):
-        lesson = parse_mctest_line(story_line)
-        
-        if not lesson:
-            print(f"  ⚠️  Bỏ qua dòng {idx + 1}")
+    return lesson
+
+def iter_lessons(tsv_source, ans_source):
+    """Generator: ghép từng dòng story với dòng answers tương ứng -> lesson dict"""
+    for line_no, story_line, answer_line in iter_line_pairs(tsv_source, ans_source):
+        lesson = build_lesson(line_no, story_line, answer_line)
+        if lesson:
+            yield lesson
+
+def parse_chunk(pairs):
+    """Chạy trong process pool: [(line_no, story, answers)] -> (lessons, giây CPU parse)"""
+    started = time.perf_counter()
+    lessons = [lesson for lesson in (build_lesson(*pair) for pair in pairs) if lesson]
+    return lessons, time.perf_counter() - started
+
+def batched(iterable, size):
+    """Gom iterator thành list tối đa `size` phần tử"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_dataset(tsv_url, ans_url):
+    """Download (hoặc đọc file local) và parse 1 dataset thành list (dùng cho --test)"""
+    try:
+        return list(iter_lessons(tsv_url, ans_url))
+    except (OSError, requests.RequestException) as e:
+        print(f"  ❌ Lỗi đọc dữ liệu: {e}")
+        return []
+
+def content_hash(lesson):
+    """Hash nội dung lesson (story + questions) để phát hiện thay đổi"""
+    payload = json.dumps({k: lesson.get(k) for k in CONTENT_FIELDS}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def upsert_lessons(lessons_col, lessons, dry_run=False):
+    """
+    Upsert theo `id` cho lesson mới hoặc đã đổi nội dung.
+
+    - Lesson không đổi: bỏ qua (không ghi)
+    - Lesson đổi nội dung: cập nhật story/questions, unset short_story (tóm tắt cũ không còn đúng)
+    - score và các field khác giữ nguyên
+
+    Returns:
+        {"inserted": n, "updated": n, "unchanged": n}
+    """
+    stats = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not lessons:
+        return stats
+
+    ids = [lesson['id'] for lesson in lessons]
+    existing = {}
+    projection = {'_id': 0, 'id': 1, 'content_hash': 1, 'story': 1, 'questions': 1}
+    for doc in lessons_col.find({'id': {'$in': ids}}, projection):
+        # Doc import trước khi có content_hash: tính từ nội dung hiện tại
+        existing[doc['id']] = doc.get('content_hash') or content_hash(doc)
+
+    now = datetime.utcnow()
+    ops = []
+    for lesson in lessons:
+        digest = content_hash(lesson)
+        old_digest = existing.get(lesson['id'])
+        if old_digest == digest:
+            stats["unchanged"] += 1
             continue
-        
-        answers = parse_answer_line(answer_line)
-        
-        for q_idx, question in enumerate(lesson['questions']):
-            if q_idx < len(answers):
-                question['answer'] = answers[q_idx]
-            else:
-                question['answer'] = 0
-        
-        lessons.append(lesson)
-    
-    return lessons
 
-def import_mctest_from_github():
-    """Import tất cả MCtest data từ GitHub vào MongoDB"""
+        update = {
+            '$set': {**{k: lesson[k] for k in CONTENT_FIELDS}, 'content_hash': digest, 'updated_at': now},
+            '$setOnInsert': {'created_at': now},
+        }
+        if old_digest is None:
+            stats["inserted"] += 1
+        else:
+            stats["updated"] += 1
+            update['$unset'] = {'short_story': ''}
+        ops.append(UpdateOne({'id': lesson['id']}, update, upsert=True))
+
+    if ops and not dry_run:
+        lessons_col.bulk_write(ops, ordered=False)
+    return stats
+
+def mctest_sources(datasets=None):
+    """[(label, tsv, ans)] từ MCTEST_URLS (lọc theo tên dataset / split nếu có)"""
+    return [
+        (f"{dataset_name}.{data_type}", urls['tsv'], urls['ans'])
+        for dataset_name, dataset_types in MCTEST_URLS.items()
+        for data_type, urls in dataset_types.items()
+        if not datasets or dataset_name in datasets or f"{dataset_name}.{data_type}" in datasets
+    ]
+
+def import_mctest_from_github(sources=None, dry_run=False, batch_size=IMPORT_BATCH_SIZE, **pipeline_options):
+    """Import MCtest data (GitHub hoặc file local) vào MongoDB, incremental"""
     
     print("=" * 70)
-    print("IMPORT MCTEST DATA TỪ GITHUB VÀO MONGODB")
+    print("IMPORT MCTEST DATA VÀO MONGODB (INCREMENTAL)")
     print("=" * 70)
     
     # Test connection
     try:
-        db.list_collection_names()
+        init_db()
+        db = get_db()
         print("✅ Database connection OK")
     except Exception as e:
         print(f"❌ Không thể kết nối database: {e}")
         return False
     
-    # Lấy collection lessons
-    lessons_col = db[LESSONS_COLLECTION]
-    
-    all_lessons = []
-    
-    # Process từng dataset
-    for dataset_name, dataset_types in MCTEST_URLS.items():
-        print(f"\n{'='*70}")
-        print(f"📚 Dataset: {dataset_name.upper()}")
-        print(f"{'='*70}")
-        
-        for data_type, urls in dataset_types.items():
-            print(f"\n📖 Processing: {dataset_name}.{data_type}")
-            
-            lessons = process_dataset(urls['tsv'], urls['ans'])
-            
-            if lessons:
-                print(f"  ✅ Đã parse {len(lessons)} lessons")
-                all_lessons.extend(lessons)
-            else:
-                print(f"  ⚠️  Không có dữ liệu hợp lệ")
+    try:
+        return _import_sources(db[LESSONS_COLLECTION], sources or mctest_sources(), dry_run, batch_size, **pipeline_options)
+    finally:
+        close_db()
+
+class StageStats:
+    """Thống kê throughput 1 stage (thread-safe)"""
+
+    def __init__(self, name, unit):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def report(self, wall_seconds):
+        busy_rate = self.items / self.busy_seconds if self.busy_seconds else 0.0
+        wall_rate = self.items / wall_seconds if wall_seconds else 0.0
+        return (f"  {self.name:<6} {self.items:>8} {self.unit:<6} | busy {self.busy_seconds:7.2f}s "
+                f"({busy_rate:,.0f} {self.unit}/s) | wall {wall_rate:,.0f} {self.unit}/s")
+
+def _completed_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+def _read_dataset(label, tsv_source, ans_source, parse_pool, out_queue, read_stats, stop, chunk_lines):
+    """Thread đọc: stream cặp dòng, gom chunk rồi gửi sang process pool; future vào queue cho writer"""
+    chunk = []
+    started = time.perf_counter()
+
+    def submit():
+        read_stats.add(len(chunk), time.perf_counter() - started)
+        pairs = list(chunk)
+        if parse_pool is None:
+            future = _completed_future(parse_chunk(pairs))
+        else:
+            future = parse_pool.submit(parse_chunk, pairs)
+        # Queue có giới hạn: reader tự chậm lại khi parse/write không theo kịp
+        out_queue.put((label, future))
+        chunk.clear()
+
+    try:
+        for pair in iter_line_pairs(tsv_source, ans_source):
+            if stop.is_set():
+                return
+            chunk.append(pair)
+            if len(chunk) >= chunk_lines:
+                submit()
+                started = time.perf_counter()
+        if chunk:
+            submit()
+    except (OSError, requests.RequestException) as e:
+        print(f"  ❌ {label}: lỗi đọc dữ liệu: {e}")
+        out_queue.put((label, e))
+    finally:
+        out_queue.put((label, None))
+
+def _import_sources(lessons_col, sources, dry_run, batch_size=IMPORT_BATCH_SIZE,
+                    read_workers=READ_WORKERS, parse_workers=PARSE_WORKERS, chunk_lines=PARSE_CHUNK_LINES):
+    """
+    Pipeline song song:
+        N thread đọc (I/O) -> process pool parse (CPU) -> 1 writer (thread hiện tại) gom batch bulk_write
+    """
+    totals = {"inserted": 0, "updated": 0, "unchanged": 0}
+    per_label = {label: 0 for label, _, _ in sources}
+    read_stats = StageStats("read", "lines")
+    parse_stats = StageStats("parse", "docs")
+    write_stats = StageStats("write", "docs")
+
+    print(f"\n{'='*70}")
+    print(f"📖 Processing {len(sources)} datasets "
+          f"({read_workers} readers, {parse_workers or 'inline'} parse workers, batch {batch_size})")
+    print(f"{'='*70}")
+
+    out_queue = queue.Queue(maxsize=max(4, read_workers * 4))
+    stop = threading.Event()
+    buffer = []
+    read_error = None
+    write_error = None
+    started = time.perf_counter()
+
+    def flush(lessons):
+        t0 = time.perf_counter()
+        stats = upsert_lessons(lessons_col, lessons, dry_run=dry_run)
+        write_stats.add(len(lessons), time.perf_counter() - t0)
+        for key, value in stats.items():
+            totals[key] += value
+        print(f"  💾 {write_stats.items} lessons | Mới: {totals['inserted']} | Cập nhật: {totals['updated']} | Không đổi: {totals['unchanged']}")
+
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers else None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, read_workers), thread_name_prefix="import-read") as readers:
+            for label, tsv_source, ans_source in sources:
+                readers.submit(_read_dataset, label, tsv_source, ans_source,
+                               parse_pool, out_queue, read_stats, stop, chunk_lines)
+
+            # Writer duy nhất: chạy tới khi mọi reader báo xong (None)
+            pending = len(sources)
+            while pending:
+                label, item = out_queue.get()
+                if item is None:
+                    pending -= 1
+                    continue
+                if isinstance(item, Exception):
+                    # Reader lỗi (404, đứt stream...) -> import không đầy đủ: dừng các reader khác
+                    if read_error is None:
+                        read_error = item
+                        stop.set()
+                    continue
+                if read_error is not None or write_error is not None:
+                    continue
+                try:
+                    lessons, parse_seconds = item.result()
+                    parse_stats.add(len(lessons), parse_seconds)
+                    per_label[label] += len(lessons)
+                    buffer.extend(lessons)
+                    while len(buffer) >= batch_size:
+                        flush(buffer[:batch_size])
+                        del buffer[:batch_size]
+                except Exception as e:
+                    # Dừng reader, tiếp tục rút queue để thread đọc không bị block
+                    write_error = e
+                    stop.set()
+                    print(f"  ❌ Lỗi khi parse/ghi: {e}")
+
+        if buffer and read_error is None and write_error is None:
+            try:
+                flush(buffer)
+            except Exception as e:
+                write_error = e
+                print(f"  ❌ Lỗi khi ghi: {e}")
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
+
+    wall = time.perf_counter() - started
+    if read_error is not None:
+        print(f"\n❌ Import dừng do lỗi đọc dữ liệu: {read_error}")
+        return False
+    if write_error is not None:
+        return False
+
+    print(f"\n📚 Theo dataset:")
+    for label, count in per_label.items():
+        marker = "✅" if count else "⚠️ "
+        print(f"  {marker} {label}: {count} lessons")
+
+    print(f"\n⏱️  Throughput ({wall:.2f}s wall):")
+    for stage in (read_stats, parse_stats, write_stats):
+        print(stage.report(wall))
+
+    parsed_total = parse_stats.items
     
-    if not all_lessons:
+    if not parsed_total:
         print("\n❌ Không có dữ liệu để import")
         return False
     
-    # Xóa dữ liệu cũ
     print(f"\n{'='*70}")
-    print("🗑️  Xóa dữ liệu cũ trong database...")
-    result = lessons_col.delete_many({})
-    print(f"  Đã xóa {result.deleted_count} documents")
-    
-    # Insert vào database
-    print(f"\n💾 Đang lưu {len(all_lessons)} lessons vào database...")
-    try:
-        result = lessons_col.insert_many(all_lessons, ordered=False)
-        print(f"✅ Đã import thành công {len(result.inserted_ids)} lessons!")
-    except Exception as e:
-        print(f"❌ Lỗi khi insert: {e}")
-        return False
+    prefix = "🧪 (dry-run) " if dry_run else "✅ "
+    print(f"{prefix}Mới: {totals['inserted']} | Cập nhật: {totals['updated']} | Không đổi: {totals['unchanged']}")
     
     # Thống kê
     print(f"\n{'='*70}")
@@ -245,7 +521,6 @@ def import_mctest_from_github():
     print(f"{'='*70}")
     
     for i, sample in enumerate(lessons_col.find().limit(2)):
-        import json
         sample_copy = sample.copy()
         sample_copy.pop('_id', None)
         
@@ -287,7 +562,6 @@ def test_single_file():
     if lessons:
         print(f"\n✅ Parse thành công {len(lessons)} lessons")
         
-        import json
         for i, lesson in enumerate(lessons[:2]):
             print(f"\n{'='*70}")
             print(f"📋 Lesson {i+1}:")
@@ -296,9 +570,33 @@ def test_single_file():
         print("\n❌ Parse thất bại")
 
 if __name__ == "__main__":
-    import sys
-    
-    if len(sys.argv) > 1 and sys.argv[1] == '--test':
+    parser = argparse.ArgumentParser(description="Import MCTest lessons (incremental upsert)")
+    parser.add_argument("--tsv", action="append", default=[], help="File (hoặc URL) TSV thay cho MCTEST_URLS (có thể lặp lại)")
+    parser.add_argument("--ans", action="append", default=[], help="File (hoặc URL) answers đi kèm từng --tsv")
+    parser.add_argument("--dataset", action="append", help="Chỉ import dataset/split này, vd. mc500 hoặc mc160.dev")
+    parser.add_argument("--readers", type=int, default=READ_WORKERS, help="Số thread đọc song song")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="Số process parse (0 = parse trong thread đọc)")
+    parser.add_argument("--dry-run", action="store_true", help="Chỉ so sánh, không ghi database")
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE, help="Số lesson mỗi bulk_write")
+    parser.add_argument("--test", action="store_true", help="Chỉ download & parse mc160.train")
+    args = parser.parse_args()
+
+    if args.test:
         test_single_file()
     else:
-        import_mctest_from_github()
\ No newline at end of file
+        if len(args.tsv) != len(args.ans):
+            parser.error("--tsv và --ans phải đi cùng nhau")
+        if args.tsv:
+            sources = [(os.path.basename(tsv), tsv, ans) for tsv, ans in zip(args.tsv, args.ans)]
+        else:
+            sources = mctest_sources(args.dataset)
+            if not sources:
+                parser.error(f"Không có dataset nào khớp {args.dataset}")
+        ok = import_mctest_from_github(
+            sources,
+            dry_run=args.dry_run,
+            batch_size=max(1, args.batch_size),
+            read_workers=max(1, args.readers),
+            parse_workers=max(0, args.parse_workers),
+        )
+        sys.exit(0 if ok else 1)
@@ -0,0 +1,173 @@
+# app/logging_config.py
+"""
+Structured logging không block request.
+
+- Handler duy nhất trên root là QueueHandler: request handler / event loop
+  chỉ đẩy record vào queue (không ghi stdout trực tiếp)
+- QueueListener (thread nền) format JSON lines và ghi ra stdout
+- Level theo module: LOG_LEVELS="app.services.llm_service=DEBUG,pymongo=WARNING"
+- Sampling cho path ồn ào (chỉ áp dụng record < WARNING):
+  LOG_SAMPLING="app.api.lesson=0.1"
+- Queue đầy thì bỏ record và đếm (dropped_records), không chặn caller
+
+Gọi setup_logging() 1 lần trước khi import các module app (main.py làm việc này).
+Module dùng như bình thường: logger = logging.getLogger(__name__)
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# Attribute chuẩn của LogRecord; phần còn lại (từ extra=...) đưa vào JSON
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    """"a=1,b=2" -> {"a": "1", "b": "2"}"""
+    result = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            if key.strip():
+                result[key.strip()] = value.strip()
+    return result
+
+
+class JsonFormatter(logging.Formatter):
+    """1 record = 1 dòng JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        elif record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Giữ lại một tỉ lệ record < WARNING cho logger khớp prefix dài nhất."""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        # prefix dài nhất được xét trước
+        self._rates = sorted(rates.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self._rates:
+            return True
+        name = record.name
+        for prefix, rate in self._rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return random.random() < rate
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler không block: queue đầy thì bỏ record."""
+
+    def __init__(self, q: "queue.Queue"):
+        super().__init__(q)
+        self.dropped_records = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Format message + traceback ngay tại chỗ (args có thể bị mutate sau đó),
+        # nhưng giữ traceback ở field riêng thay vì nối vào msg như QueueHandler gốc
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging():
+    """Cấu hình root logger. Idempotent."""
+    global _listener, _queue_handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+
+        stream = logging.StreamHandler(sys.stdout)
+        if LOG_FORMAT == "json":
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+        q: "queue.Queue" = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = DroppingQueueHandler(q)
+        rates = {}
+        for name, rate in _parse_mapping(LOG_SAMPLING).items():
+            try:
+                rates[name] = float(rate)
+            except ValueError:
+                pass
+        if rates:
+            _queue_handler.addFilter(SamplingFilter(rates))
+        # request_id của request hiện tại (contextvar) -> field trong JSON
+        from app.services.tracing import RequestIdLogFilter
+        _queue_handler.addFilter(RequestIdLogFilter())
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        for name, level in _parse_mapping(LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level.upper())
+
+        _listener = logging.handlers.QueueListener(q, stream, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queue rồi dừng thread ghi log."""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_logging_stats() -> Dict[str, int]:
+    if _queue_handler is None:
+        return {"queue_depth": 0, "dropped_records": 0}
+    return {
+        "queue_depth": _queue_handler.queue.qsize(),
+        "dropped_records": _queue_handler.dropped_records,
+    }
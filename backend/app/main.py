@@ -1,13 +1,26 @@
 # backend/app/main.py
+import logging
+
+from app.logging_config import setup_logging, shutdown_logging, get_logging_stats
+
+# Cấu hình logging trước khi import các module app khác
+setup_logging()
+
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from pathlib import Path
 import os
 from bson import ObjectId
 
-from app.db import init_db, close_db, get_db
+from app.db import init_db, close_db, get_lessons_collection, init_async_db, close_async_db, get_async_db, check_db_health, get_pool_stats
+from app.services.metrics import MetricsMiddleware, register_collector, render_metrics, gauge_samples
+from app.services.tracing import TracingMiddleware, exporter as trace_exporter
+from app.services.loop_monitor import loop_monitor, LOOP_MONITOR_ENABLED, LOOP_DEBUG_ENDPOINT
+logger = logging.getLogger(__name__)
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(BASE_DIR / ".env")
 
@@ -34,6 +47,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+# Ngoài cùng: request id có sẵn cho mọi middleware / handler phía trong
+app.add_middleware(TracingMiddleware)
 
 APP_DIR = Path(__file__).resolve().parent
 TEMP_TTS_DIR = APP_DIR / "temp_tts"
@@ -70,17 +86,23 @@ def root():
             },
             "lessons": {
                 "get_lesson": "/api/lessons/{lesson_id}?use_short=true",
-                "list_lessons": "/api/lessons?limit=50",
+                "list_lessons": "/api/lessons?limit=50&cursor={next_cursor}",
+                "search": "/api/lessons/search?q={keyword}",
+                "batch": "POST /api/lessons/batch",
                 "get_story": "/api/lessons/{lesson_id}/story",
                 "get_questions": "/api/lessons/{lesson_id}/questions",
             },
             "progress": {
                 "record_completion": "/api/progress/complete",
+                "record_batch": "POST /api/progress/batch",
                 "get_all_progress": "/api/progress/all",
                 "get_stats": "/api/progress/stats",
-                "leaderboard": "/api/progress/leaderboard",
+                "activity": "/api/progress/activity?start=YYYY-MM-DD&end=YYYY-MM-DD",
+                "leaderboard": "/api/progress/leaderboard?board=global|weekly|lesson",
             },
             "voice_chat": "/api/voice-chat",
+            "health": "/health",
+            "metrics": "/metrics",
             "stt": "/api/speech-to-text",
         },
         "notes": {
@@ -90,75 +112,167 @@ def root():
     }
 
 
+def _runtime_gauges():
+    """Gauge đọc lúc scrape: pool Mongo, hàng đợi bcrypt, user cache, lesson catalog"""
+    from app.services.password_hasher import password_hasher
+    from app.services.user_cache import user_cache
+    from app.services.lesson_catalog import lesson_catalog
+
+    pools = get_pool_stats()
+    yield ("mongo_pool", "gauge", "MongoDB connection pool",
+           [s for name, stats in pools.items() for s in gauge_samples(stats, {"client": name})])
+    yield ("password_hasher", "gauge", "bcrypt worker pool", gauge_samples(password_hasher.stats()))
+    yield ("user_cache", "gauge", "Auth user cache", gauge_samples(user_cache.stats()))
+    yield ("lesson_catalog_size", "gauge", "Số lesson trong in-memory catalog", [({}, len(lesson_catalog))])
+    yield ("log_queue", "gauge", "Structured log queue", gauge_samples(get_logging_stats()))
+    yield ("trace_exporter", "gauge", "Trace span exporter", gauge_samples(trace_exporter.stats()))
+
+
+register_collector(_runtime_gauges)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+if LOOP_DEBUG_ENDPOINT:
+    @app.get("/debug/loop", include_in_schema=False)
+    def debug_loop():
+        """Event loop lag, threadpool và các lần loop bị block gần nhất (kèm stack)"""
+        return {
+            "enabled": LOOP_MONITOR_ENABLED,
+            **loop_monitor.stats(),
+            "recent_blocks": loop_monitor.recent_blocks(),
+        }
+
+
+@app.get("/health")
+async def health():
+    """Health check: MongoDB ping + connection pool metrics + bcrypt queue"""
+    from app.services.password_hasher import password_hasher
+
+    db_health = await check_db_health()
+    status_code = 200 if db_health["ok"] else 503
+    return JSONResponse(status_code=status_code, content={
+        "status": "ok" if db_health["ok"] else "degraded",
+        "mongodb": db_health,
+        "password_hasher": password_hasher.stats(),
+    })
+
+
 @app.on_event("startup")
 async def startup_event():
-    print("🚀 Starting up...")
+    logger.info("Starting up...")
+    trace_exporter.start()
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
     
     # Create temp_tts directory
     TEMP_TTS_DIR.mkdir(exist_ok=True)
-    print(f"✅ Created temp_tts directory: {TEMP_TTS_DIR}")
+    logger.info("temp_tts directory: %s", TEMP_TTS_DIR)
     
-    # Connect MongoDB
+    # Connect MongoDB (fail fast: không chạy app với db=None)
+    init_db()
+    await init_async_db()
+    logger.info("MongoDB connected")
+
+    # Tạo index 1 lần cho process (idempotent, không drop index nào). Không
+    # fatal: index lỗi/xung đột đã được log từng cái.
     try:
-        init_db()
-        db = get_db()
+        from app.schema import ensure_schema
+        await ensure_schema(get_async_db())
+    except Exception:
+        logger.exception("Schema bootstrap failed; continuing without guaranteed indexes")
+
+    # Leaderboard: nạp snapshot (hoặc rebuild) + snapshot định kỳ
+    try:
+        from app.services.leaderboard_service import leaderboard
+        await leaderboard.load(get_async_db())
+        leaderboard.start()
+    except Exception as e:
+        logger.exception("Leaderboard load failed")
+
+    try:
+        # Nạp lesson catalog vào memory (reads không còn đi qua Mongo)
+        from app.services.lesson_catalog import lesson_catalog
+        lessons_col = get_lessons_collection()
+        lesson_catalog.load(lessons_col)
+        lesson_catalog.start_auto_refresh(lessons_col)
         
         # 💡 OPTIONAL: Check if short_stories exist
-        lessons_with_short = db["lessons"].count_documents({"short_story": {"$exists": True}})
-        total_lessons = db["lessons"].count_documents({})
+        lessons_with_short = sum(1 for rec in lesson_catalog.records() if rec.short_story is not None)
+        total_lessons = len(lesson_catalog)
         
-        print(f"✅ MongoDB connected")
-        print(f"   📚 Total lessons: {total_lessons}")
-        print(f"   📝 Lessons with short_story: {lessons_with_short}")
+        logger.info("Lessons: %d total, %d with short_story", total_lessons, lessons_with_short)
         
         if lessons_with_short == 0:
-            print(f"   ⚠️  No short stories found! Run: python summarize_lessons_simple.py")
+            logger.warning("No short stories found! Run: python summarize_lessons_simple.py")
         
     except Exception as e:
-        print("❌ init_db raised:", e)
+        logger.exception("Lesson catalog load failed")
 
     # Initialize Groq LLM
     try:
         from app.services import llm_service
         await llm_service.init_client()
-        print("✅ Groq LLM initialized")
+        logger.info("Groq LLM initialized")
     except Exception as e:
-        print("⚠️ Groq LLM init failed:", e)
+        logger.warning("Groq LLM init failed: %s", e)
     
-    print("✅ All services initialized")
-    print("\n" + "="*70)
-    print("📝 API Endpoints:")
-    print("   Authentication:")
-    print("      POST   /api/auth/register")
-    print("      POST   /api/auth/login")
-    print("      GET    /api/auth/me (protected)")
-    print("\n   Lessons:")
-    print("      GET    /api/lessons/{id}?use_short=true (default)")
-    print("      GET    /api/lessons/{id}?use_short=false (original)")
-    print("      GET    /api/lessons/{id}/story")
-    print("      GET    /api/lessons/{id}/questions")
-    print("      GET    /api/lessons?limit=50")
-    print("\n   Voice & TTS:")
-    print("      POST   /api/voice-chat")
-    print("      POST   /api/speech-to-text")
-    print("="*70 + "\n")
+    logger.info("All services initialized", extra={"endpoints": [
+        "POST /api/auth/register", "POST /api/auth/login", "GET /api/auth/me",
+        "GET /api/lessons", "GET /api/lessons/search", "GET /api/lessons/{id}",
+        "POST /api/lessons/batch", "POST /api/voice-chat", "POST /api/speech-to-text",
+        "GET /health", "GET /metrics",
+    ]})
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    print("🛑 Shutting down...")
+    logger.info("Shutting down...")
     
+    # Lưu snapshot leaderboard trước khi đóng Mongo
+    try:
+        from app.services.leaderboard_service import leaderboard
+        await leaderboard.stop()
+    except Exception as e:
+        logger.warning("Leaderboard snapshot on shutdown failed: %s", e)
+
+    # Stop lesson catalog refresher
+    try:
+        from app.services.lesson_catalog import lesson_catalog
+        lesson_catalog.stop_auto_refresh()
+    except Exception as e:
+        logger.warning("Lesson catalog stop failed: %s", e)
+
     # Close MongoDB connection
     try:
         close_db()
     except Exception as e:
-        print("❌ close_db raised:", e)
+        logger.error("close_db raised: %s", e)
+
+    try:
+        close_async_db()
+    except Exception as e:
+        logger.error("close_async_db raised: %s", e)
+
+    # Stop bcrypt worker pool
+    try:
+        from app.services.password_hasher import password_hasher
+        password_hasher.shutdown()
+    except Exception as e:
+        logger.warning("Password hasher shutdown failed: %s", e)
 
     # Close Groq client
     try:
         from app.services import llm_service
         await llm_service.close_client()
     except Exception as e:
-        print("⚠️ Groq client close failed:", e)
+        logger.warning("Groq client close failed: %s", e)
     
-    print("✅ Cleanup complete")
\ No newline at end of file
+    loop_monitor.stop()
+    trace_exporter.stop()
+    logger.info("Cleanup complete")
+    shutdown_logging()
\ No newline at end of file
@@ -0,0 +1,186 @@
+# app/schema.py
+"""
+Schema / index bootstrap cho MongoDB.
+
+Chạy 1 lần mỗi process lúc startup (idempotent: create_index với spec
+giống hệt là no-op trên server). Request handler không tạo index nữa.
+
+INDEX_SPECS là nguồn sự thật duy nhất; script `create_index.py` dùng lại
+cùng spec qua `ensure_schema_sync`.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEX_SPECS: Dict[str, List[Dict[str, Any]]] = {
+    "lessons": [
+        {"keys": [("id", 1)], "name": "idx_lesson_id", "unique": True},
+    ],
+    "user_progress": [
+        {"keys": [("user_id", 1), ("lesson_id", 1)], "name": "user_lesson_idx", "unique": True},
+        {"keys": [("user_id", 1)], "name": "user_idx"},
+    ],
+    "learning_logs": [
+        {"keys": [("user_id", 1), ("date", 1)], "name": "user_date_idx", "unique": True},
+        {"keys": [("user_id", 1)], "name": "logs_user_idx"},
+    ],
+    "user_stats": [
+        {"keys": [("user_id", 1)], "name": "stats_user_idx", "unique": True},
+    ],
+    "progress_submissions": [
+        # Idempotency key cho batch submit (client_id do client sinh)
+        {"keys": [("user_id", 1), ("client_id", 1)], "name": "user_client_idx", "unique": True},
+        {"keys": [("created_at", 1)], "name": "submission_ttl_idx", "expireAfterSeconds": 30 * 24 * 3600},
+    ],
+    "leaderboard_snapshots": [
+        # 1 document/(board, user); partial vì snapshot định dạng cũ không có 2 field này
+        {"keys": [("board", 1), ("user_id", 1)], "name": "board_user_idx", "unique": True,
+         "partialFilterExpression": {"board": {"$exists": True}}},
+    ],
+    "users": [
+        {"keys": [("email", 1)], "name": "email_idx", "unique": True},
+        # Username so khớp không phân biệt hoa thường qua field chuẩn hoá
+        {"keys": [("username_lower", 1)], "name": "username_lower_idx", "unique": True},
+    ],
+}
+
+# Backfill dữ liệu cần có trước khi tạo index: (collection, filter, pipeline update)
+DATA_MIGRATIONS: List[Tuple[str, Dict[str, Any], List[Dict[str, Any]]]] = [
+    (
+        "users",
+        {"username_lower": {"$exists": False}, "username": {"$type": "string"}},
+        [{"$set": {"username_lower": {"$toLower": "$username"}}}],
+    ),
+    (
+        # Field tạm của save_progress cũ, không còn được lưu
+        "user_progress",
+        {"prev_best_score": {"$exists": True}},
+        [{"$unset": "prev_best_score"}],
+    ),
+]
+
+# IndexOptionsConflict (85): cùng key nhưng khác tên/option
+# IndexKeySpecsConflict (86): cùng tên nhưng khác key
+_CONFLICT_CODES = {85, 86}
+
+_bootstrapped = False
+_bootstrap_lock = asyncio.Lock()
+
+
+def _index_kwargs(spec: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in spec.items() if k != "keys"}
+
+
+def _report(collection_name: str, spec: Dict[str, Any], error: Exception):
+    logger.warning("Index %s.%s not created: %s", collection_name, spec['name'], error)
+
+
+def _normalize_keys(keys) -> List[Tuple[str, Any]]:
+    items = keys.items() if hasattr(keys, "items") else keys
+    return [(field, int(d) if isinstance(d, float) else d) for field, d in items]
+
+
+def _conflicting_index(existing: List[Dict[str, Any]], spec: Dict[str, Any]):
+    """
+    Tên index đang chặn spec: cùng key (code 85, vd. index auto-named
+    "email_1") hoặc cùng tên (code 86). None nếu không tìm thấy.
+    """
+    keys = _normalize_keys(spec["keys"])
+    for index in existing:
+        if index["name"] == "_id_":
+            continue
+        if _normalize_keys(index["key"]) == keys:
+            return index["name"]
+    for index in existing:
+        if index["name"] == spec["name"]:
+            return index["name"]
+    return None
+
+
+def _report_conflict(collection_name: str, spec: Dict[str, Any], name: Optional[str], error: Exception):
+    logger.warning(
+        "Index %s.%s conflicts with existing index %s, skipped "
+        "(run `python app/create_index.py --recreate-conflicts` to replace it): %s",
+        collection_name, spec["name"], name, error,
+    )
+
+
+def _restore_kwargs(index: Dict[str, Any]) -> Dict[str, Any]:
+    """Option để tạo lại index cũ từ list_indexes()"""
+    return {k: v for k, v in index.items() if k not in ("v", "key", "ns")}
+
+
+async def ensure_schema(db) -> bool:
+    """
+    Tạo tất cả index (async, motor). Chỉ chạy 1 lần mỗi process.
+
+    Không bao giờ drop index lúc startup: index xung đột (code 85/86) chỉ được
+    log rồi bỏ qua; thay thế bằng `create_index.py --recreate-conflicts`.
+
+    Returns:
+        True nếu lần gọi này thực sự chạy bootstrap
+    """
+    global _bootstrapped
+    if _bootstrapped:
+        return False
+    async with _bootstrap_lock:
+        if _bootstrapped:
+            return False
+        for collection_name, query, pipeline in DATA_MIGRATIONS:
+            result = await db[collection_name].update_many(query, pipeline)
+            if result.modified_count:
+                logger.info("%s: backfilled %d docs", collection_name, result.modified_count)
+        for collection_name, specs in INDEX_SPECS.items():
+            col = db[collection_name]
+            for spec in specs:
+                try:
+                    await col.create_index(spec["keys"], **_index_kwargs(spec))
+                except OperationFailure as e:
+                    if e.code not in _CONFLICT_CODES:
+                        _report(collection_name, spec, e)
+                        continue
+                    existing = [index async for index in col.list_indexes()]
+                    _report_conflict(collection_name, spec, _conflicting_index(existing, spec), e)
+        _bootstrapped = True
+        logger.info("MongoDB indexes ensured")
+        return True
+
+
+def ensure_schema_sync(db, recreate_conflicts: bool = False):
+    """
+    Bản sync (pymongo) cho scripts.
+
+    recreate_conflicts: drop index đang xung đột rồi tạo theo spec; nếu tạo
+    lại lỗi (vd. dữ liệu trùng chặn unique index) thì khôi phục index cũ.
+    """
+    for collection_name, query, pipeline in DATA_MIGRATIONS:
+        result = db[collection_name].update_many(query, pipeline)
+        logger.info("%s: backfilled %d docs", collection_name, result.modified_count)
+    for collection_name, specs in INDEX_SPECS.items():
+        col = db[collection_name]
+        for spec in specs:
+            try:
+                col.create_index(spec["keys"], **_index_kwargs(spec))
+                logger.info("Index %s.%s ensured", collection_name, spec["name"])
+            except OperationFailure as e:
+                if e.code not in _CONFLICT_CODES:
+                    _report(collection_name, spec, e)
+                    continue
+                existing = list(col.list_indexes())
+                name = _conflicting_index(existing, spec)
+                if not recreate_conflicts or name is None:
+                    _report_conflict(collection_name, spec, name, e)
+                    continue
+                old = next(index for index in existing if index["name"] == name)
+                col.drop_index(name)
+                try:
+                    col.create_index(spec["keys"], **_index_kwargs(spec))
+                    logger.info("Index %s.%s recreated (replaced %s)", collection_name, spec["name"], name)
+                except OperationFailure as retry_error:
+                    _report(collection_name, spec, retry_error)
+                    col.create_index(list(old["key"].items()), **_restore_kwargs(old))
+                    logger.warning("Index %s.%s restored", collection_name, name)
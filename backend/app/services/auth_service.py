@@ -1,30 +1,39 @@
+import logging
 import os
-import bcrypt  # Dùng bcrypt trực tiếp, không dùng passlib
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 from jose import JWTError, jwt
 from dotenv import load_dotenv
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from app.services.user_cache import user_cache, invalidate_user
+from app.services.password_hasher import password_hasher, PasswordHasherBusy
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # JWT Configuration
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-this-in-production')
 JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
 JWT_EXPIRATION_HOURS = int(os.getenv('JWT_EXPIRATION_HOURS', 24))
 
 def hash_password(password: str) -> str:
-    """Hash password sử dụng bcrypt"""
-    salt = bcrypt.gensalt()
-    hashed = bcrypt.hashpw(password.encode('utf-8'), salt)
-    return hashed.decode('utf-8')
+    """Hash password sử dụng bcrypt (sync - chỉ dùng trong scripts)"""
+    return password_hasher.hash_sync(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify password với hash"""
-    return bcrypt.checkpw(
-        plain_password.encode('utf-8'),
-        hashed_password.encode('utf-8')
-    )
+    """Verify password với hash (sync - chỉ dùng trong scripts)"""
+    return password_hasher.verify_sync(plain_password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    """Hash trên bcrypt worker pool, không block event loop"""
+    return await password_hasher.hash(password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify trên bcrypt worker pool, không block event loop"""
+    return await password_hasher.verify(plain_password, hashed_password)
 
 def create_access_token(data: dict) -> str:
     """Tạo JWT access token"""
@@ -42,7 +51,18 @@ def verify_token(token: str) -> Optional[dict]:
     except JWTError:
         return None
 
-def register_user(db, email: str, username: str, password: str) -> Tuple[bool, str, Optional[dict]]:
+def _duplicate_message(error: DuplicateKeyError) -> str:
+    """Map lỗi unique index sang message cho client"""
+    details = error.details or {}
+    fields = set(details.get('keyPattern') or details.get('keyValue') or {})
+    if not fields:
+        # Server cũ không trả keyPattern -> đọc tên index trong errmsg
+        fields = {'email'} if 'email' in str(error) else {'username_lower'}
+    if 'email' in fields:
+        return "Email đã được sử dụng"
+    return "Username đã được sử dụng"
+
+async def register_user(db, email: str, username: str, password: str) -> Tuple[bool, str, Optional[dict]]:
     """
     Đăng ký user mới
     
@@ -59,60 +79,62 @@ def register_user(db, email: str, username: str, password: str) -> Tuple[bool, s
         if len(password) < 6:
             return False, "Password phải có ít nhất 6 ký tự", None
         
-        # Kiểm tra email đã tồn tại chưa
-        if users_collection.find_one({'email': email.lower().strip()}):
-            return False, "Email đã được sử dụng", None
-        
-        # Kiểm tra username đã tồn tại chưa
-        if users_collection.find_one({'username': username.strip()}):
-            return False, "Username đã được sử dụng", None
-        
+        email_norm = email.lower().strip()
+        username_norm = username.strip()
+
         # Hash password
-        hashed_pwd = hash_password(password)
+        hashed_pwd = await hash_password_async(password)
         
         # Tạo user document
         user_doc = {
-            'email': email.lower().strip(),
-            'username': username.strip(),
+            'email': email_norm,
+            'username': username_norm,
+            'username_lower': username_norm.lower(),
             'password_hash': hashed_pwd,
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow(),
             'is_active': True
         }
         
-        # Insert vào database
-        result = users_collection.insert_one(user_doc)
+        # Insert 1 lần; unique index trên email / username_lower chặn trùng
+        try:
+            result = await users_collection.insert_one(user_doc)
+        except DuplicateKeyError as e:
+            return False, _duplicate_message(e), None
         user_id = str(result.inserted_id)
         
         # Tạo token
         token = create_access_token({
             "user_id": user_id,
-            "email": email.lower().strip()
+            "email": email_norm,
+            "username": username_norm
         })
         
         # Trả về thông tin user
         user_data = {
             'user_id': user_id,
-            'email': email.lower().strip(),
-            'username': username.strip(),
+            'email': email_norm,
+            'username': username_norm,
             'token': token
         }
         
         return True, "Đăng ký thành công", user_data
         
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
-        print(f"Register error: {e}")
+        logger.exception("Register error")
         return False, f"Lỗi: {str(e)}", None
 
-def login_user(db, username: str, password: str) -> Tuple[bool, str, Optional[dict]]:
+async def login_user(db, username: str, password: str) -> Tuple[bool, str, Optional[dict]]:
     try:
         users_collection = db['users']
 
         if not username or not password:
             return False, "Username và password không được để trống", None
 
-        # Tìm user theo username
-        user = users_collection.find_one({'username': username.lower().strip()})
+        # Tìm user theo username (không phân biệt hoa thường, dùng unique index)
+        user = await users_collection.find_one({'username_lower': username.lower().strip()})
 
         # ❌ Username không tồn tại
         if not user:
@@ -123,17 +145,18 @@ def login_user(db, username: str, password: str) -> Tuple[bool, str, Optional[di
             return False, "Tài khoản đã bị vô hiệu hóa", None
 
         # ❌ Password sai
-        if not verify_password(password, user['password_hash']):
+        if not await verify_password_async(password, user['password_hash']):
             return False, "Password không đúng", None
 
         # ✔ Đăng nhập thành công
         user_id = str(user['_id'])
         token = create_access_token({
             "user_id": user_id,
+            "email": user['email'],
             "username": user['username']
         })
 
-        users_collection.update_one(
+        await users_collection.update_one(
             {'_id': user['_id']},
             {'$set': {'last_login': datetime.utcnow()}}
         )
@@ -145,35 +168,74 @@ def login_user(db, username: str, password: str) -> Tuple[bool, str, Optional[di
             'token': token
         }
 
+    except PasswordHasherBusy:
+        raise
     except Exception as e:
-        print(f"Login error: {e}")
+        logger.exception("Login error")
         return False, f"Lỗi: {str(e)}", None
 
 
-def get_user_from_token(db, token: str) -> Optional[dict]:
+async def _get_cached_user(db, user_id: str) -> Optional[dict]:
+    """
+    User record tối thiểu (email, username, is_active) qua TTL cache.
+    Cache hit = 0 DB round trip.
+    """
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    
+    user = await db['users'].find_one(
+        {'_id': ObjectId(user_id)},
+        {'email': 1, 'username': 1, 'is_active': 1}
+    )
+    record = {
+        'email': user.get('email') if user else None,
+        'username': user.get('username') if user else None,
+        # User không tồn tại (đã xóa) cũng cache như bị khóa
+        'is_active': bool(user) and user.get('is_active', True)
+    }
+    user_cache.set(user_id, record)
+    return record
+
+async def get_user_from_token(db, token: str) -> Optional[dict]:
     """
     Lấy thông tin user từ token
     
+    Fast path: email/username lấy từ claims trong JWT, trạng thái
+    is_active kiểm tra qua TTL cache (không query users mỗi request).
+    
     Returns:
         user dict or None
     """
     try:
         payload = verify_token(token)
-        if not payload:
+        if not payload or not payload.get('user_id'):
             return None
         
-        users_collection = db['users']
-        user = users_collection.find_one({'_id': ObjectId(payload['user_id'])})
+        user_id = payload['user_id']
+        record = await _get_cached_user(db, user_id)
         
-        if not user:
+        if not record['is_active']:
             return None
         
         return {
-            'user_id': str(user['_id']),
-            'email': user['email'],
-            'username': user['username']
+            'user_id': user_id,
+            # Token cũ (trước khi có đủ claims) fallback về record
+            'email': payload.get('email') or record['email'],
+            'username': payload.get('username') or record['username']
         }
         
     except Exception as e:
-        print(f"Error getting user from token: {e}")
-        return None
\ No newline at end of file
+        logger.warning("Error getting user from token: %s", e)
+        return None
+
+async def set_user_active(db, user_id: str, is_active: bool) -> bool:
+    """
+    Khóa / mở khóa user và invalidate cache để token hiện có bị từ chối ngay.
+    """
+    result = await db['users'].update_one(
+        {'_id': ObjectId(user_id)},
+        {'$set': {'is_active': is_active, 'updated_at': datetime.utcnow()}}
+    )
+    invalidate_user(user_id)
+    return result.matched_count > 0
@@ -4,6 +4,7 @@ import time
 import uuid
 from typing import List, Dict, Any, Optional
 
+
 class ConversationStore:
     """
     In-memory conversation store.
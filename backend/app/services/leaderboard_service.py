@@ -0,0 +1,441 @@
+# app/services/leaderboard_service.py
+"""
+Leaderboard với bảng xếp hạng giữ sẵn trong memory.
+
+Mỗi board là một skip list có span (như sorted set của Redis) theo
+(-score, user_id), nên:
+    - "my rank": O(log n)
+    - top-N: O(log n + N)
+    - update: xóa + chèn O(log n) kỳ vọng
+
+Boards:
+    - "global": tổng best_score của mọi lesson (cập nhật bằng best delta)
+    - "weekly:<YYYY-Www>": tổng số câu đúng đã nộp trong tuần ISO hiện tại
+    - "lesson:<lesson_id>": best_score của lesson đó
+
+Cập nhật incremental từ ProgressService. Snapshot định kỳ vào collection
+`leaderboard_snapshots`, 1 document cho mỗi (board, user) nên không bị giới
+hạn 16MB và chỉ ghi các entry đã đổi:
+    - điểm cộng dồn (global / weekly) được ghi bằng $inc phần delta, nên
+      nhiều worker cùng ghi không đè lên nhau
+    - điểm ghi đè (lesson best, rebuild, batch) ghi $set giá trị tuyệt đối
+      (lấy từ Mongo nên worker nào ghi cũng như nhau)
+Nếu chưa có snapshot thì rebuild từ user_stats + user_progress.
+
+Lưu ý: state nằm trong process, nên khi chạy nhiều worker mỗi worker chỉ
+thấy update của chính nó cho tới lần load tiếp theo.
+"""
+import logging
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("LEADERBOARD_SNAPSHOT_SECONDS", 60))
+SNAPSHOT_COLLECTION = "leaderboard_snapshots"
+
+GLOBAL_BOARD = "global"
+
+
+def weekly_board_name(now: Optional[datetime] = None) -> str:
+    year, week, _ = (now or datetime.now()).isocalendar()
+    return f"weekly:{year}-W{week:02d}"
+
+
+def lesson_board_name(lesson_id: str) -> str:
+    return f"lesson:{lesson_id}"
+
+
+class _Node:
+    __slots__ = ("key", "next", "span")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        # span[i]: số node bước qua khi đi theo next[i] (để tính rank)
+        self.span: List[int] = [0] * level
+
+
+class _SkipList:
+    """Skip list có thứ tự tăng dần, đếm rank theo span. Key không trùng."""
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._level = 1
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        x = self._head
+        for i in reversed(range(self._level)):
+            rank[i] = 0 if i == self._level - 1 else rank[i + 1]
+            while x.next[i] is not None and x.next[i].key < key:
+                rank[i] += x.span[i]
+                x = x.next[i]
+            update[i] = x
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                self._head.span[i] = self._len
+            self._level = level
+
+        node = _Node(key, level)
+        for i in range(level):
+            node.next[i] = update[i].next[i]
+            update[i].next[i] = node
+            node.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = rank[0] - rank[i] + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self._len += 1
+
+    def remove(self, key) -> bool:
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        x = self._head
+        for i in reversed(range(self._level)):
+            while x.next[i] is not None and x.next[i].key < key:
+                x = x.next[i]
+            update[i] = x
+
+        x = x.next[0]
+        if x is None or x.key != key:
+            return False
+        for i in range(self._level):
+            if update[i].next[i] is x:
+                update[i].span[i] += x.span[i] - 1
+                update[i].next[i] = x.next[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.next[self._level - 1] is None:
+            self._level -= 1
+        self._len -= 1
+        return True
+
+    def count_less(self, key) -> int:
+        """Số key < key (tương đương bisect_left)"""
+        count = 0
+        x = self._head
+        for i in reversed(range(self._level)):
+            while x.next[i] is not None and x.next[i].key < key:
+                count += x.span[i]
+                x = x.next[i]
+        return count
+
+    def __iter__(self):
+        x = self._head.next[0]
+        while x is not None:
+            yield x.key
+            x = x.next[0]
+
+
+class RankedBoard:
+    """Một bảng xếp hạng: score theo user + skip list để rank/top-N."""
+
+    def __init__(self):
+        self._scores: Dict[str, int] = {}
+        self._order = _SkipList()  # (-score, user_id), tăng dần
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def get(self, user_id: str) -> Optional[int]:
+        return self._scores.get(user_id)
+
+    def set(self, user_id: str, score: int):
+        old = self._scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            self._order.remove((-old, user_id))
+        self._scores[user_id] = score
+        self._order.insert((-score, user_id))
+
+    def add(self, user_id: str, delta: int):
+        if delta:
+            self.set(user_id, self._scores.get(user_id, 0) + delta)
+
+    def remove(self, user_id: str):
+        old = self._scores.pop(user_id, None)
+        if old is not None:
+            self._order.remove((-old, user_id))
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """Rank kiểu thi đấu (đồng điểm cùng hạng), bắt đầu từ 1."""
+        score = self._scores.get(user_id)
+        if score is None:
+            return None
+        return self._order.count_less((-score,)) + 1
+
+    def top(self, n: int) -> List[Tuple[int, str, int]]:
+        """[(rank, user_id, score)] cho n user đầu."""
+        out = []
+        prev_score = None
+        rank = 0
+        for idx, (neg_score, user_id) in enumerate(islice(self._order, n)):
+            if neg_score != prev_score:
+                rank = idx + 1
+                prev_score = neg_score
+            out.append((rank, user_id, -neg_score))
+        return out
+
+    def items(self) -> List[Tuple[str, int]]:
+        return [(user_id, -neg_score) for neg_score, user_id in self._order]
+
+
+class LeaderboardService:
+    def __init__(self):
+        self._boards: Dict[str, RankedBoard] = {}
+        self._usernames: Dict[str, str] = {}
+        # (board, user_id) -> delta chưa ghi ($inc), hoặc None = ghi giá trị tuyệt đối
+        self._pending: Dict[Tuple[str, str], Optional[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._db = None
+
+    # ------------------------------------------------------------------ #
+    # Updates
+    # ------------------------------------------------------------------ #
+    def _board(self, name: str) -> RankedBoard:
+        board = self._boards.get(name)
+        if board is None:
+            board = self._boards[name] = RankedBoard()
+        return board
+
+    def _mark_set(self, board_name: str, user_id: str):
+        self._pending[(board_name, user_id)] = None
+
+    def _mark_inc(self, board_name: str, user_id: str, delta: int):
+        key = (board_name, user_id)
+        if key in self._pending and self._pending[key] is None:
+            return  # đã chờ ghi giá trị tuyệt đối
+        self._pending[key] = self._pending.get(key, 0) + delta
+
+    def record_progress(
+        self,
+        user_id: str,
+        lesson_id: str,
+        score: int,
+        best_score: int,
+        best_delta: int,
+        username: Optional[str] = None,
+        now: Optional[datetime] = None
+    ):
+        """Gọi sau mỗi lần save_progress."""
+        if username:
+            self._usernames[user_id] = username
+
+        weekly = weekly_board_name(now)
+        lesson = lesson_board_name(lesson_id)
+
+        if best_delta:
+            self._board(GLOBAL_BOARD).add(user_id, best_delta)
+            self._mark_inc(GLOBAL_BOARD, user_id, best_delta)
+        if score:
+            self._board(weekly).add(user_id, score)
+            self._mark_inc(weekly, user_id, score)
+        self._board(lesson).set(user_id, best_score)
+        self._mark_set(lesson, user_id)
+
+    def set_score(self, board_name: str, user_id: str, score: int, username: Optional[str] = None):
+        """Ghi đè điểm (dùng khi rebuild / batch submit)."""
+        if username:
+            self._usernames[user_id] = username
+        self._board(board_name).set(user_id, score)
+        self._mark_set(board_name, user_id)
+
+    def add_score(self, board_name: str, user_id: str, delta: int, username: Optional[str] = None):
+        if username:
+            self._usernames[user_id] = username
+        if delta:
+            self._board(board_name).add(user_id, delta)
+            self._mark_inc(board_name, user_id, delta)
+
+    def remove_progress(self, user_id: str, lesson_id: str, best_score: int):
+        """Gọi khi xóa progress 1 lesson: bỏ khỏi board lesson, trừ global."""
+        lesson = lesson_board_name(lesson_id)
+        board = self._boards.get(lesson)
+        if board is not None:
+            board.remove(user_id)
+        self._mark_set(lesson, user_id)
+        if best_score and self._board(GLOBAL_BOARD).get(user_id) is not None:
+            self._board(GLOBAL_BOARD).add(user_id, -best_score)
+            self._mark_inc(GLOBAL_BOARD, user_id, -best_score)
+
+    # ------------------------------------------------------------------ #
+    # Queries
+    # ------------------------------------------------------------------ #
+    def _entry(self, rank: int, user_id: str, score: int) -> Dict:
+        return {
+            "rank": rank,
+            "user_id": user_id,
+            "username": self._usernames.get(user_id),
+            "score": score,
+        }
+
+    def get_leaderboard(self, board_name: str, limit: int = 10, user_id: Optional[str] = None) -> Dict:
+        board = self._boards.get(board_name) or RankedBoard()
+
+        me = None
+        if user_id is not None:
+            rank = board.rank(user_id)
+            if rank is not None:
+                me = self._entry(rank, user_id, board.get(user_id))
+
+        return {
+            "board": board_name,
+            "entries": [self._entry(rank, uid, score) for rank, uid, score in board.top(limit)],
+            "me": me,
+            "total_users": len(board),
+        }
+
+    # ------------------------------------------------------------------ #
+    # Persistence
+    # ------------------------------------------------------------------ #
+    async def load(self, db):
+        """Nạp từ snapshot; nếu chưa có thì rebuild từ user_stats/user_progress."""
+        self._db = db
+        col = db[SNAPSHOT_COLLECTION]
+        current_week = weekly_board_name()
+
+        # Dọn snapshot định dạng cũ (1 document/board) và các tuần đã qua
+        await col.delete_many({"entries": {"$exists": True}})
+        await col.delete_many({"board": {"$regex": "^weekly:", "$ne": current_week}})
+
+        loaded = 0
+        async for entry in col.find({}, {"board": 1, "user_id": 1, "score": 1, "username": 1}):
+            self._board(entry["board"]).set(entry["user_id"], entry.get("score", 0))
+            if entry.get("username"):
+                self._usernames[entry["user_id"]] = entry["username"]
+            loaded += 1
+
+        if loaded:
+            logger.info("Leaderboard loaded from snapshot: %s boards, %s entries", len(self._boards), loaded)
+            return
+
+        await self.rebuild(db)
+
+    async def rebuild(self, db):
+        self._boards.clear()
+        self._pending.clear()
+
+        async for stats in db["user_stats"].find({}, {"user_id": 1, "best_score_sum": 1}):
+            self.set_score(GLOBAL_BOARD, stats["user_id"], stats.get("best_score_sum", 0))
+
+        async for progress in db["user_progress"].find({}, {"user_id": 1, "lesson_id": 1, "best_score": 1}):
+            self.set_score(lesson_board_name(progress["lesson_id"]), progress["user_id"], progress.get("best_score", 0))
+
+        # Weekly: xấp xỉ bằng last_score của các lesson làm trong tuần
+        # (user_progress không lưu từng lần nộp)
+        now = datetime.now()
+        week_start = datetime.combine((now - timedelta(days=now.weekday())).date(), datetime.min.time())
+        weekly = weekly_board_name(now)
+        pipeline = [
+            {"$match": {"updated_at": {"$gte": week_start}}},
+            {"$group": {"_id": "$user_id", "points": {"$sum": "$last_score"}}},
+        ]
+        async for row in db["user_progress"].aggregate(pipeline):
+            if row["points"]:
+                self.set_score(weekly, row["_id"], row["points"])
+
+        await self._load_usernames(db)
+        logger.info("Leaderboard rebuilt: %s boards", len(self._boards))
+
+    async def _load_usernames(self, db):
+        from bson import ObjectId
+
+        user_ids = {uid for board in self._boards.values() for uid, _ in board.items()}
+        object_ids = [ObjectId(uid) for uid in user_ids if ObjectId.is_valid(uid)]
+        if not object_ids:
+            return
+        async for user in db["users"].find({"_id": {"$in": object_ids}}, {"username": 1}):
+            self._usernames[str(user["_id"])] = user.get("username")
+
+    def _restore_pending(self, pending: Dict[Tuple[str, str], Optional[int]]):
+        """Trả các entry chưa ghi được về hàng đợi (gộp với update mới hơn)."""
+        for key, delta in pending.items():
+            if key not in self._pending:
+                self._pending[key] = delta
+            elif delta is None or self._pending[key] is None:
+                self._pending[key] = None
+            else:
+                self._pending[key] += delta
+
+    async def snapshot(self):
+        """Ghi các entry (board, user) đã thay đổi kể từ lần snapshot trước."""
+        if self._db is None or not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        now = datetime.now()
+
+        ops = []
+        for (name, user_id), delta in pending.items():
+            key = {"board": name, "user_id": user_id}
+            fields = {"updated_at": now}
+            if self._usernames.get(user_id):
+                fields["username"] = self._usernames[user_id]
+
+            if delta is not None:
+                ops.append(UpdateOne(key, {"$inc": {"score": delta}, "$set": fields}, upsert=True))
+                continue
+            board = self._boards.get(name)
+            score = board.get(user_id) if board is not None else None
+            if score is None:
+                ops.append(DeleteOne(key))
+            else:
+                ops.append(UpdateOne(key, {"$set": {**fields, "score": score}}, upsert=True))
+
+        try:
+            await self._db[SNAPSHOT_COLLECTION].bulk_write(ops, ordered=False)
+        except Exception as e:
+            # Có thể 1 phần đã ghi: $inc gửi lại sẽ bị cộng 2 lần, nên chỉ
+            # gửi lại giá trị tuyệt đối
+            self._restore_pending({key: None for key in pending})
+            logger.warning("Leaderboard snapshot failed: %s", e)
+
+    def _prune_weeks(self):
+        current_week = weekly_board_name()
+        for name in [n for n in self._boards if n.startswith("weekly:") and n != current_week]:
+            del self._boards[name]
+        for key in [k for k in self._pending if k[0].startswith("weekly:") and k[0] != current_week]:
+            del self._pending[key]
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+            await self.snapshot()
+            self._prune_weeks()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.snapshot()
+
+
+# Module-level singleton
+leaderboard = LeaderboardService()
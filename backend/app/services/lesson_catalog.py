@@ -0,0 +1,255 @@
+# app/services/lesson_catalog.py
+"""
+In-memory lesson catalog.
+
+Bộ MCTest (mc160/mc500) nhỏ và hầu như không đổi, nên toàn bộ collection
+`lessons` được nạp một lần lúc startup vào một snapshot bất biến:
+    - records: tuple các LessonRecord (sắp xếp theo id)
+    - by_id / by_mongo_id: index id -> record
+
+Snapshot được thay nguyên khối (atomic swap) khi dữ liệu đổi, reader
+không cần lock. Refresh qua MongoDB change stream nếu server hỗ trợ
+(replica set), nếu không thì reload định kỳ và so version.
+"""
+import logging
+import bisect
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+import pymongo
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.services.lesson_service import normalize_answer
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_SECONDS = int(os.getenv("LESSON_CATALOG_REFRESH_SECONDS", 300))
+
+_PROJECTION = {"id": 1, "story": 1, "short_story": 1, "questions": 1, "score": 1}
+
+
+class QuestionRecord(NamedTuple):
+    type: str
+    question: str
+    choices: Tuple[str, ...]
+    answer: Any
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": self.type,
+            "question": self.question,
+            "choices": list(self.choices),
+            "answer": self.answer,
+        }
+
+
+class LessonRecord(NamedTuple):
+    mongo_id: str
+    id: str
+    story: str
+    short_story: Optional[str]
+    questions: Tuple[QuestionRecord, ...]
+    score: Optional[int]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Trả về dict mới (giống document Mongo) để caller tự do sửa."""
+        doc = {
+            "_id": self.mongo_id,
+            "id": self.id,
+            "story": self.story,
+            "questions": [q.to_dict() for q in self.questions],
+            "score": self.score,
+        }
+        if self.short_story is not None:
+            doc["short_story"] = self.short_story
+        return doc
+
+
+class _Snapshot(NamedTuple):
+    records: Tuple[LessonRecord, ...]
+    ids: Tuple[str, ...]
+    by_id: Dict[str, LessonRecord]
+    by_mongo_id: Dict[str, LessonRecord]
+    version: str
+    loaded_at: float
+
+
+def _to_record(doc: Dict[str, Any]) -> LessonRecord:
+    mongo_id = str(doc["_id"])
+    questions = tuple(
+        QuestionRecord(
+            type=q.get("type", ""),
+            question=q.get("question", ""),
+            choices=tuple(q.get("choices") or ()),
+            answer=normalize_answer(q.get("answer")),
+        )
+        for q in doc.get("questions") or []
+    )
+    return LessonRecord(
+        mongo_id=mongo_id,
+        id=doc.get("id") or mongo_id,
+        story=doc.get("story") or "",
+        short_story=doc.get("short_story"),
+        questions=questions,
+        score=doc.get("score"),
+    )
+
+
+def _compute_version(records: Tuple[LessonRecord, ...]) -> str:
+    h = hashlib.sha1()
+    for rec in records:
+        h.update(repr(rec).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class LessonCatalog:
+    """
+    Catalog bất biến, thread-safe cho đọc (chỉ đọc self._snapshot một lần).
+    """
+
+    def __init__(self, refresh_interval: int = REFRESH_INTERVAL_SECONDS):
+        self._snapshot: Optional[_Snapshot] = None
+        self._refresh_interval = refresh_interval
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ------------------------------------------------------------------ #
+    # Loading
+    # ------------------------------------------------------------------ #
+    @property
+    def is_loaded(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def version(self) -> Optional[str]:
+        snap = self._snapshot
+        return snap.version if snap else None
+
+    def load(self, collection: pymongo.collection.Collection) -> bool:
+        """
+        Nạp toàn bộ lessons và swap snapshot.
+
+        Returns:
+            True nếu version thay đổi (hoặc lần nạp đầu tiên)
+        """
+        with self._reload_lock:
+            docs = collection.find({}, _PROJECTION).sort("id", 1)
+            # Sort lại trong Python: doc thiếu `id` dùng _id làm id
+            records = tuple(sorted((_to_record(doc) for doc in docs), key=lambda rec: rec.id))
+            version = _compute_version(records)
+
+            old = self._snapshot
+            if old is not None and old.version == version:
+                return False
+
+            self._snapshot = _Snapshot(
+                records=records,
+                ids=tuple(rec.id for rec in records),
+                by_id={rec.id: rec for rec in records},
+                by_mongo_id={rec.mongo_id: rec for rec in records},
+                version=version,
+                loaded_at=time.time(),
+            )
+            logger.info("Lesson catalog loaded: %s lessons (version %s)", len(records), version)
+            return True
+
+    # ------------------------------------------------------------------ #
+    # Reads
+    # ------------------------------------------------------------------ #
+    def get(self, mongo_id_or_custom_id: str) -> Optional[LessonRecord]:
+        snap = self._snapshot
+        if snap is None:
+            return None
+        rec = snap.by_id.get(mongo_id_or_custom_id)
+        if rec is None:
+            rec = snap.by_mongo_id.get(mongo_id_or_custom_id)
+        return rec
+
+    def records(self) -> Tuple[LessonRecord, ...]:
+        snap = self._snapshot
+        return snap.records if snap else ()
+
+    def current(self) -> Tuple[Tuple[LessonRecord, ...], Optional[str]]:
+        """(records, version) lấy từ cùng một snapshot"""
+        snap = self._snapshot
+        return (snap.records, snap.version) if snap else ((), None)
+
+    def page_after(self, cursor: Optional[str], limit: int) -> Tuple[Tuple[LessonRecord, ...], Optional[str]]:
+        """
+        Keyset pagination theo id (O(log n) nhờ bisect).
+
+        Returns:
+            (records, next_cursor) - next_cursor là None nếu hết trang
+        """
+        snap = self._snapshot
+        if snap is None:
+            return (), None
+        start = bisect.bisect_right(snap.ids, cursor) if cursor else 0
+        page = snap.records[start:start + limit]
+        has_more = start + limit < len(snap.records)
+        next_cursor = page[-1].id if page and has_more else None
+        return page, next_cursor
+
+    def __len__(self) -> int:
+        snap = self._snapshot
+        return len(snap.records) if snap else 0
+
+    # ------------------------------------------------------------------ #
+    # Auto refresh
+    # ------------------------------------------------------------------ #
+    def start_auto_refresh(self, collection: pymongo.collection.Collection):
+        """Chạy background thread giữ catalog đồng bộ với Mongo."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._refresh_loop,
+            args=(collection,),
+            name="lesson-catalog-refresh",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop_auto_refresh(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _refresh_loop(self, collection: pymongo.collection.Collection):
+        try:
+            self._watch_changes(collection)
+        except OperationFailure as e:
+            # Standalone mongod không hỗ trợ change stream -> polling
+            logger.info("Lesson catalog: change stream unavailable (%s), polling every %ss", e.code, self._refresh_interval)
+        except PyMongoError as e:
+            logger.warning("Lesson catalog: change stream error (%s), falling back to polling", e)
+
+        while not self._stop.wait(self._refresh_interval):
+            try:
+                self.load(collection)
+            except Exception as e:
+                logger.warning("Lesson catalog refresh failed: %s", e)
+
+    def _watch_changes(self, collection: pymongo.collection.Collection):
+        with collection.watch(max_await_time_ms=1000) as stream:
+            logger.info("Lesson catalog: watching change stream")
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                # Gom các thay đổi liên tiếp (ví dụ import hàng loạt) thành 1 lần reload
+                while stream.try_next() is not None:
+                    pass
+                try:
+                    self.load(collection)
+                except Exception as e:
+                    logger.warning("Lesson catalog reload failed: %s", e)
+
+
+# Module-level singleton
+lesson_catalog = LessonCatalog()
@@ -0,0 +1,142 @@
+# app/services/lesson_search.py
+"""
+Full-text lesson search trên in-memory catalog.
+
+Inverted index (term -> postings) xây từ story + questions + choices của
+mỗi lesson, ranking BM25. Term cuối của query được match theo prefix
+(gõ "elep" ra "elephant") bằng bisect trên vocabulary đã sort.
+
+Index được build lại lazily khi catalog version đổi.
+"""
+import logging
+import bisect
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.services.lesson_catalog import LessonCatalog, LessonRecord, lesson_catalog
+
+logger = logging.getLogger(__name__)
+
+# BM25 params
+K1 = 1.2
+B = 0.75
+
+# Trọng số field: story quan trọng hơn questions/choices
+STORY_WEIGHT = 2
+QUESTION_WEIGHT = 1
+
+MIN_PREFIX_LEN = 2
+MAX_PREFIX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class SearchHit(NamedTuple):
+    record: LessonRecord
+    score: float
+
+
+class LessonSearchIndex:
+    """Inverted index bất biến cho 1 catalog version."""
+
+    def __init__(self, records: Tuple[LessonRecord, ...], version: Optional[str]):
+        self.version = version
+        self.records = records
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.doc_len: List[int] = []
+
+        for doc_idx, rec in enumerate(records):
+            tf: Counter = Counter()
+            for term in tokenize(rec.story):
+                tf[term] += STORY_WEIGHT
+            for term in tokenize(rec.id):
+                tf[term] += STORY_WEIGHT
+            for q in rec.questions:
+                for term in tokenize(q.question):
+                    tf[term] += QUESTION_WEIGHT
+                for choice in q.choices:
+                    for term in tokenize(choice):
+                        tf[term] += QUESTION_WEIGHT
+            for term, freq in tf.items():
+                self.postings[term].append((doc_idx, freq))
+            self.doc_len.append(sum(tf.values()))
+
+        self.postings = dict(self.postings)
+        self.vocab = sorted(self.postings)
+        n = len(records)
+        # Mọi doc đều rỗng -> tổng = 0; dùng 1.0 để BM25 không chia cho 0
+        self.avg_doc_len = ((sum(self.doc_len) / n) if n else 0.0) or 1.0
+        self.idf = {
+            term: math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        start = bisect.bisect_left(self.vocab, prefix)
+        out = []
+        for term in self.vocab[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(prefix):
+                break
+            out.append(term)
+        return out
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        terms = tokenize(query)
+        if not terms or not self.records:
+            return []
+
+        # Term cuối cùng match theo prefix (search-as-you-type)
+        query_terms: List[str] = list(dict.fromkeys(terms[:-1]))
+        last = terms[-1]
+        if len(last) >= MIN_PREFIX_LEN:
+            query_terms.extend(t for t in self._expand_prefix(last) if t not in query_terms)
+        elif last not in query_terms:
+            query_terms.append(last)
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term in query_terms:
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self.idf[term]
+            for doc_idx, tf in plist:
+                norm = K1 * (1 - B + B * self.doc_len[doc_idx] / self.avg_doc_len)
+                scores[doc_idx] += idf * tf * (K1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda kv: (-kv[1], self.records[kv[0]].id))[:limit]
+        return [SearchHit(self.records[doc_idx], round(score, 4)) for doc_idx, score in top]
+
+
+class LessonSearch:
+    """Giữ index đồng bộ với catalog version (rebuild lazily)."""
+
+    def __init__(self, catalog: LessonCatalog):
+        self._catalog = catalog
+        self._index: Optional[LessonSearchIndex] = None
+        self._lock = threading.Lock()
+
+    def _current_index(self) -> LessonSearchIndex:
+        index = self._index
+        version = self._catalog.version
+        if index is not None and index.version == version:
+            return index
+        with self._lock:
+            records, version = self._catalog.current()
+            if self._index is None or self._index.version != version:
+                self._index = LessonSearchIndex(records, version)
+                logger.info("Lesson search index built: %s terms", len(self._index.vocab))
+            return self._index
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        return self._current_index().search(query, limit)
+
+
+# Module-level singleton (gắn với lesson_catalog toàn cục)
+lesson_search = LessonSearch(lesson_catalog)
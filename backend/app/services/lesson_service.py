@@ -1,8 +1,33 @@
 # app/services/lesson_service.py
-from typing import Any, Dict, List, Optional, Union
+import logging
+from typing import Any, Dict, List, Optional
+import re
 from bson import ObjectId
 import pymongo
 
+logger = logging.getLogger(__name__)
+
+
+def normalize_answer(ans: Any) -> Any:
+    """
+    Normalize answer field to int.
+    Handles MongoDB export format {"$numberInt": "2"} and string numbers "2".
+    """
+    # Handle MongoDB export format: {"$numberInt": "2"}
+    if isinstance(ans, dict):
+        if "$numberInt" in ans:
+            try:
+                return int(ans["$numberInt"])
+            except (ValueError, TypeError):
+                logger.warning("Could not parse answer: %s", ans)
+                return 0  # fallback
+        return ans
+    # Handle string numbers: "2" -> 2
+    if isinstance(ans, str) and ans.isdigit():
+        return int(ans)
+    # Already int or other type
+    return ans if ans is not None else 0
+
 
 class LessonService:
     """
@@ -10,10 +35,18 @@ class LessonService:
     Methods return plain python dicts / lists (documents from Mongo).
     
     Supports both MongoDB _id (ObjectId) and custom id (e.g., 'mc160.train.0')
+
+    If a loaded LessonCatalog is given, reads are served from memory
+    and Mongo is only used as fallback before the catalog is ready.
     """
 
-    def __init__(self, collection: pymongo.collection.Collection):
+    def __init__(self, collection: pymongo.collection.Collection, catalog=None, search=None):
         self.col = collection
+        self.catalog = catalog
+        self.search = search
+
+    def _use_catalog(self) -> bool:
+        return self.catalog is not None and self.catalog.is_loaded
 
     def _build_query(self, mongo_id_or_custom_id: str) -> Dict[str, Any]:
         """
@@ -33,6 +66,10 @@ class LessonService:
         return {"id": mongo_id_or_custom_id}
 
     def get_full_lesson(self, mongo_id_or_custom_id: str) -> Optional[Dict[str, Any]]:
+        if self._use_catalog():
+            rec = self.catalog.get(mongo_id_or_custom_id)
+            return rec.to_dict() if rec else None
+
         q = self._build_query(mongo_id_or_custom_id)
         doc = self.col.find_one(q)
         
@@ -58,6 +95,10 @@ class LessonService:
         Returns:
             Story text or None
         """
+        if self._use_catalog():
+            rec = self.catalog.get(mongo_id_or_custom_id)
+            return rec.story if rec else None
+
         q = self._build_query(mongo_id_or_custom_id)
         doc = self.col.find_one(q, {"story": 1})
         return doc.get("story") if doc else None
@@ -73,33 +114,22 @@ class LessonService:
         Returns:
             List of question dicts
         """
+        if self._use_catalog():
+            rec = self.catalog.get(mongo_id_or_custom_id)
+            return [q.to_dict() for q in rec.questions] if rec else []
+
         q = self._build_query(mongo_id_or_custom_id)
         doc = self.col.find_one(q, {"questions": 1})
         qs = doc.get("questions", []) if doc else []
-        
-        # Normalize answer field to int if it's stored as string or nested
+        return self.normalize_questions(qs)
+
+    @staticmethod
+    def normalize_questions(qs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Shallow-copy question dicts with answer normalized to int."""
         normalized = []
         for qitem in qs:
             item = dict(qitem)  # shallow copy
-            ans = item.get("answer")
-            
-            # Handle MongoDB export format: {"$numberInt": "2"}
-            if isinstance(ans, dict):
-                if "$numberInt" in ans:
-                    try:
-                        item["answer"] = int(ans["$numberInt"])
-                    except (ValueError, TypeError):
-                        print(f"⚠️ Warning: Could not parse answer: {ans}")
-                        item["answer"] = 0  # fallback
-                else:
-                    item["answer"] = ans
-            # Handle string numbers: "2" -> 2
-            elif isinstance(ans, str) and ans.isdigit():
-                item["answer"] = int(ans)
-            # Already int or other type
-            else:
-                item["answer"] = ans if ans is not None else 0
-                
+            item["answer"] = normalize_answer(item.get("answer"))
             normalized.append(item)
             
         return normalized
@@ -122,7 +152,11 @@ class LessonService:
         Returns:
             List of enriched question dicts
         """
-        qs = self.get_questions(mongo_id_or_custom_id)
+        return self.add_correct_answer_text(self.get_questions(mongo_id_or_custom_id))
+
+    @staticmethod
+    def add_correct_answer_text(qs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Enrich normalized questions with 'correct_index' and 'correct_text'."""
         out = []
         
         for q in qs:
@@ -133,14 +167,14 @@ class LessonService:
             try:
                 correct_index = int(raw_ans) if raw_ans is not None else None
             except (ValueError, TypeError):
-                print(f"⚠️ Warning: Invalid answer index: {raw_ans}")
+                logger.warning("Invalid answer index: %s", raw_ans)
                 correct_index = None
                 
             correct_text = None
             if correct_index is not None and 0 <= correct_index < len(choices):
                 correct_text = choices[correct_index]
             else:
-                print(f"⚠️ Warning: Answer index {correct_index} out of range for question: {q.get('question', '')[:50]}")
+                logger.warning("Answer index %s out of range for question: %s", correct_index, q.get('question', '')[:50])
                 
             item = dict(q)
             item["correct_index"] = correct_index
@@ -149,8 +183,43 @@ class LessonService:
             
         return out
 
+    def get_lessons_bulk(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Resolve nhiều lesson một lần (1 query `$in` nếu không có catalog).
+
+        Args:
+            ids: list of MongoDB _id or custom id
+
+        Returns:
+            {requested_id: lesson doc} - id không tồn tại sẽ không có trong dict
+        """
+        if self._use_catalog():
+            out = {}
+            for lesson_id in ids:
+                rec = self.catalog.get(lesson_id)
+                if rec:
+                    out[lesson_id] = rec.to_dict()
+            return out
+
+        object_ids = [ObjectId(i) for i in ids if len(i) == 24 and ObjectId.is_valid(i)]
+        query = {"$or": [{"id": {"$in": ids}}, {"_id": {"$in": object_ids}}]} if object_ids else {"id": {"$in": ids}}
+
+        by_key = {}
+        for doc in self.col.find(query, {"id": 1, "story": 1, "questions": 1, "score": 1}):
+            doc["_id"] = str(doc["_id"])
+            if "id" not in doc:
+                doc["id"] = doc["_id"]
+            doc["score"] = doc.get("score")
+            doc["questions"] = self.normalize_questions(doc.get("questions", []))
+            by_key[doc["id"]] = doc
+            by_key[doc["_id"]] = doc
+
+        return {lesson_id: by_key[lesson_id] for lesson_id in ids if lesson_id in by_key}
+
     def list_all_lessons(self, limit: int = 100, skip: int = 0) -> List[Dict[str, Any]]:
-       
+        if self._use_catalog():
+            return [rec.to_dict() for rec in self.catalog.records()[skip:skip + limit]]
+
         cursor = self.col.find({}, {
             "id": 1,
             "story": 1,
@@ -173,11 +242,30 @@ class LessonService:
 
     
     def search_lessons_by_keyword(self, keyword: str, limit: int = 20) -> List[Dict[str, Any]]:
-       
+        """
+        Full-text search (BM25 + prefix) qua LessonSearch nếu catalog đã nạp.
+        Fallback Mongo: regex đã escape (chỉ dùng trước khi catalog sẵn sàng).
+        """
+        if self.search is not None and self._use_catalog():
+            lessons = []
+            for hit in self.search.search(keyword, limit):
+                rec = hit.record
+                story = rec.story
+                lessons.append({
+                    "_id": rec.mongo_id,
+                    "id": rec.id,
+                    "story": story,
+                    "score": rec.score,
+                    "relevance": hit.score,
+                    "story_preview": story[:200] + "..." if len(story) > 200 else story,
+                })
+            return lessons
+
+        pattern = re.escape(keyword)
         query = {
             "$or": [
-                {"story": {"$regex": keyword, "$options": "i"}},
-                {"id": {"$regex": keyword, "$options": "i"}}
+                {"story": {"$regex": pattern, "$options": "i"}},
+                {"id": {"$regex": pattern, "$options": "i"}}
             ]
         }
         
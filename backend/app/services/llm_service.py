@@ -1,8 +1,14 @@
 # app/services/llm_service.py
+import logging
 import os
 from typing import List, Dict
 from groq import AsyncGroq
 
+from app.services.metrics import stage_timer
+from app.services.tracing import span
+
+logger = logging.getLogger(__name__)
+
 # Global async client
 _client = None
 
@@ -15,13 +21,13 @@ async def init_client():
         raise RuntimeError("GROQ_API_KEY not found in environment variables")
     
     _client = AsyncGroq(api_key=api_key)
-    print("✅ Groq AsyncClient initialized")
+    logger.info("Groq AsyncClient initialized")
 
 async def close_client():
     """Close Groq client (if needed)"""
     global _client
     _client = None
-    print("✅ Groq client closed")
+    logger.info("Groq client closed")
 
 async def chat_with_messages_async(
     messages: List[Dict[str, str]], 
@@ -51,38 +57,42 @@ async def chat_with_messages_async(
         model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
     
     try:
-        print(f"=== Calling Groq LLM ({model}) ===")
-        print(f"Messages: {len(messages)} messages")
-        for msg in messages:
-            print(f"  {msg['role']}: {msg['content'][:100]}...")
+        logger.info("Calling Groq LLM (%s) with %d messages", model, len(messages))
+        if logger.isEnabledFor(logging.DEBUG):
+            for msg in messages:
+                logger.debug("%s: %s...", msg['role'], msg['content'][:100])
         
         # Call Groq API
-        chat_completion = await _client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=temperature,
-            max_tokens=max_tokens,
-        )
+        with stage_timer("llm"), span("llm.chat", model=model, messages=len(messages)) as s:
+            chat_completion = await _client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+            usage = getattr(chat_completion, "usage", None)
+            if usage is not None:
+                s.set(
+                    prompt_tokens=getattr(usage, "prompt_tokens", None),
+                    completion_tokens=getattr(usage, "completion_tokens", None),
+                )
         
         # Extract response
         response_text = chat_completion.choices[0].message.content
         
-        print(f"=== LLM Response ===")
-        print(f"{response_text[:200]}...")
+        logger.debug("LLM response: %s...", response_text[:200])
         
         return response_text
         
     except Exception as e:
-        print(f"❌ Groq API Error: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Groq API Error: %s", type(e).__name__)
         raise
 
 # Optional: Quick test function
 async def quick_test():
     """Test the Groq client"""
     if _client is None:
-        print("❌ Client not initialized")
+        logger.error("Client not initialized")
         return
     
     test_messages = [
@@ -91,4 +101,4 @@ async def quick_test():
     ]
     
     response = await chat_with_messages_async(test_messages)
-    print(f"✅ Test successful: {response}")
\ No newline at end of file
+    logger.info("Test successful: %s", response)
@@ -0,0 +1,179 @@
+# app/services/loop_monitor.py
+"""
+Runtime diagnostics cho event loop (bật bằng LOOP_MONITOR_ENABLED=1).
+
+- Lag: task asyncio ngủ LOOP_MONITOR_INTERVAL rồi đo độ trễ thực tế so với
+  dự kiến -> histogram event_loop_lag_seconds
+- Blocking call: thread watchdog kiểm tra heartbeat của task trên; nếu loop
+  không chạy quá LOOP_BLOCK_THRESHOLD_MS thì lấy stack của thread event loop
+  (sys._current_frames) để biết callback nào đang giữ loop, log warning và
+  giữ LOOP_BLOCK_HISTORY sự kiện gần nhất
+- Threadpool của route `def`: đọc anyio default thread limiter (borrowed /
+  total / waiting) mỗi tick, đếm số lần bị bão hòa
+
+Tất cả được export qua /metrics (collector) và /debug/loop
+(chỉ mount khi LOOP_DEBUG_ENDPOINT=1, vì trả về stack trace).
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from app.services.metrics import REGISTRY, gauge_samples, register_collector
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "0").lower() in ("1", "true", "yes")
+# /debug/loop trả stack trace của thread -> chỉ mount khi bật rõ ràng (không auth)
+LOOP_DEBUG_ENDPOINT = os.getenv("LOOP_DEBUG_ENDPOINT", "0").lower() in ("1", "true", "yes")
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", 0.1))
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", 100))
+LOOP_BLOCK_HISTORY = int(os.getenv("LOOP_BLOCK_HISTORY", 20))
+LOOP_STACK_DEPTH = int(os.getenv("LOOP_STACK_DEPTH", 15))
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+EVENT_LOOP_LAG = REGISTRY.histogram("event_loop_lag_seconds", "Độ trễ lịch của event loop", buckets=LAG_BUCKETS)
+EVENT_LOOP_BLOCKED = REGISTRY.counter("event_loop_blocked_total", "Số lần loop bị giữ quá ngưỡng")
+THREADPOOL_SATURATED = REGISTRY.counter("threadpool_saturated_total", "Số tick threadpool (anyio) hết token")
+
+
+class LoopMonitor:
+    def __init__(self, interval: float, threshold_ms: float, history: int):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._last_beat = 0.0
+        self._reported_beat = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.blocks: Deque[Dict[str, Any]] = deque(maxlen=history)
+        self.threadpool: Dict[str, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    # ------------------------------------------------------------------ #
+    # Event loop side
+    # ------------------------------------------------------------------ #
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        limiter = self._get_thread_limiter()
+        while True:
+            expected = loop.time() + self.interval
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            EVENT_LOOP_LAG.observe(lag)
+            if limiter is not None:
+                self._sample_threadpool(limiter)
+
+    @staticmethod
+    def _get_thread_limiter():
+        try:
+            from anyio import to_thread
+            return to_thread.current_default_thread_limiter()
+        except Exception as e:
+            logger.info("anyio thread limiter unavailable: %s", e)
+            return None
+
+    def _sample_threadpool(self, limiter):
+        stats = limiter.statistics()
+        self.threadpool = {
+            "borrowed": stats.borrowed_tokens,
+            "total": int(stats.total_tokens),
+            "waiting": stats.tasks_waiting,
+        }
+        if stats.borrowed_tokens >= stats.total_tokens:
+            THREADPOOL_SATURATED.inc()
+
+    # ------------------------------------------------------------------ #
+    # Watchdog thread
+    # ------------------------------------------------------------------ #
+    def _watch(self):
+        poll = max(self.threshold / 2, 0.01)
+        while not self._stop.wait(poll):
+            beat = self._last_beat
+            if not beat:
+                continue
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == self._reported_beat:
+                continue
+            # Chỉ báo 1 lần cho mỗi heartbeat bị trễ
+            self._reported_beat = beat
+            self._record_block(stalled)
+
+    def _record_block(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame, limit=LOOP_STACK_DEPTH) if frame is not None else []
+        event = {
+            "at": time.time(),
+            "stalled_ms": round(stalled * 1000, 1),
+            "stack": [line.rstrip() for line in stack],
+        }
+        self.blocks.append(event)
+        EVENT_LOOP_BLOCKED.inc()
+        logger.warning(
+            "Event loop blocked for %.0fms", stalled * 1000,
+            extra={"stack": event["stack"][-5:]},
+        )
+
+    # ------------------------------------------------------------------ #
+    def start(self):
+        """Gọi trong event loop (startup)."""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info("Loop monitor started (interval=%.3fs, threshold=%.0fms)", self.interval, self.threshold * 1000)
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "threshold_ms": self.threshold * 1000,
+            "threadpool": dict(self.threadpool),
+        }
+
+    def recent_blocks(self) -> List[Dict[str, Any]]:
+        return list(self.blocks)
+
+
+# Module-level singleton
+loop_monitor = LoopMonitor(LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD_MS, LOOP_BLOCK_HISTORY)
+
+
+def _collect():
+    if not loop_monitor.running:
+        return
+    stats = loop_monitor.stats()
+    yield ("event_loop_lag", "gauge", "Lag gần nhất / lớn nhất (ms)",
+           gauge_samples({"last_ms": stats["last_lag_ms"], "max_ms": stats["max_lag_ms"]}))
+    yield ("threadpool_tokens", "gauge", "anyio default thread limiter", gauge_samples(stats["threadpool"]))
+
+
+register_collector(_collect)
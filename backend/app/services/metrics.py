@@ -0,0 +1,324 @@
+# app/services/metrics.py
+"""
+Instrumentation: histogram / counter + endpoint /metrics (Prometheus text).
+
+Hot path không lấy lock: mỗi thread ghi vào shard riêng (threading.local),
+lock chỉ dùng khi một thread tạo shard lần đầu và khi scrape gộp các shard.
+Event loop là 1 thread nên mọi request async chung 1 shard; các route `def`
+(threadpool) và pymongo listener ghi vào shard của thread tương ứng.
+
+Gauge (pool Mongo, hàng đợi bcrypt, user cache...) không lưu state ở đây mà
+được đọc lúc scrape qua collector callback (register_collector).
+
+    from app.services.metrics import stage_timer
+    with stage_timer("llm"):
+        ...
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+# Latency buckets (giây): từ 1ms tới 60s, đủ cho cả Mongo lẫn LLM/TTS
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Sharded:
+    """Base: mỗi thread giữ dict label -> state riêng, scrape thì gộp."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Dict[LabelValues, list]] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> Dict[LabelValues, list]:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshot_shards(self) -> List[Dict[LabelValues, list]]:
+        with self._shards_lock:
+            shards = list(self._shards)
+        # copy từng shard: thread chủ có thể đang thêm label mới
+        return [dict(shard) for shard in shards]
+
+
+class Counter(_Sharded):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, *labelvalues: str):
+        shard = self._shard()
+        cell = shard.get(labelvalues)
+        if cell is None:
+            cell = shard[labelvalues] = [0.0]
+        cell[0] += amount
+
+    def samples(self) -> List[Sample]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._snapshot_shards():
+            for key, cell in shard.items():
+                totals[key] = totals.get(key, 0.0) + cell[0]
+        return [
+            (self.name, dict(zip(self.labelnames, key)), value)
+            for key, value in sorted(totals.items())
+        ]
+
+
+class Histogram(_Sharded):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str):
+        shard = self._shard()
+        cell = shard.get(labelvalues)
+        if cell is None:
+            # [count từng bucket..., +Inf, sum]
+            cell = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def samples(self) -> List[Sample]:
+        merged: Dict[LabelValues, list] = {}
+        for shard in self._snapshot_shards():
+            for key, cell in shard.items():
+                acc = merged.get(key)
+                if acc is None:
+                    merged[key] = list(cell)
+                else:
+                    for i, v in enumerate(cell):
+                        acc[i] += v
+
+        out: List[Sample] = []
+        for key, cell in sorted(merged.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), cell[:-1]):
+                cumulative += count
+                out.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            out.append((f"{self.name}_sum", labels, cell[-1]))
+            out.append((f"{self.name}_count", labels, cumulative))
+        return out
+
+
+# Collector: trả về [(name, type, help, [(labels, value), ...])]
+Collected = Tuple[str, str, str, Iterable[Tuple[Dict[str, str], float]]]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Sharded] = {}
+        self._collectors: List[Callable[[], Iterable[Collected]]] = []
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Counter(name, help_text, labelnames)
+            return metric
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = Histogram(name, help_text, labelnames, buckets)
+            return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Collected]]):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        lines: List[str] = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for collector in collectors:
+            try:
+                collected = list(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {_escape(e)}")
+                continue
+            for name, kind, help_text, samples in collected:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Module-level singleton
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency theo route",
+    ("method", "route", "status"),
+)
+STAGE_DURATION = REGISTRY.histogram(
+    "app_stage_duration_seconds", "Thời gian từng stage (stt, llm, tts, audio...)",
+    ("stage", "outcome"),
+)
+MONGO_COMMAND_DURATION = REGISTRY.histogram(
+    "mongo_command_duration_seconds", "Thời gian command MongoDB (client-side)",
+    ("command", "outcome"),
+)
+AUDIO_CACHE = REGISTRY.counter(
+    "audio_cache_requests_total", "Lookup audio cache của lesson",
+    ("result",),
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Đo 1 stage; outcome=error nếu có exception (exception vẫn được raise tiếp)."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage, outcome)
+
+
+# ---------------------------------------------------------------------- #
+# ASGI middleware
+# ---------------------------------------------------------------------- #
+def _route_label(scope, base_root_path: str = "") -> str:
+    """
+    Path template của route để label không nổ cardinality, gồm prefix của
+    include_router và path của Mount (vd /api/lessons/{lesson_id}), không
+    gồm root_path của server (--root-path khi chạy sau proxy).
+
+    base_root_path: root_path lúc request vào middleware; phần root_path tăng
+    thêm sau routing chính là path của các Mount đã đi qua.
+    """
+    root_path = scope.get("root_path", "")
+    mount_prefix = root_path[len(base_root_path):] if root_path.startswith(base_root_path) else ""
+    route = scope.get("route")
+    path = getattr(route, "path_format", None) or getattr(route, "path", None)
+    if path:
+        return mount_prefix + path
+    if mount_prefix:
+        # Sub-app không có route (vd StaticFiles)
+        return mount_prefix + "/{path}"
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return getattr(endpoint, "__name__", "endpoint")
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: đo latency mỗi HTTP request theo route template."""
+
+    def __init__(self, app, exclude_paths: Iterable[str] = ("/metrics",)):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_holder = [500]
+        base_root_path = scope.get("root_path", "")
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                scope.get("method", ""),
+                _route_label(scope, base_root_path),
+                str(status_holder[0]),
+            )
+
+
+# ---------------------------------------------------------------------- #
+# MongoDB command listener
+# ---------------------------------------------------------------------- #
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Ghi duration_micros của mọi command (sync lẫn motor) vào histogram."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name, "ok")
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name, "error")
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def register_collector(collector: Callable[[], Iterable[Collected]]):
+    REGISTRY.register_collector(collector)
+
+
+def gauge_samples(values: Dict[str, float], labels: Optional[Dict[str, str]] = None):
+    """Helper cho collector: dict -> [(labels, value)] bỏ qua giá trị không phải số."""
+    return [
+        ({**(labels or {}), "field": key}, float(value))
+        for key, value in values.items()
+        if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
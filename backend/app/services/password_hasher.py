@@ -0,0 +1,112 @@
+# app/services/password_hasher.py
+"""
+Bcrypt hashing / verify chạy trên thread pool riêng có giới hạn.
+
+bcrypt tốn hàng chục-trăm ms CPU mỗi lần và nhả GIL khi tính, nên đưa
+ra thread pool để event loop (voice chat, progress...) không bị block.
+Số worker và độ dài hàng đợi có giới hạn: khi login burst vượt quá
+PASSWORD_HASH_MAX_QUEUE thì từ chối ngay (PasswordHasherBusy) thay vì
+để request xếp hàng vô hạn.
+"""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", 64))
+
+
+class PasswordHasherBusy(Exception):
+    """Hàng đợi hash đã đầy"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int, rounds: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._workers = workers
+        self._max_queue = max_queue
+        self.rounds = rounds
+        self._lock = threading.Lock()
+        self._pending = 0      # đã submit, chưa chạy xong (gồm đang chạy)
+        self._in_flight = 0    # đang chạy trên worker
+        self._completed = 0
+        self._rejected = 0
+        self._queue_wait_total = 0.0
+        self._run_time_total = 0.0
+
+    def _run(self, fn: Callable, submitted_at: float, *args) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self._in_flight += 1
+            self._queue_wait_total += started - submitted_at
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._pending -= 1
+                self._completed += 1
+                self._run_time_total += time.perf_counter() - started
+
+    async def _submit(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            if self._pending >= self._workers + self._max_queue:
+                self._rejected += 1
+                raise PasswordHasherBusy("Password hashing queue is full")
+            self._pending += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._executor, self._run, fn, time.perf_counter(), *args)
+        except BaseException:
+            # Submit lỗi (vd. executor đã shutdown): _run không chạy -> trả lại slot
+            with self._lock:
+                self._pending -= 1
+            raise
+        return await future
+
+    # ------------------------------------------------------------------ #
+    def hash_sync(self, password: str) -> str:
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+    @staticmethod
+    def verify_sync(plain_password: str, hashed_password: str) -> bool:
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(self.hash_sync, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(self.verify_sync, plain_password, hashed_password)
+
+    # ------------------------------------------------------------------ #
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = self._pending - self._in_flight
+            return {
+                "workers": self._workers,
+                "rounds": self.rounds,
+                "queue_depth": queued,
+                "in_flight": self._in_flight,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "queue_wait_avg_ms": round(self._queue_wait_total * 1000 / self._completed, 2) if self._completed else 0.0,
+                "run_time_avg_ms": round(self._run_time_total * 1000 / self._completed, 2) if self._completed else 0.0,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# Module-level singleton
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    max_queue=PASSWORD_HASH_MAX_QUEUE,
+    rounds=BCRYPT_ROUNDS,
+)
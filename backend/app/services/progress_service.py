@@ -1,142 +1,529 @@
-from datetime import datetime, timedelta
+import logging
+import asyncio
+from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict
 from bson import ObjectId
-from pymongo.database import Database
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.services.leaderboard_service import GLOBAL_BOARD, weekly_board_name, lesson_board_name
+
+logger = logging.getLogger(__name__)
+
+# Số client_id gần nhất giữ trong mỗi document progress/log để chống áp dụng 2 lần
+APPLIED_IDS_KEEP = 50
 
 
 class ProgressService:
-    """Service để quản lý user progress trong MongoDB"""
+    """Service để quản lý user progress trong MongoDB (async, motor)"""
     
-    def __init__(self, db: Database):
+    def __init__(self, db: AsyncIOMotorDatabase, leaderboard=None):
         self.db = db
+        self.leaderboard = leaderboard
         self.collection = db["user_progress"]
         self.learning_logs = db["learning_logs"]
-        # Tạo index để tăng performance
-        self._ensure_indexes()
-    
-    def _ensure_indexes(self):
-        """Tạo các index cần thiết"""
-        try:
-            # Index cho user_progress
-            self.collection.create_index(
-                [("user_id", 1), ("lesson_id", 1)], 
-                unique=True,
-                name="user_lesson_idx"
-            )
-            self.collection.create_index([("user_id", 1)], name="user_idx")
-            
-            # Index cho learning_logs (streak tracking)
-            self.learning_logs.create_index(
-                [("user_id", 1), ("date", 1)],
-                unique=True,
-                name="user_date_idx"
-            )
-            self.learning_logs.create_index([("user_id", 1)], name="logs_user_idx")
-            
-            print("✅ Progress indexes created")
-        except Exception as e:
-            if "already exists" in str(e).lower():
-                print("ℹ️ Indexes already exist")
-            else:
-                print(f"⚠️ Index creation warning: {e}")
+        self.user_stats = db["user_stats"]
+        self.submissions = db["progress_submissions"]
+        # Index được tạo 1 lần lúc startup (app/schema.py), không tạo ở đây
     
-    def save_progress(
+    async def save_progress(
         self, 
         user_id: str, 
         lesson_id: str, 
         score: int,
-        total_questions: int = 4
+        total_questions: int = 4,
+        username: Optional[str] = None
     ) -> Dict:
-        """Lưu progress và cập nhật learning log cho streak"""
+        """
+        Lưu progress và cập nhật learning log cho streak.
+
+        Round trip:
+            1. song song: 1 find_one_and_update user_progress (pre-image,
+               _id sinh ở client qua $setOnInsert) + 1 upsert learning log
+            2. 1 update user_stats (cần best delta + new_day từ bước 1)
+        """
         try:
-            existing_progress = self.collection.find_one({
-                "user_id": user_id,
-                "lesson_id": lesson_id
-            })
-            
             now = datetime.now()
             today = now.date().isoformat()
             
+            progress_filter = {"user_id": user_id, "lesson_id": lesson_id}
+            new_id = ObjectId()
+            progress_update = self._progress_update(user_id, lesson_id, score, total_questions, now, new_id)
+            
             # 🔥 Cập nhật learning log (cho streak tracking)
             # Chỉ tạo 1 log/ngày bất kể học bao nhiêu lesson
-            self.learning_logs.update_one(
-                {
+            log_update = {
+                "$setOnInsert": {
                     "user_id": user_id,
-                    "date": today
+                    "date": today,
+                    "created_at": now
                 },
-                {
-                    "$setOnInsert": {
-                        "user_id": user_id,
-                        "date": today,
-                        "created_at": now
-                    },
-                    "$inc": {
-                        "lessons_completed": 1  # Đếm số lesson học trong ngày
-                    },
-                    "$set": {
-                        "last_updated": now
-                    }
+                "$inc": {
+                    "lessons_completed": 1  # Đếm số lesson học trong ngày
                 },
-                upsert=True
+                "$set": {
+                    "last_updated": now
+                }
+            }
+            
+            before, log = await asyncio.gather(
+                self._upsert(self.collection, progress_filter, progress_update, ReturnDocument.BEFORE),
+                self._upsert(self.learning_logs, {"user_id": user_id, "date": today}, log_update),
             )
+            progress = self._apply_attempt(before, user_id, lesson_id, score, total_questions, now, new_id)
             
-            if existing_progress:
-                # Cập nhật progress hiện tại
-                update_data = {
-                    "$set": {
-                        "last_score": score,
-                        "updated_at": now
-                    },
-                    "$inc": {
-                        "total_attempts": 1
-                    },
-                    "$max": {
-                        "best_score": score
-                    }
-                }
-                
-                # Nếu đạt điểm tối đa, tăng completion_count
-                if score == total_questions:
-                    update_data["$inc"]["completion_count"] = 1
-                
-                result = self.collection.update_one(
-                    {"user_id": user_id, "lesson_id": lesson_id},
-                    update_data
+            # 📊 Cập nhật user_stats (materialized, O(1) mỗi lần save)
+            prev_best = before.get("best_score") if before else None
+            await self._update_user_stats(
+                user_id,
+                now,
+                lessons_started=1 if before is None else 0,
+                completed=1 if score == total_questions else 0,
+                best_delta=progress["best_score"] - (prev_best or 0),
+                new_day=log.get("lessons_completed") == 1,
+            )
+            
+            # 🏆 Cập nhật leaderboard (in-memory)
+            if self.leaderboard is not None:
+                self.leaderboard.record_progress(
+                    user_id,
+                    lesson_id,
+                    score=score,
+                    best_score=progress["best_score"],
+                    best_delta=progress["best_score"] - (prev_best or 0),
+                    username=username,
+                    now=now
                 )
-                
-                updated_progress = self.collection.find_one({
-                    "user_id": user_id,
-                    "lesson_id": lesson_id
-                })
-                
-                return self._format_progress(updated_progress)
             
-            else:
-                # Tạo progress mới
-                new_progress = {
-                    "user_id": user_id,
-                    "lesson_id": lesson_id,
-                    "completion_count": 1 if score == total_questions else 0,
-                    "total_attempts": 1,
-                    "last_score": score,
-                    "best_score": score,
-                    "created_at": now,
-                    "updated_at": now
-                }
-                
-                result = self.collection.insert_one(new_progress)
-                new_progress["_id"] = result.inserted_id
-                
-                return self._format_progress(new_progress)
+            return self._format_progress(progress)
         
         except Exception as e:
-            print(f"❌ Error saving progress: {e}")
+            logger.error("Error saving progress: %s", e)
             raise
     
-    def get_user_progress(self, user_id: str, lesson_id: str) -> Optional[Dict]:
+    @staticmethod
+    def _progress_update(
+        user_id: str, lesson_id: str, score: int, total_questions: int, now: datetime, new_id: ObjectId
+    ) -> Dict:
+        """
+        Update cho 1 lần làm bài online. Phải khớp với _apply_attempt.
+        new_id: _id dùng nếu upsert tạo document mới (biết trước, không cần đọc lại).
+        Dọn prev_best_score do phiên bản cũ lưu vào document.
+        """
+        return {
+            "$setOnInsert": {"_id": new_id, "created_at": now},
+            "$set": {"user_id": user_id, "lesson_id": lesson_id, "last_score": score, "updated_at": now},
+            "$inc": {
+                "total_attempts": 1,
+                # Nếu đạt điểm tối đa, tăng completion_count
+                "completion_count": 1 if score == total_questions else 0
+            },
+            "$max": {"best_score": score},
+            "$unset": {"prev_best_score": ""}
+        }
+    
+    @staticmethod
+    def _progress_pipeline(
+        user_id: str,
+        lesson_id: str,
+        score: int,
+        total_questions: int,
+        completed_at: datetime,
+        client_id: str
+    ) -> List[Dict]:
+        """
+        Pipeline update cho 1 item của batch offline.
+        
+        completed_at: thời điểm làm bài; bài nộp muộn cũ hơn updated_at
+             hiện tại không ghi đè last_score/updated_at.
+        client_id: no-op nếu client_id đã nằm trong applied_ids của
+             document -> gửi lại cùng bài không bị cộng 2 lần.
+        
+        Stage cuối dọn prev_best_score do phiên bản cũ lưu vào document.
+        """
+        newer = {"$gte": [completed_at, {"$ifNull": ["$updated_at", completed_at]}]}
+        fields = {
+            "user_id": {"$literal": user_id},
+            "lesson_id": {"$literal": lesson_id},
+            "created_at": {"$ifNull": ["$created_at", completed_at]},
+            "last_score": {"$cond": [newer, score, "$last_score"]},
+            "updated_at": {"$max": [{"$ifNull": ["$updated_at", completed_at]}, completed_at]},
+            "total_attempts": {"$add": [{"$ifNull": ["$total_attempts", 0]}, 1]},
+            # Nếu đạt điểm tối đa, tăng completion_count
+            "completion_count": {"$add": [
+                {"$ifNull": ["$completion_count", 0]},
+                1 if score == total_questions else 0
+            ]},
+            "best_score": {"$max": [{"$ifNull": ["$best_score", score]}, score]}
+        }
+        applied = {"$ifNull": ["$applied_ids", []]}
+        return [
+            {"$replaceWith": {"$cond": [
+                {"$in": [{"$literal": client_id}, applied]},
+                "$$ROOT",
+                {"$mergeObjects": ["$$ROOT", fields, {"applied_ids": {"$slice": [
+                    {"$concatArrays": [applied, [{"$literal": client_id}]]}, -APPLIED_IDS_KEEP
+                ]}}]}
+            ]}},
+            {"$unset": "prev_best_score"}
+        ]
+    
+    @staticmethod
+    def _log_pipeline(user_id: str, day: str, client_ids: List[str], now: datetime) -> List[Dict]:
+        """
+        Pipeline cho learning log 1 ngày (batch): chỉ cộng lessons_completed
+        cho các client_id chưa có trong applied_ids.
+        """
+        applied = {"$ifNull": ["$applied_ids", []]}
+        return [
+            {"$set": {"_fresh": {"$setDifference": [{"$literal": client_ids}, applied]}}},
+            {"$set": {
+                "user_id": {"$literal": user_id},
+                "date": day,
+                "created_at": {"$ifNull": ["$created_at", now]},
+                "lessons_completed": {"$add": [{"$ifNull": ["$lessons_completed", 0]}, {"$size": "$_fresh"}]},
+                "last_updated": now,
+                "applied_ids": {"$slice": [{"$concatArrays": [applied, "$_fresh"]}, -APPLIED_IDS_KEEP]}
+            }},
+            {"$unset": "_fresh"}
+        ]
+    
+    @staticmethod
+    def _apply_attempt(
+        before: Optional[Dict],
+        user_id: str,
+        lesson_id: str,
+        score: int,
+        total_questions: int,
+        now: datetime,
+        new_id: ObjectId
+    ) -> Dict:
+        """
+        Document sau _progress_update, tính từ pre-image (ReturnDocument.BEFORE)
+        thay vì lưu prev_best_score vào document để đọc lại.
+        """
+        progress = {k: v for k, v in (before or {}).items() if k != "prev_best_score"}
+        before = before or {"_id": new_id, "created_at": now}
+        progress.update({
+            "_id": before["_id"],
+            "user_id": user_id,
+            "lesson_id": lesson_id,
+            "created_at": before.get("created_at") or now,
+            "last_score": score,
+            "updated_at": now,
+            "total_attempts": before.get("total_attempts", 0) + 1,
+            "completion_count": before.get("completion_count", 0) + (1 if score == total_questions else 0),
+            "best_score": max(before.get("best_score", score), score),
+        })
+        return progress
+    
+    async def save_progress_batch(
+        self,
+        user_id: str,
+        items: List[Dict],
+        username: Optional[str] = None
+    ) -> Dict:
+        """
+        Áp dụng nhiều kết quả (được queue offline) trong 1 lần.
+        
+        Args:
+            items: [{client_id, lesson_id, score, total_questions, completed_at}]
+                   theo thứ tự client đã làm
+        
+        Flow:
+            1. Claim client_id trong progress_submissions (unique index, state
+               "pending", owner = token của request này). Claim "pending" có sẵn
+               (lần trước lỗi / đang chạy) được request này nhận lại owner.
+            2. 1 bulk_write cho user_progress + 1 bulk_write cho learning_logs (song song);
+               mỗi write tự bỏ qua client_id đã áp dụng (applied_ids trong document)
+            3. Chuyển claim pending -> "applied" (chỉ claim còn owner là request này);
+               chỉ các item vừa chuyển mới được cộng điểm weekly -> 2 request
+               chồng nhau không cộng 2 lần
+            4. Tính lại user_stats/streak + điểm tuyệt đối trên leaderboard. Bước này
+               idempotent và cũng chạy cho item trùng, nên lỗi ở đây được sửa ở lần gửi lại.
+        
+        Lỗi giữa chừng (kể cả crash) để lại claim "pending": client gửi lại thì
+        các item đó được áp dụng lại, và write chỉ có tác dụng với phần chưa ghi.
+        
+        Returns:
+            {"applied": [client_id], "duplicates": [client_id], "progress": [...], "stats": {...}}
+        """
+        now = datetime.now()
+        owner = ObjectId()
+        
+        # Bỏ trùng client_id trong cùng batch, sắp theo thời điểm làm bài
+        unique_items = list({item["client_id"]: item for item in items}.values())
+        for item in unique_items:
+            item["completed_at"] = min(item.get("completed_at") or now, now)
+        unique_items.sort(key=lambda item: item["completed_at"])
+        
+        # 1) Claim
+        claims = [
+            {
+                "user_id": user_id,
+                "client_id": item["client_id"],
+                "lesson_id": item["lesson_id"],
+                "state": "pending",
+                "owner": owner,
+                "created_at": now
+            }
+            for item in unique_items
+        ]
+        claimed_before = []
+        try:
+            await self.submissions.insert_many(claims, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") != 11000:
+                    raise
+                claimed_before.append(claims[err["index"]]["client_id"])
+        
+        duplicates = set()
+        if claimed_before:
+            # Claim "pending" = lần trước chưa xong -> nhận owner rồi áp dụng lại
+            # (write idempotent). Request cũ nếu còn chạy sẽ không chuyển được state.
+            await self.submissions.update_many(
+                {"user_id": user_id, "client_id": {"$in": claimed_before}, "state": "pending"},
+                {"$set": {"owner": owner}}
+            )
+            # Claim không có state là của phiên bản cũ, khi đó đã áp dụng xong.
+            async for claim in self.submissions.find(
+                {"user_id": user_id, "client_id": {"$in": claimed_before}, "state": {"$ne": "pending"}},
+                {"client_id": 1}
+            ):
+                duplicates.add(claim["client_id"])
+        
+        accepted = [item for item in unique_items if item["client_id"] not in duplicates]
+        accepted_ids = [item["client_id"] for item in accepted]
+        credited = set()
+        
+        if accepted:
+            # 2) Bulk writes
+            progress_ops = [
+                UpdateOne(
+                    {"user_id": user_id, "lesson_id": item["lesson_id"]},
+                    self._progress_pipeline(
+                        user_id, item["lesson_id"], item["score"], item["total_questions"],
+                        item["completed_at"], client_id=item["client_id"]
+                    ),
+                    upsert=True
+                )
+                for item in accepted
+            ]
+            
+            per_day: Dict[str, List[str]] = {}
+            for item in accepted:
+                day = item["completed_at"].date().isoformat()
+                per_day.setdefault(day, []).append(item["client_id"])
+            log_ops = [
+                UpdateOne(
+                    {"user_id": user_id, "date": day},
+                    self._log_pipeline(user_id, day, client_ids, now),
+                    upsert=True
+                )
+                for day, client_ids in per_day.items()
+            ]
+            
+            # Lỗi -> claim vẫn "pending", client gửi lại sẽ áp dụng nốt phần còn thiếu
+            await asyncio.gather(
+                self.collection.bulk_write(progress_ops, ordered=True),
+                self.learning_logs.bulk_write(log_ops, ordered=False),
+            )
+            
+            # 3) pending -> applied; chỉ claim request này còn giữ owner
+            await self.submissions.update_many(
+                {"user_id": user_id, "client_id": {"$in": accepted_ids}, "state": "pending", "owner": owner},
+                {"$set": {"state": "applied", "applied_at": datetime.now()}}
+            )
+            async for claim in self.submissions.find(
+                {"user_id": user_id, "client_id": {"$in": accepted_ids}, "state": "applied", "owner": owner},
+                {"client_id": 1}
+            ):
+                credited.add(claim["client_id"])
+            
+            # Điểm weekly (không idempotent) cộng ngay sau khi chuyển state,
+            # trước mọi bước có thể lỗi
+            if self.leaderboard is not None:
+                current_week = weekly_board_name(now)
+                weekly_points = sum(
+                    item["score"] for item in accepted
+                    if item["client_id"] in credited and weekly_board_name(item["completed_at"]) == current_week
+                )
+                self.leaderboard.add_score(current_week, user_id, weekly_points, username)
+        
+        # 4) Stats + streak (có thể có ngày cũ nên tính lại từ đầu) + điểm tuyệt đối.
+        # Chạy cả khi toàn bộ là item trùng: sửa lại nếu lần trước lỗi sau bước 3.
+        lesson_ids = list({item["lesson_id"] for item in unique_items})
+        accepted_lessons = {item["lesson_id"] for item in accepted}
+        stats, progress_docs = await asyncio.gather(
+            self.rebuild_user_stats(user_id),
+            self.collection.find({"user_id": user_id, "lesson_id": {"$in": lesson_ids}}).to_list(length=None),
+        )
+        
+        if self.leaderboard is not None:
+            self.leaderboard.set_score(GLOBAL_BOARD, user_id, stats["best_score_sum"], username)
+            for doc in progress_docs:
+                self.leaderboard.set_score(lesson_board_name(doc["lesson_id"]), user_id, doc.get("best_score", 0))
+        
+        return {
+            "applied": accepted_ids,
+            "duplicates": sorted(duplicates),
+            "progress": [self._format_progress(doc) for doc in progress_docs if doc["lesson_id"] in accepted_lessons],
+            "stats": self._format_stats(stats)
+        }
+    
+    async def _upsert(self, collection, query: Dict, update, return_document=ReturnDocument.AFTER) -> Optional[Dict]:
+        """
+        find_one_and_update(upsert=True), mặc định trả về document sau khi update
+        (BEFORE: pre-image, None nếu vừa insert).
+        Hai upsert đồng thời cùng key có thể đụng unique index -> retry 1 lần
+        (lần 2 chắc chắn match document đã được insert).
+        """
+        for attempt in range(2):
+            try:
+                return await collection.find_one_and_update(
+                    query,
+                    update,
+                    upsert=True,
+                    return_document=return_document
+                )
+            except DuplicateKeyError:
+                if attempt == 1:
+                    raise
+    
+    async def _update_user_stats(
+        self,
+        user_id: str,
+        now: datetime,
+        lessons_started: int,
+        completed: int,
+        best_delta: int,
+        new_day: bool = False,
+        attempts: int = 1
+    ):
+        """
+        Cập nhật nguyên tử document user_stats (totals + streak).
+        new_day: learning log của hôm nay vừa được tạo (tăng total_active_days)
+
+        Streak được tính từ last_active_date đang lưu:
+            - cùng ngày: giữ nguyên
+            - hôm qua: +1
+            - khác: reset về 1
+        """
+        today = now.date().isoformat()
+        yesterday = (now.date() - timedelta(days=1)).isoformat()
+        
+        def inc(field: str, value: int) -> Dict:
+            return {"$add": [{"$ifNull": [f"${field}", 0]}, value]}
+        
+        pipeline = [
+            {"$set": {
+                "user_id": {"$literal": user_id},
+                "lessons_started": inc("lessons_started", lessons_started),
+                "total_completed": inc("total_completed", completed),
+                "total_attempts": inc("total_attempts", attempts),
+                "best_score_sum": inc("best_score_sum", best_delta),
+                "total_active_days": inc("total_active_days", 1 if new_day else 0),
+                "current_streak": {"$switch": {
+                    "branches": [
+                        {"case": {"$eq": ["$last_active_date", today]},
+                         "then": {"$ifNull": ["$current_streak", 1]}},
+                        {"case": {"$eq": ["$last_active_date", yesterday]},
+                         "then": inc("current_streak", 1)},
+                    ],
+                    "default": 1
+                }},
+                "last_active_date": today,
+                "updated_at": now
+            }},
+            {"$set": {
+                "longest_streak": {"$max": [{"$ifNull": ["$longest_streak", 0]}, "$current_streak"]}
+            }}
+        ]
+        
+        result = await self.user_stats.update_one({"user_id": user_id}, pipeline, upsert=True)
+        
+        if result.upserted_id is not None:
+            # Lần đầu có user_stats: user cũ có thể đã có lịch sử -> tính lại từ đầu
+            await self.rebuild_user_stats(user_id)
+    
+    async def rebuild_user_stats(self, user_id: str) -> Dict:
+        """
+        Tính lại user_stats từ user_progress + learning_logs (O(history)).
+        Dùng cho user chưa có user_stats và cho backfill.
+        """
+        progress_list, logs = await asyncio.gather(
+            self.collection.find(
+                {"user_id": user_id},
+                {"total_attempts": 1, "completion_count": 1, "best_score": 1}
+            ).to_list(length=None),
+            self.learning_logs.find({"user_id": user_id}, {"date": 1}).sort("date", -1).to_list(length=None),
+        )
+        
+        dates = [datetime.strptime(log["date"], "%Y-%m-%d").date() for log in logs]
+        run_at_last, longest = self._streak_runs(dates)
+        
+        stats = {
+            "user_id": user_id,
+            "lessons_started": len(progress_list),
+            "total_completed": sum(p.get("completion_count", 0) for p in progress_list),
+            "total_attempts": sum(p.get("total_attempts", 0) for p in progress_list),
+            "best_score_sum": sum(p.get("best_score", 0) for p in progress_list),
+            "current_streak": run_at_last,
+            "longest_streak": longest,
+            "last_active_date": dates[0].isoformat() if dates else None,
+            "total_active_days": len(dates),
+            "updated_at": datetime.now()
+        }
+        await self.user_stats.update_one({"user_id": user_id}, {"$set": stats}, upsert=True)
+        return stats
+    
+    @staticmethod
+    def _streak_runs(dates: List) -> tuple:
+        """
+        Args:
+            dates: các ngày đã học, sắp xếp giảm dần
+        
+        Returns:
+            (run_at_last, longest) - độ dài chuỗi liên tiếp kết thúc ở
+            ngày gần nhất, và chuỗi dài nhất
+        """
+        if not dates:
+            return 0, 0
+        
+        run_at_last = 1
+        for i in range(len(dates) - 1):
+            if (dates[i] - dates[i + 1]).days != 1:
+                break
+            run_at_last += 1
+        
+        longest = 1
+        temp_streak = 1
+        for i in range(len(dates) - 1):
+            if (dates[i] - dates[i + 1]).days == 1:
+                temp_streak += 1
+                longest = max(longest, temp_streak)
+            else:
+                temp_streak = 1
+        
+        return run_at_last, longest
+    
+    @staticmethod
+    def _effective_streak(stats: Dict) -> int:
+        """Streak đang lưu chỉ còn hiệu lực nếu học hôm nay hoặc hôm qua"""
+        last = stats.get("last_active_date")
+        if not last:
+            return 0
+        today = datetime.now().date()
+        if last in (today.isoformat(), (today - timedelta(days=1)).isoformat()):
+            return stats.get("current_streak", 0)
+        return 0
+    
+    async def get_user_progress(self, user_id: str, lesson_id: str) -> Optional[Dict]:
         """Lấy progress của user cho một lesson cụ thể"""
         try:
-            progress = self.collection.find_one({
+            progress = await self.collection.find_one({
                 "user_id": user_id,
                 "lesson_id": lesson_id
             })
@@ -146,54 +533,36 @@ class ProgressService:
             return None
         
         except Exception as e:
-            print(f"❌ Error getting progress: {e}")
+            logger.error("Error getting progress: %s", e)
             raise
     
-    def get_all_user_progress(self, user_id: str) -> List[Dict]:
+    async def get_all_user_progress(self, user_id: str) -> List[Dict]:
         """Lấy tất cả progress của user"""
         try:
-            progress_list = list(self.collection.find({"user_id": user_id}))
+            progress_list = await self.collection.find({"user_id": user_id}).to_list(length=None)
             return [self._format_progress(p) for p in progress_list]
         
         except Exception as e:
-            print(f"❌ Error getting all progress: {e}")
+            logger.error("Error getting all progress: %s", e)
             raise
     
-    def get_user_stats(self, user_id: str) -> Dict:
-        """Lấy thống kê tổng quan của user (bao gồm streak)"""
+    async def get_user_stats(self, user_id: str) -> Dict:
+        """Lấy thống kê tổng quan của user (bao gồm streak) - 1 point lookup"""
         try:
-            progress_list = self.get_all_user_progress(user_id)
-            
-            total_attempts = sum(p["total_attempts"] for p in progress_list)
-            total_completed = sum(p["completion_count"] for p in progress_list)
-            lessons_started = len(progress_list)
-            
-            # Tính điểm trung bình
-            if progress_list:
-                avg_best_score = sum(p["best_score"] for p in progress_list) / len(progress_list)
-            else:
-                avg_best_score = 0
-            
-            # 🔥 Lấy streak info
-            streak_info = self.get_user_streak(user_id)
+            stats = await self.user_stats.find_one({"user_id": user_id})
+            if stats is None:
+                stats = await self.rebuild_user_stats(user_id)
             
-            return {
-                "lessons_started": lessons_started,
-                "total_completed": total_completed,
-                "total_attempts": total_attempts,
-                "average_best_score": round(avg_best_score, 2),
-                "current_streak": streak_info["current_streak"],
-                "longest_streak": streak_info.get("longest_streak", 0),
-                "last_active_date": streak_info["last_active_date"]
-            }
+            return self._format_stats(stats)
         
         except Exception as e:
-            print(f"❌ Error getting user stats: {e}")
+            logger.error("Error getting user stats: %s", e)
             raise
     
-    def get_user_streak(self, user_id: str) -> Dict:
+    async def get_user_streak(self, user_id: str) -> Dict:
         """
-        Tính streak của user dựa trên learning logs
+        Lấy streak của user từ user_stats (O(1), không quét learning logs).
+        Streak được duy trì incremental trong save_progress.
         
         Returns:
             {
@@ -204,77 +573,26 @@ class ProgressService:
             }
         """
         try:
-            # Lấy tất cả learning logs, sắp xếp giảm dần theo ngày
-            logs = list(
-                self.learning_logs
-                .find({"user_id": user_id})
-                .sort("date", -1)  # -1 = descending
+            stats = await self.user_stats.find_one(
+                {"user_id": user_id},
+                {"current_streak": 1, "longest_streak": 1, "last_active_date": 1, "total_active_days": 1}
             )
-            
-            if not logs:
-                return {
-                    "current_streak": 0,
-                    "longest_streak": 0,
-                    "last_active_date": None,
-                    "total_active_days": 0
-                }
-            
-            # Parse dates
-            dates = [
-                datetime.strptime(log["date"], "%Y-%m-%d").date()
-                for log in logs
-            ]
-            
-            # Dùng local date (không UTC)
-            today = datetime.now().date()
-            
-            # 🔥 Tính current streak
-            current_streak = 0
-            
-            # Kiểm tra xem có học hôm nay hoặc hôm qua không
-            if dates[0] == today or dates[0] == today - timedelta(days=1):
-                # Bắt đầu đếm streak
-                expected_date = dates[0]
-                
-                for date in dates:
-                    if date == expected_date:
-                        current_streak += 1
-                        expected_date = date - timedelta(days=1)
-                    elif date < expected_date:
-                        # Có gap trong streak
-                        break
-            
-            # 🔥 Tính longest streak
-            longest_streak = 0
-            temp_streak = 0
-            
-            if dates:
-                temp_streak = 1
-                longest_streak = 1
-                
-                for i in range(len(dates) - 1):
-                    diff = (dates[i] - dates[i + 1]).days
-                    
-                    if diff == 1:
-                        # Ngày liên tiếp
-                        temp_streak += 1
-                        longest_streak = max(longest_streak, temp_streak)
-                    else:
-                        # Có gap, reset temp_streak
-                        temp_streak = 1
+            if stats is None or "total_active_days" not in stats:
+                # Chưa có (hoặc thiếu) state -> tính lại 1 lần từ learning logs
+                stats = await self.rebuild_user_stats(user_id)
             
             return {
-                "current_streak": current_streak,
-                "longest_streak": longest_streak,
-                "last_active_date": dates[0].isoformat(),
-                "total_active_days": len(dates)
+                "current_streak": self._effective_streak(stats),
+                "longest_streak": stats.get("longest_streak", 0),
+                "last_active_date": stats.get("last_active_date"),
+                "total_active_days": stats.get("total_active_days", 0)
             }
         
         except Exception as e:
-            print(f"❌ Error calculating streak: {e}")
+            logger.error("Error getting streak: %s", e)
             raise
     
-    def get_learning_calendar(self, user_id: str, year: int, month: int) -> List[str]:
+    async def get_learning_calendar(self, user_id: str, year: int, month: int) -> List[str]:
         """
         Lấy các ngày đã học trong tháng (dùng cho calendar UI)
         
@@ -300,7 +618,7 @@ class ProgressService:
             end_date = f"{end_year}-{end_month:02d}-01"
             
             # Query logs trong tháng
-            logs = list(
+            logs = await (
                 self.learning_logs.find({
                     "user_id": user_id,
                     "date": {
@@ -308,27 +626,124 @@ class ProgressService:
                         "$lt": end_date
                     }
                 }).sort("date", 1)
+                .to_list(length=None)
             )
             
             return [log["date"] for log in logs]
         
         except Exception as e:
-            print(f"❌ Error getting learning calendar: {e}")
+            logger.error("Error getting learning calendar: %s", e)
             raise
     
-    def delete_progress(self, user_id: str, lesson_id: str) -> bool:
+    async def get_activity_history(self, user_id: str, start: date, end: date) -> Dict:
+        """
+        Lịch sử học trong khoảng [start, end] dạng nén (cho heatmap năm).
+        1 aggregation trên index (user_id, date).
+        
+        Returns:
+            {
+                "start", "end": str,
+                "days": int,              # số ngày trong khoảng
+                "bitmap": str,            # hex, bit i (LSB-first mỗi byte) = ngày start+i có học
+                "runs": [[offset, len]],  # các chuỗi ngày học liên tiếp
+                "counts": [int],          # số lesson mỗi ngày có học, theo thứ tự
+                "active_days": int,
+                "total_lessons": int
+            }
+        """
+        try:
+            pipeline = [
+                {"$match": {
+                    "user_id": user_id,
+                    "date": {"$gte": start.isoformat(), "$lte": end.isoformat()}
+                }},
+                {"$sort": {"date": 1}},
+                {"$group": {
+                    "_id": None,
+                    "days": {"$push": {"d": "$date", "n": "$lessons_completed"}}
+                }}
+            ]
+            result = await self.learning_logs.aggregate(pipeline).to_list(length=1)
+            days = result[0]["days"] if result else []
+            
+            total_days = (end - start).days + 1
+            bitmap = bytearray((total_days + 7) // 8)
+            runs: List[List[int]] = []
+            counts: List[int] = []
+            
+            for day in days:
+                offset = (date.fromisoformat(day["d"]) - start).days
+                bitmap[offset >> 3] |= 1 << (offset & 7)
+                counts.append(day.get("n") or 1)
+                if runs and runs[-1][0] + runs[-1][1] == offset:
+                    runs[-1][1] += 1
+                else:
+                    runs.append([offset, 1])
+            
+            return {
+                "start": start.isoformat(),
+                "end": end.isoformat(),
+                "days": total_days,
+                "bitmap": bitmap.hex(),
+                "runs": runs,
+                "counts": counts,
+                "active_days": len(counts),
+                "total_lessons": sum(counts)
+            }
+        
+        except Exception as e:
+            logger.error("Error getting activity history: %s", e)
+            raise
+    
+    async def delete_progress(self, user_id: str, lesson_id: str) -> bool:
         """Xóa progress của user cho một lesson (dùng cho testing/reset)"""
         try:
-            result = self.collection.delete_one({
+            deleted = await self.collection.find_one_and_delete({
                 "user_id": user_id,
                 "lesson_id": lesson_id
             })
-            return result.deleted_count > 0
+            if not deleted:
+                return False
+            
+            # Trừ lại phần đóng góp của lesson này trong user_stats
+            await self.user_stats.update_one(
+                {"user_id": user_id},
+                {"$inc": {
+                    "lessons_started": -1,
+                    "total_completed": -deleted.get("completion_count", 0),
+                    "total_attempts": -deleted.get("total_attempts", 0),
+                    "best_score_sum": -deleted.get("best_score", 0)
+                }}
+            )
+            
+            if self.leaderboard is not None:
+                self.leaderboard.remove_progress(user_id, lesson_id, deleted.get("best_score", 0))
+            return True
         
         except Exception as e:
-            print(f"❌ Error deleting progress: {e}")
+            logger.error("Error deleting progress: %s", e)
             raise
     
+    def _format_stats(self, stats: Dict) -> Dict:
+        """Format document user_stats để trả về API"""
+        lessons_started = stats.get("lessons_started", 0)
+        
+        # Tính điểm trung bình
+        if lessons_started:
+            avg_best_score = stats.get("best_score_sum", 0) / lessons_started
+        else:
+            avg_best_score = 0
+        
+        return {
+            "lessons_started": lessons_started,
+            "total_completed": stats.get("total_completed", 0),
+            "total_attempts": stats.get("total_attempts", 0),
+            "average_best_score": round(avg_best_score, 2),
+            "current_streak": self._effective_streak(stats),
+            "longest_streak": stats.get("longest_streak", 0),
+            "last_active_date": stats.get("last_active_date")
+        }
+    
     def _format_progress(self, progress: Dict) -> Dict:
         """Format progress document để trả về API"""
         if not progress:
@@ -1,9 +1,12 @@
 # app/services/stt_service.py
+import logging
 import os
 import asyncio
 import mimetypes
 from typing import Optional, Any, Dict
 
+from app.services.tracing import span
+
 # Optional: HTTP fallback
 try:
     import requests
@@ -26,6 +29,8 @@ if _DeepGramClient := _DeepgramClient is None:
         "Install official Deepgram SDK (pip install deepgram-sdk) or check the package."
     )
 
+logger = logging.getLogger(__name__)
+
 class DeepgramSTTService:
     """
     Deepgram STT service compatible with modern deepgram-sdk (v3+/v4+/v5+).
@@ -59,7 +64,7 @@ class DeepgramSTTService:
                         "Failed to initialize Deepgram client. Last error: %s" % e
                     )
 
-        print("✅ Deepgram STT Service initialized (deepgram-sdk detected)")
+        logger.info("Deepgram STT Service initialized (deepgram-sdk detected)")
 
     def _guess_mimetype(self, path: str) -> str:
         mimetype, _ = mimetypes.guess_type(path)
@@ -124,6 +129,13 @@ class DeepgramSTTService:
         return {"text": None, "confidence": None}
 
     def transcribe_file(self, audio_path: str, language: str = "en") -> dict:
+        """Transcribe audio file (xem _transcribe_file); mỗi lần thử provider là 1 span con."""
+        with span("stt.transcribe", language=language) as s:
+            result = self._transcribe_file(audio_path, language)
+            s.set(confidence=result.get("confidence"))
+            return result
+
+    def _transcribe_file(self, audio_path: str, language: str = "en") -> dict:
         """
         Transcribe audio file. Preferred: SDK call client.listen.v1.media.transcribe_file(request=bytes,...).
         Falls back to transcription.prerecorded or HTTP POST to /v1/listen.
@@ -164,12 +176,13 @@ class DeepgramSTTService:
                 if transcribe_file_fn:
                     # may be coroutine
                     try:
-                        if self._is_coroutine_callable(transcribe_file_fn):
-                            resp = self._maybe_await(transcribe_file_fn(request=audio_bytes, **sdk_kwargs))
-                        else:
-                            resp = transcribe_file_fn(request=audio_bytes, **sdk_kwargs)
+                        with span("stt.attempt", method="listen.v1.media.transcribe_file", bytes=len(audio_bytes)):
+                            if self._is_coroutine_callable(transcribe_file_fn):
+                                resp = self._maybe_await(transcribe_file_fn(request=audio_bytes, **sdk_kwargs))
+                            else:
+                                resp = transcribe_file_fn(request=audio_bytes, **sdk_kwargs)
                     except Exception as e:
-                        print("WARN: transcribe_file call raised:", e)
+                        logger.warning("transcribe_file call raised: %s", e)
                         resp = None
 
                     if resp is not None:
@@ -182,7 +195,7 @@ class DeepgramSTTService:
         except ValueError:
             raise
         except Exception as e:
-            print("WARN: preferred listen.v1.media.transcribe_file failed:", e)
+            logger.warning("preferred listen.v1.media.transcribe_file failed: %s", e)
 
         # 2) Fallback: transcription.prerecorded (older SDK shape)
         try:
@@ -190,10 +203,11 @@ class DeepgramSTTService:
             if transcription is not None:
                 prerec = getattr(transcription, "prerecorded", None)
                 if prerec:
-                    try:
-                        resp = prerec({"buffer": audio_bytes, "mimetype": mimetype}, sdk_kwargs)
-                    except TypeError:
-                        resp = prerec(request=audio_bytes, **sdk_kwargs) if self._is_coroutine_callable(prerec) else prerec(request=audio_bytes, **sdk_kwargs)
+                    with span("stt.attempt", method="transcription.prerecorded", bytes=len(audio_bytes)):
+                        try:
+                            resp = prerec({"buffer": audio_bytes, "mimetype": mimetype}, sdk_kwargs)
+                        except TypeError:
+                            resp = prerec(request=audio_bytes, **sdk_kwargs) if self._is_coroutine_callable(prerec) else prerec(request=audio_bytes, **sdk_kwargs)
                     parsed = self._extract_transcript_from_response(resp)
                     if parsed.get("text"):
                         return {"text": parsed.get("text"), "confidence": parsed.get("confidence"), "language": language}
@@ -202,19 +216,20 @@ class DeepgramSTTService:
         except ValueError:
             raise
         except Exception as e:
-            print("WARN: transcription.prerecorded failed:", e)
+            logger.warning("transcription.prerecorded failed: %s", e)
 
         # 3) Fallback: top-level transcribe (if exists)
         try:
             transcribe_top = getattr(self.client, "transcribe", None)
             if transcribe_top:
                 try:
-                    if self._is_coroutine_callable(transcribe_top):
-                        resp = self._maybe_await(transcribe_top(request=audio_bytes, **sdk_kwargs))
-                    else:
-                        resp = transcribe_top(request=audio_bytes, **sdk_kwargs)
+                    with span("stt.attempt", method="transcribe", bytes=len(audio_bytes)):
+                        if self._is_coroutine_callable(transcribe_top):
+                            resp = self._maybe_await(transcribe_top(request=audio_bytes, **sdk_kwargs))
+                        else:
+                            resp = transcribe_top(request=audio_bytes, **sdk_kwargs)
                 except Exception as e:
-                    print("WARN: transcribe_top call raised:", e)
+                    logger.warning("transcribe_top call raised: %s", e)
                     resp = None
 
                 if resp is not None:
@@ -226,7 +241,7 @@ class DeepgramSTTService:
         except ValueError:
             raise
         except Exception as e:
-            print("WARN: top-level transcribe failed:", e)
+            logger.warning("top-level transcribe failed: %s", e)
 
         # 4) Final fallback: HTTP request to Deepgram REST API (/v1/listen)
         if requests is None:
@@ -247,9 +262,11 @@ class DeepgramSTTService:
                 "punctuate": "true" if sdk_kwargs.get("punctuate") else "false",
                 "smart_format": "true" if sdk_kwargs.get("smart_format") else "false",
             }
-            resp = requests.post(url, params=params, headers=headers, data=audio_bytes, timeout=60)
+            with span("stt.attempt", method="http", bytes=len(audio_bytes)) as attempt:
+                resp = requests.post(url, params=params, headers=headers, data=audio_bytes, timeout=60)
+                attempt.set(status_code=resp.status_code)
             if resp.status_code != 200:
-                print("WARN: Deepgram HTTP fallback returned non-200:", resp.status_code, resp.text[:300])
+                logger.warning("Deepgram HTTP fallback returned non-200: %s %s", resp.status_code, resp.text[:300])
                 raise RuntimeError(f"Deepgram HTTP error {resp.status_code}: {resp.text}")
             data = resp.json()
             parsed = self._extract_transcript_from_response(data)
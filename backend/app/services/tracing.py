@@ -0,0 +1,279 @@
+# app/services/tracing.py
+"""
+Tracing nhẹ cho pipeline voice (STT -> LLM -> TTS).
+
+- Request id nằm trong contextvars: TracingMiddleware lấy từ header
+  X-Request-ID (hoặc sinh mới), trả lại trong response header
+- span(name, **attrs): context manager lồng nhau, tự gắn parent;
+  dùng được trong code sync, async và asyncio.to_thread (context được copy)
+- Span kết thúc được đẩy vào queue; thread exporter ghi theo batch:
+    TRACE_EXPORTER=file  -> JSON lines vào TRACE_FILE
+    TRACE_EXPORTER=http  -> POST JSON array tới TRACE_COLLECTOR_URL
+    TRACE_EXPORTER=none  -> tắt (mặc định), span() gần như không tốn gì
+- TRACE_SAMPLE_RATE: tỉ lệ request được trace (quyết định ở span gốc)
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", 10000))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", 200))
+TRACE_FLUSH_SECONDS = float(os.getenv("TRACE_FLUSH_SECONDS", 2.0))
+
+REQUEST_ID_HEADER = "x-request-id"
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_sampled: contextvars.ContextVar[bool] = contextvars.ContextVar("trace_sampled", default=False)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "_t0", "duration_ms", "attrs", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.attrs = attrs
+        self.status = "ok"
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        self.duration_ms = round((time.perf_counter() - self._t0) * 1000, 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class _NoopSpan:
+    """Trả về khi tracing tắt / request không được sample."""
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+# ---------------------------------------------------------------------- #
+# Exporter
+# ---------------------------------------------------------------------- #
+class SpanExporter:
+    """Thread nền gom span theo batch rồi ghi file / POST collector."""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self.exported = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind in ("file", "http")
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, span: Span):
+        try:
+            self._queue.put_nowait(span.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch: List[Dict[str, Any]] = []
+            deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+            stop = False
+            while len(batch) < TRACE_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._export(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    logger.warning("Trace export failed: %s", e)
+            if stop:
+                return
+
+    def _export(self, batch: List[Dict[str, Any]]):
+        if self.kind == "file":
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(item, ensure_ascii=False, default=str) + "\n" for item in batch))
+        elif self.kind == "http":
+            req = urllib.request.Request(
+                TRACE_COLLECTOR_URL,
+                data=json.dumps(batch, default=str).encode("utf-8"),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with urllib.request.urlopen(req, timeout=5) as resp:
+                resp.read()
+
+    def stats(self) -> Dict[str, int]:
+        return {"queue_depth": self._queue.qsize(), "exported": self.exported, "dropped": self.dropped}
+
+
+# Module-level singleton
+exporter = SpanExporter(TRACE_EXPORTER)
+
+
+# ---------------------------------------------------------------------- #
+# API
+# ---------------------------------------------------------------------- #
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Mở 1 span con của span hiện tại. Exception được ghi vào span rồi raise tiếp.
+
+        with span("llm.chat", model=model) as s:
+            ...
+            s.set(tokens=usage.total_tokens)
+    """
+    if not exporter.enabled:
+        yield _NOOP
+        return
+
+    parent = _current_span.get()
+    # Span gốc ngoài request (startup, job nền): tự sinh trace id + quyết định
+    # sample, reset lại khi span kết thúc để không rò sang code chạy sau
+    root_tokens = None
+    if parent is None and _request_id.get() is None:
+        root_tokens = (
+            _request_id.set(new_request_id()),
+            _sampled.set(random.random() < TRACE_SAMPLE_RATE),
+        )
+    try:
+        if not _sampled.get():
+            yield _NOOP
+            return
+
+        s = Span(name, _request_id.get(), parent.span_id if parent else None, attrs)
+        token = _current_span.set(s)
+        try:
+            yield s
+        except BaseException as e:
+            s.status = "error"
+            s.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            s.finish()
+            exporter.submit(s)
+    finally:
+        if root_tokens is not None:
+            _request_id.reset(root_tokens[0])
+            _sampled.reset(root_tokens[1])
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware: gán request id + span gốc cho mỗi HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for key, value in scope.get("headers", []):
+            if key == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or new_request_id()
+
+        rid_token = _request_id.set(request_id)
+        sampled_token = _sampled.set(random.random() < TRACE_SAMPLE_RATE)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+                if root is not _NOOP:
+                    root.set(status_code=message["status"])
+            await send(message)
+
+        try:
+            with span("http.request", method=scope.get("method"), path=scope.get("path")) as root:
+                await self.app(scope, receive, send_wrapper)
+                route = scope.get("route")
+                if getattr(route, "path", None):
+                    root.set(route=route.path)
+        finally:
+            _request_id.reset(rid_token)
+            _sampled.reset(sampled_token)
+
+
+class RequestIdLogFilter(logging.Filter):
+    """Gắn request_id vào log record (nếu đang trong request)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = _request_id.get()
+        if request_id is not None and not hasattr(record, "request_id"):
+            record.request_id = request_id
+        return True
@@ -3,12 +3,16 @@ from gtts import gTTS
 from pathlib import Path
 import uuid
 
+from app.services.metrics import stage_timer
+from app.services.tracing import span
+
 BASE_DIR = Path(__file__).parent.parent
 TTS_FOLDER = BASE_DIR / "temp_tts"
 TTS_FOLDER.mkdir(exist_ok=True)
 
 def text_to_speech(text: str, lang: str = "en") -> str:
     filename = TTS_FOLDER / f"{uuid.uuid4()}.mp3"
-    tts = gTTS(text=text, lang=lang)
-    tts.save(str(filename))
+    with stage_timer("tts"), span("tts.gtts", lang=lang, chars=len(text)):
+        tts = gTTS(text=text, lang=lang)
+        tts.save(str(filename))
     return f"/temp_tts/{filename.name}"
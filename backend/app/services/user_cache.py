@@ -0,0 +1,73 @@
+# app/services/user_cache.py
+"""
+Cache user record ngắn hạn (TTL + LRU) cho auth fast path.
+
+JWT đã mang user_id/email/username; cache chỉ cần giữ trạng thái
+is_active để kiểm tra thu hồi mà không query `users` mỗi request.
+Khi đổi trạng thái user phải gọi invalidate_user() (set_user_active
+trong auth_service đã làm việc này).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", 60))
+
+
+class TTLCache:
+    """OrderedDict LRU có hạn dùng cho từng entry. Thread-safe."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expires_at, value = item
+            if expires_at < now:
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self._ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+# Module-level singleton
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+
+
+def invalidate_user(user_id: str):
+    """Hook: gọi khi user bị khóa / đổi thông tin để token cũ bị kiểm tra lại ngay."""
+    user_cache.invalidate(user_id)
@@ -1,163 +1,362 @@
-# # summarize_lessons_simple.py
-# """
-# Script đơn giản: Thêm field 'short_story' vào collection 'lessons' hiện tại
-
-# Chạy: python summarize_lessons_simple.py
-# """
-
-# import os
-# from dotenv import load_dotenv
-# from pymongo import MongoClient
-# from groq import Groq
-# import time
-
-# load_dotenv()
-
-# # Config
-# MONGO_URI = os.getenv("MONGO_URI")
-# DATABASE_NAME = os.getenv("DATABASE_NAME")
-# GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-# GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
-
-# if not all([MONGO_URI, DATABASE_NAME, GROQ_API_KEY]):
-#     raise ValueError("❌ Missing config in .env")
-
-# # Connect
-# print("🔌 Connecting...")
-# mongo_client = MongoClient(MONGO_URI)
-# db = mongo_client[DATABASE_NAME]
-# groq_client = Groq(api_key=GROQ_API_KEY)
-# print("✅ Connected!\n")
-
-
-# def summarize_story(story: str, questions: list) -> str:
-#     """Gọi Groq để rút gọn story"""
-    
-#     # Format questions
-#     q_text = ""
-#     for idx, q in enumerate(questions, 1):
-#         q_text += f"\n{idx}. {q.get('question')}\n"
-#         for i, choice in enumerate(q.get('choices', [])):
-#             q_text += f"   {chr(65+i)}. {choice}\n"
-    
-#     prompt = f"""Summarize this story in 40-60% of original length. Keep ONLY information needed to answer these questions:
-
-# STORY:
-# {story}
-
-# QUESTIONS:
-# {q_text}
-
-# Write a concise summary:"""
-    
-#     response = groq_client.chat.completions.create(
-#         model=GROQ_MODEL,
-#         messages=[
-#             {"role": "system", "content": "You summarize stories concisely."},
-#             {"role": "user", "content": prompt}
-#         ],
-#         temperature=0.3,
-#         max_tokens=1000,
-#     )
-    
-#     return response.choices[0].message.content.strip()
-
-
-# def main():
-#     print("="*60)
-#     print("📚 ADD SHORT_STORY TO LESSONS")
-#     print("="*60)
-    
-#     # Get lessons without short_story
-#     query = {"short_story": {"$exists": False}}
-#     lessons = list(db["lessons"].find(query))
-    
-#     print(f"\n✅ Found {len(lessons)} lessons to process")
-    
-#     if len(lessons) == 0:
-#         print("   All lessons already have short_story!")
-#         mongo_client.close()
-#         return
-    
-#     # Show samples
-#     print("\n📝 Sample:")
-#     for lesson in lessons[:3]:
-#         print(f"   - {lesson.get('id')}")
-    
-#     # Confirm
-#     response = input(f"\nProcess {len(lessons)} lessons? (y/n): ")
-#     if response.lower() != 'y':
-#         print("❌ Cancelled")
-#         mongo_client.close()
-#         return
-    
-#     # Option to limit
-#     limit = input("Process only first N? (Enter for all): ").strip()
-#     if limit.isdigit():
-#         lessons = lessons[:int(limit)]
-    
-#     # Process
-#     print(f"\n🚀 Processing {len(lessons)} lessons...\n")
-    
-#     success = 0
-#     failed = 0
-    
-#     for idx, lesson in enumerate(lessons, 1):
-#         lesson_id = lesson.get('id', 'unknown')
-#         story = lesson.get('story', '')
-#         questions = lesson.get('questions', [])
-        
-#         print(f"[{idx}/{len(lessons)}] {lesson_id}")
-        
-#         if not story or not questions:
-#             print(f"   ⚠️  Missing story/questions, skipping")
-#             failed += 1
-#             continue
-        
-#         try:
-#             # Summarize
-#             print(f"   🤖 Summarizing... ", end='', flush=True)
-#             short_story = summarize_story(story, questions)
-            
-#             # Calculate reduction
-#             reduction = round(100 - (len(short_story)/len(story)*100), 1)
-#             print(f"{len(story)} → {len(short_story)} chars ({reduction}%)")
-            
-#             # Update MongoDB: thêm field short_story
-#             db["lessons"].update_one(
-#                 {"_id": lesson["_id"]},
-#                 {"$set": {"short_story": short_story}}
-#             )
-            
-#             success += 1
-            
-#             # Rate limit
-#             if idx < len(lessons):
-#                 time.sleep(1)
-            
-#         except Exception as e:
-#             print(f"   ❌ Error: {e}")
-#             failed += 1
-    
-#     # Summary
-#     print(f"\n{'='*60}")
-#     print(f"📊 DONE!")
-#     print(f"{'='*60}")
-#     print(f"✅ Success: {success}")
-#     print(f"❌ Failed: {failed}")
-#     print(f"{'='*60}\n")
-    
-#     mongo_client.close()
-
-
-# if __name__ == "__main__":
-#     try:
-#         main()
-#     except KeyboardInterrupt:
-#         print("\n⚠️  Cancelled")
-#         mongo_client.close()
-#     except Exception as e:
-#         print(f"\n❌ Error: {e}")
-#         import traceback
-#         traceback.print_exc()
-#         mongo_client.close()
\ No newline at end of file
+# app/summarize_lessons_simple.py
+"""
+Batch job: thêm field 'short_story' cho các lesson chưa có (gọi Groq để rút gọn story)
+
+- Async: nhiều request Groq chạy song song (giới hạn bằng semaphore)
+- Token bucket cho cả requests/phút và tokens/phút theo quota Groq
+- Retry với backoff khi gặp rate limit / lỗi tạm thời
+- Checkpoint JSONL: mỗi summary thành công được ghi ngay ra file, lần chạy sau
+  ghi lại các summary chưa kịp vào DB (không gọi LLM lại), lesson lỗi được bỏ qua
+  trừ khi có --retry-failed
+- Ghi MongoDB theo batch bằng bulk_write
+- Không hỏi tương tác: cấu hình qua flags / env
+
+Chạy: python app/summarize_lessons_simple.py [--limit N] [--concurrency 4] [--rpm 30] [--tpm 6000] [--dry-run]
+"""
+import sys
+import os
+import json
+import time
+import hashlib
+import random
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dotenv import load_dotenv
+from groq import AsyncGroq
+import groq
+from pymongo import UpdateOne
+
+from app.db import init_async_db, close_async_db, get_async_db
+
+load_dotenv()
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+# Quota mặc định theo gói Groq đang dùng; chỉnh qua env hoặc flags
+GROQ_RPM = int(os.getenv("GROQ_RPM", 30))
+GROQ_TPM = int(os.getenv("GROQ_TPM", 6000))
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_CHECKPOINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".summarize_checkpoint.jsonl")
+MAX_TOKENS = 1000
+MAX_RETRIES = 4
+
+
+class TokenBucket:
+    """Token bucket async: capacity token, nạp lại đều trong 60s."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # Request lớn hơn capacity vẫn được chạy khi bucket đầy
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def adjust(self, delta: float):
+        """Bù trừ sau khi biết số token thực tế (delta > 0: dùng nhiều hơn ước tính)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+def build_prompt(story: str, questions: list) -> str:
+    q_text = ""
+    for idx, q in enumerate(questions, 1):
+        q_text += f"\n{idx}. {q.get('question')}\n"
+        for i, choice in enumerate(q.get('choices', [])):
+            q_text += f"   {chr(65+i)}. {choice}\n"
+
+    return f"""Summarize this story in 40-60% of original length. Keep ONLY information needed to answer these questions:
+
+STORY:
+{story}
+
+QUESTIONS:
+{q_text}
+
+Write a concise summary:"""
+
+
+def story_hash(story: str) -> str:
+    return hashlib.sha1(story.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 ký tự / token cho tiếng Anh + phần trả lời tối đa
+    return len(text) // 4 + MAX_TOKENS
+
+
+class Checkpoint:
+    """
+    File JSONL: {"id", "story_hash", "short_story"} khi thành công, {"id", "error"} khi lỗi.
+    story_hash để không ghi summary cũ lên story đã bị importer thay đổi.
+    read_only (dry-run): chỉ đọc, không ghi entry mới -> lần chạy thật sau
+    không replay summary chưa từng được ghi.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self.path = path
+        self.done = {}
+        self.failed = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # dòng cuối bị cắt dở khi crash
+                    if "short_story" in entry:
+                        self.done[entry["id"]] = (entry.get("story_hash"), entry["short_story"])
+                        self.failed.pop(entry["id"], None)
+                    elif "error" in entry:
+                        self.failed[entry["id"]] = entry["error"]
+        self._file = None if read_only else open(path, "a", encoding="utf-8")
+
+    def record(self, entry: dict):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class Summarizer:
+    def __init__(self, db, client, args):
+        self.lessons = db["lessons"]
+        self.client = client
+        self.args = args
+        self.requests_bucket = TokenBucket(args.rpm)
+        self.tokens_bucket = TokenBucket(args.tpm)
+        self.semaphore = asyncio.Semaphore(args.concurrency)
+        self.checkpoint = Checkpoint(args.checkpoint, read_only=args.dry_run)
+        self.pending = []
+        self.write_lock = asyncio.Lock()
+        self.stats = {"success": 0, "failed": 0, "skipped": 0, "written": 0}
+        self.started = time.perf_counter()
+
+    async def summarize(self, story: str, questions: list) -> str:
+        prompt = build_prompt(story, questions)
+        estimated = estimate_tokens(prompt)
+
+        for attempt in range(MAX_RETRIES + 1):
+            await self.requests_bucket.acquire(1)
+            await self.tokens_bucket.acquire(estimated)
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.args.model,
+                    messages=[
+                        {"role": "system", "content": "You summarize stories concisely."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    temperature=0.3,
+                    max_tokens=MAX_TOKENS,
+                )
+            except (groq.RateLimitError, groq.APIConnectionError, groq.InternalServerError) as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                retry_after = _retry_after(e)
+                delay = retry_after if retry_after is not None else min(60, 2 ** attempt) + random.random()
+                print(f"   ⏳ {type(e).__name__}, retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None):
+                self.tokens_bucket.adjust(usage.total_tokens - estimated)
+            return response.choices[0].message.content.strip()
+
+    async def process(self, lesson: dict):
+        lesson_id = lesson.get("id", "unknown")
+        story = lesson.get("story", "")
+        questions = lesson.get("questions", [])
+
+        if not story or not questions:
+            print(f"   ⚠️  {lesson_id}: missing story/questions, skipping")
+            self.stats["skipped"] += 1
+            return
+
+        async with self.semaphore:
+            try:
+                short_story = await self.summarize(story, questions)
+            except Exception as e:
+                print(f"   ❌ {lesson_id}: {type(e).__name__}: {e}")
+                self.checkpoint.record({"id": lesson_id, "error": f"{type(e).__name__}: {e}"})
+                self.stats["failed"] += 1
+                return
+
+        self.checkpoint.record({"id": lesson_id, "story_hash": story_hash(story), "short_story": short_story})
+        self.stats["success"] += 1
+        reduction = round(100 - (len(short_story) / len(story) * 100), 1)
+        elapsed = time.perf_counter() - self.started
+        print(f"[{self.stats['success']}] {lesson_id}: {len(story)} → {len(short_story)} chars ({reduction}%) "
+              f"| {self.stats['success'] / elapsed * 60:.1f}/min")
+        await self.queue_write(lesson_id, story, short_story)
+
+    async def queue_write(self, lesson_id: str, story: str, short_story: str):
+        self.pending.append((lesson_id, story, short_story))
+        if len(self.pending) >= self.args.batch_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self.write_lock:
+            if not self.pending:
+                return
+            batch, self.pending = self.pending, []
+            if self.args.dry_run:
+                self.stats["written"] += len(batch)
+                return
+            # Chỉ ghi nếu lesson chưa có short_story VÀ story vẫn là bản đã tóm tắt:
+            # importer đổi story thì $unset short_story, nên riêng $exists không đủ
+            ops = [
+                UpdateOne(
+                    {"id": lesson_id, "short_story": {"$exists": False}, "story": story},
+                    {"$set": {"short_story": short_story}}
+                )
+                for lesson_id, story, short_story in batch
+            ]
+            result = await self.lessons.bulk_write(ops, ordered=False)
+            self.stats["written"] += result.modified_count
+            print(f"   💾 Saved {result.modified_count}/{len(batch)} summaries")
+
+    async def replay_checkpoint(self):
+        """Ghi các summary đã có trong checkpoint nhưng chưa vào DB (story không đổi)"""
+        if not self.checkpoint.done or self.args.dry_run:
+            return
+        replayed = 0
+        cursor = self.lessons.find(
+            {"id": {"$in": list(self.checkpoint.done)}, "short_story": {"$exists": False}},
+            {"_id": 0, "id": 1, "story": 1},
+        )
+        async for lesson in cursor:
+            saved_hash, short_story = self.checkpoint.done[lesson["id"]]
+            if saved_hash != story_hash(lesson.get("story", "")):
+                continue  # story đã đổi -> tóm tắt lại
+            self.pending.append((lesson["id"], lesson["story"], short_story))
+            replayed += 1
+            if len(self.pending) >= self.args.batch_size:
+                await self.flush()
+        await self.flush()
+        if replayed:
+            print(f"♻️  Replayed {replayed} summaries from checkpoint")
+
+    async def run(self):
+        await self.replay_checkpoint()
+
+        skip_ids = set() if self.args.retry_failed else set(self.checkpoint.failed)
+
+        query = {"short_story": {"$exists": False}}
+        if skip_ids:
+            query["id"] = {"$nin": list(skip_ids)}
+        total = await self.lessons.count_documents(query)
+        if self.args.limit:
+            total = min(total, self.args.limit)
+        print(f"\n✅ Found {total} lessons to process"
+              f" (rpm={self.args.rpm}, tpm={self.args.tpm}, concurrency={self.args.concurrency})\n")
+        if total == 0:
+            return
+
+        cursor = self.lessons.find(query, {"_id": 0, "id": 1, "story": 1, "questions": 1}).sort("id", 1)
+        if self.args.limit:
+            cursor = cursor.limit(self.args.limit)
+
+        # Giữ số task đang chờ có giới hạn: không nạp mọi lesson vào memory
+        in_flight = set()
+        async for lesson in cursor:
+            in_flight.add(asyncio.create_task(self.process(lesson)))
+            if len(in_flight) >= self.args.concurrency * 2:
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task.result()  # lỗi ghi DB -> dừng job
+        if in_flight:
+            for task in asyncio.as_completed(in_flight):
+                await task
+        await self.flush()
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def main(args):
+    print("=" * 60)
+    print("📚 ADD SHORT_STORY TO LESSONS")
+    print("=" * 60)
+
+    if not GROQ_API_KEY:
+        print("❌ Missing GROQ_API_KEY in .env")
+        return 1
+
+    print("🔌 Connecting...")
+    await init_async_db()
+    client = AsyncGroq(api_key=GROQ_API_KEY)
+    summarizer = Summarizer(get_async_db(), client, args)
+
+    try:
+        await summarizer.run()
+    finally:
+        try:
+            await summarizer.flush()
+        finally:
+            summarizer.checkpoint.close()
+            close_async_db()
+
+    stats = summarizer.stats
+    elapsed = time.perf_counter() - summarizer.started
+    print(f"\n{'='*60}")
+    print(f"📊 DONE in {elapsed:.1f}s{' (dry-run)' if args.dry_run else ''}")
+    print(f"{'='*60}")
+    print(f"✅ Success: {stats['success']}")
+    print(f"💾 Written: {stats['written']}")
+    print(f"⚠️  Skipped: {stats['skipped']}")
+    print(f"❌ Failed: {stats['failed']}")
+    print(f"{'='*60}\n")
+    return 0 if stats["failed"] == 0 else 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sinh short_story cho lessons bằng Groq (async, rate-limited, resumable)")
+    parser.add_argument("--limit", type=int, default=0, help="Chỉ xử lý N lesson đầu (0 = tất cả)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Số request Groq song song")
+    parser.add_argument("--rpm", type=int, default=GROQ_RPM, help="Giới hạn requests/phút")
+    parser.add_argument("--tpm", type=int, default=GROQ_TPM, help="Giới hạn tokens/phút")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Số summary mỗi bulk_write")
+    parser.add_argument("--model", default=GROQ_MODEL, help="Groq model")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="File checkpoint JSONL")
+    parser.add_argument("--retry-failed", action="store_true", help="Chạy lại các lesson lỗi trong checkpoint")
+    parser.add_argument("--dry-run", action="store_true", help="Gọi LLM nhưng không ghi database")
+    args = parser.parse_args()
+    args.concurrency = max(1, args.concurrency)
+    args.batch_size = max(1, args.batch_size)
+
+    try:
+        sys.exit(asyncio.run(main(args)))
+    except KeyboardInterrupt:
+        print("\n⚠️  Cancelled (đã lưu checkpoint, chạy lại để tiếp tục)")
+        sys.exit(130)
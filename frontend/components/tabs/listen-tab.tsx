@@ -106,17 +106,30 @@ export default function ListenTab() {
   useEffect(() => {
     const fetchLessons = async () => {
       try {
-        const res = await fetch("http://localhost:8000/api/lessons")
+        // Backend trả về từng trang (keyset pagination), đi theo next_cursor
+        const allLessons: Lesson[] = []
+        let cursor: string | null = null
 
-        if (!res.ok) {
-          throw new Error("Không thể tải danh sách lesson")
-        }
+        do {
+          const url = new URL("http://localhost:8000/api/lessons")
+          url.searchParams.set("limit", "200")
+          if (cursor) url.searchParams.set("cursor", cursor)
+
+          const res = await fetch(url.toString())
+
+          if (!res.ok) {
+            throw new Error("Không thể tải danh sách lesson")
+          }
+
+          const data = await res.json()
+          allLessons.push(...data.lessons)
+          cursor = data.next_cursor
+        } while (cursor)
 
-        const data = await res.json()
-        console.log('📚 Fetched lessons:', data.lessons)
+        console.log('📚 Fetched lessons:', allLessons)
         
-        setLessons(data.lessons)
-        setStats(prev => ({ ...prev, totalLessons: data.lessons.length }))
+        setLessons(allLessons)
+        setStats(prev => ({ ...prev, totalLessons: allLessons.length }))
       } catch (err) {
         console.error(err)
         setError("Không thể tải bài học")